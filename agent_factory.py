@@ -1,7 +1,19 @@
 # agent_factory.py
+# The openai SDK and httpx are imported on first use (building a client, a request timeout, an error
+# check), not with this module: together they were most of an app or CLI cold start (bench-import.py).
+import base64
+import contextlib
+import hashlib
+import json
 import os
-from langchain.schema import HumanMessage, AIMessage
-from openai import OpenAI
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from metrics import count, logger, observe, record_usage, span
+from resilience import FIRST_TURN_LATENCY, acall_with_retries, ahedged, call_with_retries, hedge_delay, hedged
 
 SYSTEM_PROMPT = """
 You are a careful assistant that answers questions strictly from the uploaded **electricity bill PDFs/images**.
@@ -20,70 +32,672 @@ If the first user question is "What is the reading on the meter?" reply concisel
 
 SUBSEQUENT TURNS
 After the first turn, just answer normally while referencing the pdf for any information.
-Files provided:
-{context}
+The files for this conversation are listed in the user message that carries them.
 """.strip()
 
+MODEL = "gpt-4.1"
+
+
+def _parse_routes(spec, cast, name):
+    # "intent=value,..."; malformed items are logged and skipped rather than failing the import
+    routes = {}
+    for item in (spec or "").split(","):
+        intent, sep, value = item.partition("=")
+        try:
+            if not (sep and intent.strip() and value.strip()):
+                raise ValueError("expected intent=value")
+            routes[intent.strip()] = cast(value.strip())
+        except ValueError as e:
+            if item.strip():
+                logger.warning("%s: ignoring %r (%s)", name, item.strip(), e)
+    return routes
+
+
+# Model and output budget (max_output_tokens) per kind of turn; a turn without an intent uses MODEL
+# with no budget. "meter": first turn on the ROI image, "text": follow-up from extracted bill text,
+# "file": follow-up that needs the PDF, "compare": several bills from their index (bill_compare.py).
+# Override with e.g. AGENT_MODELS="text=gpt-4.1,compare=gpt-4.1" and AGENT_MAX_OUTPUT_TOKENS="file=1200";
+# a budget of 0 means none. Switching models mid-conversation is fine for chaining but each model has
+# its own prompt cache.
+INTENT_MODELS = {"meter": MODEL, "text": "gpt-4.1-mini", "file": MODEL, "compare": "gpt-4.1-mini",
+                 **_parse_routes(os.environ.get("AGENT_MODELS"), str, "AGENT_MODELS")}
+INTENT_MAX_OUTPUT_TOKENS = {"meter": 200, "text": 400, "file": 800, "compare": 800,
+                            **_parse_routes(os.environ.get("AGENT_MAX_OUTPUT_TOKENS"), int,
+                                           "AGENT_MAX_OUTPUT_TOKENS")}
+
+
+def route_model(intent):
+    """(model, max_output_tokens or None) for a turn's intent."""
+    if intent is None:
+        return MODEL, None
+    return INTENT_MODELS.get(intent, MODEL), INTENT_MAX_OUTPUT_TOKENS.get(intent) or None
+
+# First-turn question the app (and batch-bills.py) asks about the ROI
+INITIAL_QUESTION = "What is the reading on the meter? Focus on the decimal point."
+
+
+def parse_meter_reading(answer):
+    """Pull <reading> out of a first-turn "the electricity meter reads: <reading>" answer (or None)."""
+    m = re.search(r"meter reads:\s*([0-9]+(?:\.[0-9]+)?)", answer or "", flags=re.IGNORECASE)
+    return m.group(1) if m else None
+
+
+class Message:
+    """A chat turn as the agent takes and returns it: .content, with the role given by the class."""
+    __slots__ = ("content",)
+    role = None
+
+    def __init__(self, content=""):
+        self.content = content
+
+    def __repr__(self):
+        return f"{type(self).__name__}(content={self.content!r})"
+
+
+class HumanMessage(Message):
+    __slots__ = ()
+    role = "user"
+
+
+class AIMessage(Message):
+    __slots__ = ()
+    role = "assistant"
+
+
+# Connection pool / timeout knobs for the shared client (seconds, connections)
+OPENAI_TIMEOUT = float(os.environ.get("OPENAI_TIMEOUT", "120"))
+OPENAI_CONNECT_TIMEOUT = float(os.environ.get("OPENAI_CONNECT_TIMEOUT", "10"))
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", "32"))
+OPENAI_KEEPALIVE_EXPIRY = float(os.environ.get("OPENAI_KEEPALIVE_EXPIRY", "60"))
+
+
+def _http_options(max_connections):
+    import httpx
+    return {
+        "limits": httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_connections,
+            keepalive_expiry=OPENAI_KEEPALIVE_EXPIRY,
+        ),
+        "timeout": httpx.Timeout(OPENAI_TIMEOUT, connect=OPENAI_CONNECT_TIMEOUT),
+    }
+
+
+def build_client(api_key=None, base_url=None):
+    """Build an OpenAI client on a pooled keep-alive httpx client.
+    Meant to be built once per process (app.py wraps it in st.cache_resource) and shared.
+    The SDK's own retries are off: resilience.call_with_retries owns retries, deadlines and backoff."""
+    import httpx
+    from openai import OpenAI
+    http_client = httpx.Client(**_http_options(OPENAI_MAX_CONNECTIONS))
+    kwargs = {"base_url": base_url} if base_url else {}
+    return OpenAI(api_key=api_key or os.environ.get("OPENAI_API_KEY"), http_client=http_client, max_retries=0,
+                  **kwargs)
+
+
+def build_async_client(api_key=None, base_url=None, max_connections=OPENAI_MAX_CONNECTIONS):
+    """AsyncOpenAI counterpart of build_client for the service layer (bill_service.py). Build it on
+    the event loop that will use it; one per process."""
+    import httpx
+    from openai import AsyncOpenAI
+    http_client = httpx.AsyncClient(**_http_options(max_connections))
+    kwargs = {"base_url": base_url} if base_url else {}
+    return AsyncOpenAI(api_key=api_key or os.environ.get("OPENAI_API_KEY"), http_client=http_client,
+                       max_retries=0, **kwargs)
+
+
+def request_timeout(remaining):
+    """Per-request timeout for an attempt with `remaining` seconds left of the call's deadline."""
+    import httpx
+    return httpx.Timeout(min(remaining, OPENAI_TIMEOUT), connect=min(remaining, OPENAI_CONNECT_TIMEOUT))
+
+
+# How turns are linked: "chain" continues the previous response server-side via previous_response_id;
+# "window" resends the recent history (newest first, up to HISTORY_TOKEN_BUDGET) every turn.
+HISTORY_MODE = os.environ.get("AGENT_HISTORY_MODE", "chain")
+HISTORY_TOKEN_BUDGET = int(os.environ.get("AGENT_HISTORY_TOKENS", "2000"))
+
+# Vision detail for in-memory images (the ROI): "high" keeps small LCD digits legible,
+# "low" is a fixed small token cost, "auto" lets the API decide.
+IMAGE_DETAIL = os.environ.get("AGENT_IMAGE_DETAIL", "high")
+
+
+def estimate_tokens(text):
+    # ~4 characters per token is close enough for budgeting English bill Q&A
+    return len(text or "") // 4 + 4
+
+
+def content_id(kind, data):
+    # Chain bookkeeping id for inline content (extracted text, images), tracked like a file_id
+    return f"{kind}:" + hashlib.sha256(data).hexdigest()[:16]
+
+
+def image_input(data, mime="image/png", detail=IMAGE_DETAIL):
+    """input_image content part carrying the image bytes inline (base64 data URL, no file upload)."""
+    url = f"data:{mime};base64," + base64.b64encode(data).decode("ascii")
+    return {"type": "input_image", "image_url": url, "detail": detail}
+
+
+# Response cache: the same question about the same document gets the same answer, so repeats
+# (the first-turn meter question, "amount payable?", "due date?") skip responses.create.
+# RESPONSE_CACHE is "memory" (per-process LRU), "sqlite" (shared, survives restarts) or "off".
+RESPONSE_CACHE = os.environ.get("RESPONSE_CACHE", "sqlite")
+RESPONSE_CACHE_PATH = os.environ.get("RESPONSE_CACHE_PATH", ".response_cache.sqlite3")
+RESPONSE_CACHE_TTL = float(os.environ.get("RESPONSE_CACHE_TTL", str(7 * 24 * 3600)))
+RESPONSE_CACHE_MAX_ENTRIES = int(os.environ.get("RESPONSE_CACHE_MAX_ENTRIES", "5000"))
+
+# Questions that lean on the conversation so far can't be answered from a cache
+CONTEXT_DEPENDENT = re.compile(
+    r"\b(it|its|that|this|those|these|them|they|above|previous|again|else|same|last one|other)\b"
+)
+SYSTEM_PROMPT_HASH = hashlib.sha256(SYSTEM_PROMPT.encode()).hexdigest()[:16]
+
+# Provider-side prompt caching reuses the longest previously seen prefix of a request (from 1024
+# tokens up). Every stateless request therefore starts with SYSTEM_MESSAGE -- built once, byte for
+# byte the same for every session -- and per-session data comes after it (see _build_input).
+# PROMPT_CACHE_KEY routes requests sharing that prefix to the same cache ("" to leave it unset).
+SYSTEM_MESSAGE = {"role": "system", "content": [{"type": "input_text", "text": SYSTEM_PROMPT}]}
+PROMPT_CACHE_KEY = os.environ.get("AGENT_PROMPT_CACHE_KEY", f"billqa-{SYSTEM_PROMPT_HASH}")
+
+
+def normalize_question(question):
+    return " ".join(re.sub(r"[^a-z0-9.]+", " ", (question or "").lower()).split()).strip(" .")
+
+
+class MemoryResponseStore:
+    """In-process LRU of cache key -> (answer, created)."""
+
+    def __init__(self, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, answer, created):
+        with self._lock:
+            self._entries[key] = (answer, created)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def delete(self, key):
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SQLiteResponseStore:
+    """On-disk store shared by every process using the same file (WAL, like UploadCache)."""
+
+    def __init__(self, path=RESPONSE_CACHE_PATH, max_entries=RESPONSE_CACHE_MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS responses (
+                       key       TEXT PRIMARY KEY,
+                       answer    TEXT NOT NULL,
+                       created   REAL NOT NULL,
+                       last_used REAL NOT NULL
+                   )"""
+            )
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+        finally:
+            conn.close()
+
+    def get(self, key):
+        with self._connect() as conn:
+            row = conn.execute("SELECT answer, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row:
+                conn.execute("UPDATE responses SET last_used = ? WHERE key = ?", (time.time(), key))
+        return tuple(row) if row else None
+
+    def set(self, key, answer, created):
+        with self._connect() as conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO responses (key, answer, created, last_used) VALUES (?, ?, ?, ?)",
+                (key, answer, created, created),
+            )
+            conn.execute(
+                "DELETE FROM responses WHERE key IN (SELECT key FROM responses "
+                "ORDER BY last_used DESC LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+
+    def delete(self, key):
+        with self._connect() as conn:
+            conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+
+    def __len__(self):
+        with self._connect() as conn:
+            return conn.execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+
+class ResponseCache:
+    """TTL + hit/miss accounting over a store (MemoryResponseStore or SQLiteResponseStore)."""
+
+    def __init__(self, store, ttl=RESPONSE_CACHE_TTL):
+        self.store = store
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._counts = {"hits": 0, "misses": 0, "expired": 0, "stores": 0, "skipped": 0}
+
+    def _count(self, name):
+        with self._lock:
+            self._counts[name] += 1
+        count("response_cache", result=name)
+
+    def key(self, doc_key, question, model=MODEL, max_output_tokens=None):
+        """Cache key, or None when the question depends on earlier turns (those are never cached).
+        The output budget is part of it: an answer written under a smaller one may be shorter."""
+        normalized = normalize_question(question)
+        if not normalized or CONTEXT_DEPENDENT.search(normalized):
+            self._count("skipped")
+            return None
+        raw = json.dumps([doc_key, normalized, model, max_output_tokens, SYSTEM_PROMPT_HASH])
+        return hashlib.sha256(raw.encode()).hexdigest()
+
+    def get(self, key):
+        entry = self.store.get(key)
+        if entry is not None and time.time() - entry[1] > self.ttl:
+            self.store.delete(key)
+            self._count("expired")
+            entry = None
+        self._count("hits" if entry is not None else "misses")
+        return entry[0] if entry is not None else None
+
+    def set(self, key, answer):
+        if answer and answer.strip():
+            self.store.set(key, answer, time.time())
+            self._count("stores")
+
+    def stats(self):
+        with self._lock:
+            counts = dict(self._counts)
+        lookups = counts["hits"] + counts["misses"]
+        return {**counts, "hit_rate": counts["hits"] / lookups if lookups else 0.0, "entries": len(self.store)}
+
+
+def build_response_cache(kind=RESPONSE_CACHE, path=RESPONSE_CACHE_PATH, ttl=RESPONSE_CACHE_TTL):
+    """ResponseCache for RESPONSE_CACHE ("memory" / "sqlite"), or None when it's "off"."""
+    if kind == "memory":
+        return ResponseCache(MemoryResponseStore(), ttl=ttl)
+    if kind == "sqlite":
+        return ResponseCache(SQLiteResponseStore(path), ttl=ttl)
+    return None
+
+
+def history_window(messages, budget):
+    """Most recent (human/AI) messages that fit in `budget` tokens, oldest first, as Responses input."""
+    window = []
+    for m in reversed(messages):
+        cost = estimate_tokens(m.content)
+        if cost > budget:
+            break
+        budget -= cost
+        window.append({"role": m.role, "content": m.content})
+    return list(reversed(window))
+
+
+class _PeekedStream:
+    """A response stream read up to its first text delta; iterating replays those events first."""
+
+    def __init__(self, stream):
+        self.stream, self.head = stream, []
+        for event in stream:
+            self.head.append(event)
+            if getattr(event, "type", None) in ("response.output_text.delta", "response.completed",
+                                                "response.failed", "error"):
+                break
+
+    def __iter__(self):
+        yield from self.head
+        yield from self.stream
+
+    def close(self):
+        self.stream.close()
+
+
+def chain_broken(error):
+    """Whether a 400/404 is about previous_response_id (not found, expired) rather than the request itself."""
+    code = str(getattr(error, "code", None) or "")
+    return getattr(error, "param", None) == "previous_response_id" or code.startswith("previous_response")
+
+
+def _output_text(resp):
+    # Be tolerant to SDK shape differences
+    output_text = getattr(resp, "output_text", None)
+    if output_text:
+        return output_text
+    try:
+        parts = []
+        for block in getattr(resp, "output", []) or []:
+            for item in getattr(block, "content", []) or []:
+                if getattr(item, "type", None) in ("output_text", "text"):
+                    parts.append(getattr(item, "text", "") or "")
+        return "\n".join([p for p in parts if p]) or ""
+    except Exception:
+        return ""
+
+
+def _close_quietly(resp):
+    # The losing side of a hedge: drop its stream (a plain response needs nothing)
+    with contextlib.suppress(Exception):
+        if hasattr(resp, "close"):
+            resp.close()
 
 
 class OpenAIFilesAgent:
-    def __init__(self, file_ids):
+    def __init__(self, file_ids, client=None, previous_response_id=None, attached_file_ids=(),
+                 history_mode=HISTORY_MODE, history_token_budget=HISTORY_TOKEN_BUDGET, context_text=None,
+                 images=None, image_detail=IMAGE_DETAIL, model=MODEL, cache=None, doc_hash=None, trace=None,
+                 first_turn=False, hedge=False, async_client=None, max_output_tokens=None):
         self.file_ids = file_ids or []
-        self.client = OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+        # Extracted bill text (see bill_fields.compact_context) sent instead of / alongside files
+        self.context_text = context_text
+        # In-memory images as (bytes, mime) pairs, e.g. the meter ROI; sent inline instead of uploaded
+        self.images = list(images or [])
+        self.image_detail = image_detail
+        # Lightweight: bind to the shared client; only build one when used standalone
+        self.client = client or build_client()
+        self.async_client = async_client  # AsyncOpenAI for ainvoke() (see build_async_client)
+        self.history_mode = history_mode
+        self.history_token_budget = history_token_budget
+        # Chain state; callers persist these (e.g. in session_state) between turns
+        self.previous_response_id = previous_response_id if history_mode == "chain" else None
+        self.attached_file_ids = list(attached_file_ids) if self.previous_response_id else []
+        self.response_id = None
+        self.model = model
+        # Output budget for this turn (see route_model); a cut-off answer comes back "incomplete"
+        self.max_output_tokens = max_output_tokens
+        # Response cache (see ResponseCache); doc_hash identifies the bill across re-uploads,
+        # otherwise the file_ids stand in for it
+        self.cache = cache
+        self.doc_hash = doc_hash
+        self.cache_hit = False
+        self._cache_key = None
+        # Timing spans / token usage for this agent's calls (see metrics.py); trace collects them per session
+        self.trace = trace
+        self.usage = None
+        # First turns feed the latency window hedging is timed from (time to first token when
+        # streaming). hedge sends a second request once this one is slower than that p95
+        # (resilience.hedged); only worth the extra cost where latency matters most
+        self.first_turn = first_turn
+        self.hedge_after = hedge_delay() if hedge else None
 
-    def invoke(self, *args, **kwargs):
-        # Get last human question
-        messages = args[0].get("messages", []) if args else []
-        user_question = ""
-        for m in reversed(messages):
-            if isinstance(m, HumanMessage):
-                user_question = m.content
-                break
+    @staticmethod
+    def _split_messages(inputs):
+        # Split the last human question from the earlier history
+        messages = inputs.get("messages", []) if inputs else []
+        for i in range(len(messages) - 1, -1, -1):
+            if isinstance(messages[i], HumanMessage):
+                return messages[i].content, messages[:i]
+        return "", []
+
+    def _cached_answer(self, inputs):
+        """Cached answer for this question and document, or None (also sets the key to store under)."""
+        self._cache_key = None
+        if self.cache is None:
+            return None
+        doc_key = [
+            self.doc_hash or sorted(self.file_ids),
+            [content_id("image", data) for data, _ in self.images],
+            content_id("text", self.context_text.encode()) if self.context_text else None,
+        ]
+        self._cache_key = self.cache.key(doc_key, self._split_messages(inputs)[0], self.model,
+                                         self.max_output_tokens)
+        answer = self.cache.get(self._cache_key) if self._cache_key else None
+        if answer is not None:
+            # Nothing was sent, so a server-side chain wouldn't have this turn: end it here. The next
+            # turn goes stateless, with the files and the history window (which does have it)
+            self.cache_hit = True
+            self.response_id = None
+            self.attached_file_ids = []
+        return answer
+
+    def _build_input(self, inputs):
+        user_question, earlier = self._split_messages(inputs)
+
+        # Continuing a chain: the system prompt and already-attached files are in the server-side
+        # context, so only send files that are new since the last turn (e.g. the full PDF after the ROI)
+        chained = bool(self.previous_response_id)
+        new_file_ids = [fid for fid in self.file_ids if not (chained and fid in self.attached_file_ids)]
+        text_id = None
+        if self.context_text:
+            # Tracked like a file so a chain only carries each extracted text once
+            text_id = content_id("text", self.context_text.encode())
+            if chained and text_id in self.attached_file_ids:
+                text_id = None
+        new_images = []
+        for data, mime in self.images:
+            image_id = content_id("image", data)
+            if not (chained and image_id in self.attached_file_ids):
+                new_images.append((image_id, data, mime))
 
-        # Compose content (files + text question)
-        input_content = [
-            *(
-                [{"type": "input_file", "file_id": fid} for fid in self.file_ids]
-                if self.file_ids else []
-            ),
+        attachments = [
+            *[{"type": "input_file", "file_id": fid} for fid in new_file_ids],
+            *[image_input(data, mime, self.image_detail) for _, data, mime in new_images],
+        ]
+        new_file_ids.extend(image_id for image_id, _, _ in new_images)
+        if text_id:
+            new_file_ids.append(text_id)
+        self.attached_file_ids = (self.attached_file_ids if chained else []) + new_file_ids
+        # Extracted text is picked per question, so it travels with the question, after anything stable
+        question = [
+            *([{"type": "input_text", "text": self.context_text}] if text_id else []),
             {"type": "input_text", "text": user_question},
         ]
+        if chained:
+            return [{"role": "user", "content": attachments + question}]
 
-        # System message MUST use input_text (not text)
-        system_msg = {
-            "role": "system",
-            "content": [
-                {
-                    "type": "input_text",
-                    "text": SYSTEM_PROMPT.format(
-                        context="\n".join([f"- {fid}" for fid in self.file_ids]) or "- (no files listed)"
-                    ),
-                }
-            ],
+        # Stateless: the shared SYSTEM_MESSAGE, then this session's files (same on every turn, so a
+        # cached prefix for the next one), then the history window, then the question. In "chain" mode
+        # that's a first turn (no history) or a chain that ended (cache hit, expired response), so the
+        # window is what carries the conversation
+        manifest = (
+            [f"- {fid}" for fid in self.file_ids]
+            + (["- meter photo (image below)"] if self.images else [])
+            + (["- extracted bill text (with the question)"] if self.context_text else [])
+        )
+        session_msg = {
+            "role": "user",
+            "content": [{"type": "input_text", "text": "Files provided:\n" + ("\n".join(manifest) or "- (none)")},
+                        *attachments],
         }
-        user_msg = {"role": "user", "content": input_content}
+        window = history_window(earlier, self.history_token_budget)
+        return [SYSTEM_MESSAGE, session_msg, *window, {"role": "user", "content": question}]
 
-        resp = self.client.responses.create(
-            model="gpt-4.1",
-            input=[system_msg, user_msg],
-        )
+    def _create(self, inputs, **kwargs):
+        """responses.create with chaining; if the chain can't be continued (the previous response is
+        unknown or expired), fall back to a stateless request with a history window. Any other
+        request error is raised as is."""
+        from openai import BadRequestError, NotFoundError
+        if self.previous_response_id:
+            try:
+                return self._request(
+                    self._build_input(inputs), previous_response_id=self.previous_response_id, **kwargs
+                )
+            except (BadRequestError, NotFoundError) as e:
+                if not chain_broken(e):
+                    raise
+                count("chain_fallback")
+                self.previous_response_id = None
+        return self._request(self._build_input(inputs), **kwargs)
+
+    def _request_options(self):
+        options = {"prompt_cache_key": PROMPT_CACHE_KEY} if PROMPT_CACHE_KEY else {}
+        if self.max_output_tokens:
+            options["max_output_tokens"] = self.max_output_tokens
+        return options
+
+    def _request(self, input_items, **kwargs):
+        """One logical responses.create: retried within its deadline (resilience.call_with_retries)
+        and, for a hedged agent, raced against a second identical request."""
+        def attempt(remaining):
+            return self.client.responses.create(
+                model=self.model, input=input_items, timeout=request_timeout(remaining),
+                **self._request_options(), **kwargs
+            )
 
-        # Be tolerant to SDK shape differences
-        output_text = getattr(resp, "output_text", None)
-        if not output_text:
+        if self.hedge_after is None and not self.first_turn:
+            return call_with_retries(attempt, "responses.create")
+
+        def once():
+            resp = call_with_retries(attempt, "responses.create")
+            # Streams are timed (and raced) to the first text delta, not just to the response headers
+            return _PeekedStream(resp) if kwargs.get("stream") else resp
+
+        t0 = time.perf_counter()
+        resp = once() if self.hedge_after is None else hedged(once, self.hedge_after, discard=_close_quietly)
+        if self.first_turn:
+            FIRST_TURN_LATENCY.add(time.perf_counter() - t0)
+        return resp
+
+    async def _acreate(self, inputs):
+        # _create() on the async client (no streaming: service jobs are polled, not streamed)
+        from openai import BadRequestError, NotFoundError
+        if self.previous_response_id:
             try:
-                parts = []
-                for block in getattr(resp, "output", []) or []:
-                    for item in getattr(block, "content", []) or []:
-                        if getattr(item, "type", None) in ("output_text", "text"):
-                            parts.append(getattr(item, "text", "") or "")
-                output_text = "\n".join([p for p in parts if p]) or ""
-            except Exception:
-                output_text = ""
+                return await self._arequest(self._build_input(inputs), previous_response_id=self.previous_response_id)
+            except (BadRequestError, NotFoundError) as e:
+                if not chain_broken(e):
+                    raise
+                count("chain_fallback")
+                self.previous_response_id = None
+        return await self._arequest(self._build_input(inputs))
+
+    async def _arequest(self, input_items, **kwargs):
+        def attempt(remaining):
+            return self.async_client.responses.create(
+                model=self.model, input=input_items, timeout=request_timeout(remaining),
+                **self._request_options(), **kwargs
+            )
+
+        def once():
+            return acall_with_retries(attempt, "responses.create")
+
+        t0 = time.perf_counter()
+        resp = await (once() if self.hedge_after is None else ahedged(once, self.hedge_after))
+        if self.first_turn:
+            FIRST_TURN_LATENCY.add(time.perf_counter() - t0)
+        return resp
+
+    def invoke(self, *args, **kwargs):
+        inputs = args[0] if args else None
+        cached = self._cached_answer(inputs)
+        if cached is not None:
+            return {"messages": [AIMessage(content=cached)], "response_id": self.response_id}
+
+        with span("responses.create", self.trace, model=self.model, chained=bool(self.previous_response_id)):
+            resp = self._create(inputs)
+        return self._finish(resp)
+
+    async def ainvoke(self, *args, **kwargs):
+        """invoke() on the async client (bill_service.py); the response cache lookup stays blocking."""
+        inputs = args[0] if args else None
+        cached = self._cached_answer(inputs)
+        if cached is not None:
+            return {"messages": [AIMessage(content=cached)], "response_id": self.response_id}
+
+        with span("responses.create", self.trace, model=self.model, chained=bool(self.previous_response_id)):
+            resp = await self._acreate(inputs)
+        return self._finish(resp)
+
+    def _finish(self, resp):
+        self.response_id = getattr(resp, "id", None)
+        self.usage = record_usage(getattr(resp, "usage", None), self.model, self.trace)
+        incomplete = getattr(resp, "status", None) == "incomplete"
+        if incomplete:
+            count("output_truncated", model=self.model)
+        output_text = _output_text(resp)
+        # A cut-off answer is shown once but never cached
+        if self._cache_key and not incomplete:
+            self.cache.set(self._cache_key, output_text)
+        return {"messages": [AIMessage(content=output_text)], "response_id": self.response_id}
+
+    def stream(self, *args, **kwargs):
+        """Like invoke(), but yields text deltas as they arrive (for st.write_stream)."""
+        inputs = args[0] if args else None
+        cached = self._cached_answer(inputs)
+        if cached is not None:
+            yield cached
+            return
 
-        return {"messages": [AIMessage(content=output_text)]}
+        parts, completed = [], False
+        with span("responses.stream", self.trace, model=self.model,
+                  chained=bool(self.previous_response_id)) as timing:
+            t0 = time.perf_counter()
+            events = self._create(inputs, stream=True)
+            for event in events:
+                event_type = getattr(event, "type", None)
+                if event_type == "response.created":
+                    self.response_id = getattr(getattr(event, "response", None), "id", None)
+                elif event_type == "response.output_text.delta":
+                    delta = getattr(event, "delta", "") or ""
+                    if delta:
+                        if not parts:
+                            first = time.perf_counter() - t0
+                            timing["first_token_ms"] = round(first * 1000, 2)
+                            observe("responses.first_token", first)
+                        parts.append(delta)
+                        yield delta
+                elif event_type in ("response.completed", "response.incomplete"):
+                    usage = getattr(getattr(event, "response", None), "usage", None)
+                    self.usage = record_usage(usage, self.model, self.trace)
+                    completed = event_type == "response.completed"
+                    if not completed:
+                        count("output_truncated", model=self.model)
+                elif event_type == "error":
+                    raise RuntimeError(f"Streaming response failed: {getattr(event, 'message', '')}")
+                elif event_type == "response.failed":
+                    error = getattr(getattr(event, "response", None), "error", None)
+                    raise RuntimeError(f"Streaming response failed: {getattr(error, 'message', error)}")
+        if self._cache_key and completed:
+            self.cache.set(self._cache_key, "".join(parts))
 
 
-def create_agent(context):
-    # context is a list of file_ids
-    return OpenAIFilesAgent(context)
+def create_agent(context, client=None, previous_response_id=None, attached_file_ids=(), context_text=None,
+                 images=None, image_detail=IMAGE_DETAIL, cache=None, doc_hash=None, trace=None, first_turn=False,
+                 hedge=False, async_client=None, intent=None):
+    # context is a list of file_ids; client is the shared pooled client (see build_client).
+    # previous_response_id/attached_file_ids carry the conversation chain from the last turn.
+    # context_text replaces the files with extracted bill text when the router allows it.
+    # images are (bytes, mime) pairs sent inline, e.g. the meter ROI on the first turn.
+    # cache (see build_response_cache) answers repeated standalone questions about the same doc_hash.
+    # trace is a list collecting timing spans / token usage (see metrics.py), e.g. per session.
+    # first_turn marks the first-turn call (its latency times hedging); hedge races a second request
+    # once the call runs past the first-turn p95 (see resilience.py).
+    # async_client (see build_async_client) is what ainvoke() calls; invoke()/stream() use client.
+    # intent ("meter", "text", "file", "compare") picks the model and output budget (see route_model).
+    model, max_output_tokens = route_model(intent)
+    return OpenAIFilesAgent(
+        context,
+        client=client,
+        previous_response_id=previous_response_id,
+        attached_file_ids=attached_file_ids,
+        context_text=context_text,
+        images=images,
+        image_detail=image_detail,
+        cache=cache,
+        doc_hash=doc_hash,
+        trace=trace,
+        first_turn=first_turn,
+        hedge=hedge,
+        async_client=async_client,
+        model=model,
+        max_output_tokens=max_output_tokens,
+    )
@@ -1,163 +1,287 @@
 # app.py
 import streamlit as st
 import os
-from langchain.schema import HumanMessage, AIMessage
-from agent_factory import create_agent
-from openai import OpenAI
-from utils import crop_roi_to_pdf
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from agent_factory import INITIAL_QUESTION, build_client, build_response_cache
+from bill_compare import COMPARE_MAX_BILLS, BillSet
+from bill_service import RENDER_PROCESSES, BillService, ServiceBusy, UnknownSession
+from bill_session import BillSession, invoke_agent
+from upload_cache import UploadCache, sha256_bytes
+from metrics import configure_logging, render_prometheus, span, start_metrics_server
+from resilience import describe_error
+from session_manager import SessionManager
 
 st.set_page_config(page_title="Electricity Bill Q&A", page_icon="⚡")
 st.title("⚡ Electricity Bill Q&A")
 st.markdown(
-    "Upload your **electricity bill PDF**."
+    "Upload your **electricity bill PDF** -- or several bills to compare them."
 )
 
 # ---- Session State ----
-if "history" not in st.session_state:
-    st.session_state.history = []
-if "file_ids" not in st.session_state:
-    st.session_state.file_ids = []  # used by agent each turn
-if "initial_query_done" not in st.session_state:
-    st.session_state.initial_query_done = False
-if "roi_file_id" not in st.session_state:
-    st.session_state.roi_file_id = None
-if "full_pdf_path" not in st.session_state:
-    st.session_state.full_pdf_path = None
-if "full_file_id" not in st.session_state:
-    st.session_state.full_file_id = None
+if "bill" not in st.session_state:
+    st.session_state.bill = None  # BillSession for the uploaded bill, BillSet for several (bill_compare.py)
+    st.session_state.bill_id = None  # its session id in the bill service (BILL_SERVICE=1)
+    st.session_state.upload_key = None  # hashes of the files it was built from
 
 # ---- Constants ----
-# Change this ROI to match your meter area (PDF coordinate space: points, origin bottom-left)
-ROI_BBOX = (348, 469, 540, 610)  # (x0, y0, x1, y1)
-INITIAL_QUESTION = "What is the reading on the meter? Focus on the decimal point."
+# ROI placement / DPI / local reader settings live in bill_session.py
+STREAM_RESPONSES = True  # render answers token-by-token instead of after a spinner
+DEBUG_PANEL = os.environ.get("DEBUG_PANEL", "0") == "1"  # stage timings / tokens / caches in the sidebar
+# Run uploads and turns as jobs on the process-wide bill service (bill_service.py) and wait on them,
+# instead of inside this script run; answers then appear whole rather than streamed
+BILL_SERVICE = os.environ.get("BILL_SERVICE", "0") == "1"
 
 # ---- Helpers ----
-def swap_roi_for_full_pdf():
-    """Delete the ROI file from OpenAI and upload the full PDF. Update session_state.file_ids."""
-    if not os.environ.get("OPENAI_API_KEY"):
-        return
-    client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
+@st.cache_resource
+def get_openai_client():
+    # One pooled keep-alive client per process, shared by every session and turn
+    return build_client()
+
+
+@st.cache_resource
+def get_metrics_server():
+    # JSON span logs on stderr; /metrics for Prometheus when METRICS_PORT is set (once per process)
+    configure_logging()
+    return start_metrics_server()
+
+
+get_metrics_server()
+
+
+@st.cache_resource
+def warm_imports():
+    # The openai SDK and OpenCV load lazily so a new pod renders its first page sooner; pull them in on a
+    # background thread (once per process) so the first upload doesn't wait for them either
+    def load():
+        import openai
+        import meter_reader
+    threading.Thread(target=load, daemon=True, name="warm-imports").start()
+
+
+@st.cache_resource
+def get_upload_cache():
+    # Shared by all sessions: SHA-256 of the uploaded bytes -> OpenAI file_id
+    return UploadCache()
+
+
+@st.cache_resource
+def get_response_cache():
+    # Shared by all sessions: (bill, question, model, prompt) -> answer; None when RESPONSE_CACHE=off
+    return build_response_cache()
+
+
+@st.cache_resource
+def get_background_pool():
+    # Shared by all sessions: uploads/deletes that shouldn't block the script thread
+    return ThreadPoolExecutor(max_workers=8, thread_name_prefix="bill-io")
+
+
+@st.cache_resource
+def get_session_manager():
+    # Shared by all sessions: closes idle ones (releasing their uploads) and GCs orphaned remote files
+    return SessionManager(get_openai_client, get_upload_cache(), get_background_pool())
+
+
+@st.cache_resource
+def get_bill_service():
+    # One per process: event loop and bounded job queue shared by all sessions. Renders run on threads:
+    # spawned render processes would re-import this script, which Streamlit runs as __main__
+    render_pool = ThreadPoolExecutor(max_workers=RENDER_PROCESSES, thread_name_prefix="bill-render")
+    return BillService(get_openai_client(), get_upload_cache(), get_response_cache(), render_pool=render_pool).start()
+
+
+def wait_for_job(submit, spinner_text):
+    """Submit a bill-service job and wait for it to finish. Stops the run with a message when the
+    service is busy, the session is gone or the job failed; returns the finished job otherwise."""
+    service = get_bill_service()
+    try:
+        job = submit(service)
+    except ServiceBusy:
+        st.warning("The service is busy right now. Please try again in a moment.")
+        st.stop()
+    except UnknownSession:
+        st.session_state.bill = st.session_state.bill_id = None
+        st.info("This session expired. Please upload the bill again.")
+        st.stop()
+    with st.spinner(spinner_text):
+        job = service.wait(job["id"])
+    if job["status"] == "failed":
+        st.error(job["error"])
+        st.stop()
+    return job
 
-    # Delete ROI file if present
-    if st.session_state.roi_file_id:
-        try:
-            client.files.delete(st.session_state.roi_file_id)
-        except Exception:
-            # Soft-fail; continue even if deletion fails
-            pass
-        finally:
-            st.session_state.roi_file_id = None
-
-    # Upload full PDF and switch context
-    if st.session_state.full_pdf_path and os.path.exists(st.session_state.full_pdf_path):
-        try:
-            with open(st.session_state.full_pdf_path, "rb") as f:
-                full_obj = client.files.create(file=f, purpose="user_data")
-            st.session_state.full_file_id = full_obj.id
-            st.session_state.file_ids = [full_obj.id]
-        except Exception as e:
-            st.error(f"Failed to upload full PDF: {e}")
+
+def run_agent(agent, messages, spinner_text):
+    """Ask the agent and return the final answer text.
+    Streams into an assistant bubble when STREAM_RESPONSES is on; otherwise blocks behind a spinner."""
+    if STREAM_RESPONSES:
+        streamed = st.chat_message("assistant").write_stream(agent.stream({"messages": messages}))
+        return streamed if isinstance(streamed, str) else "".join(map(str, streamed or []))
+
+    with st.spinner(spinner_text):
+        return invoke_agent(agent, messages)
+
+# ---- Session lifetime: close idle sessions process-wide; reload ours if it was closed ----
+# Sessions run by the bill service are reaped and closed on its own loop, never from this thread;
+# this manager has the ones run inline (every bill without BILL_SERVICE, comparisons with it)
+sessions = get_session_manager()
+sessions.reap()
+if st.session_state.bill is not None and st.session_state.bill.closed:
+    # The upload below is processed again (upload/response caches make it cheap)
+    st.session_state.bill = st.session_state.bill_id = None
+    st.info("This session was idle for a while, so the bill was reloaded.")
 
 # ---- File Uploader (PDF only) ----
-uploaded_file = st.file_uploader(
-    "Upload electricity bill PDF", type=["pdf"], accept_multiple_files=False
+uploaded_files = st.file_uploader(
+    "Upload electricity bill PDF(s)", type=["pdf"], accept_multiple_files=True
 )
+uploaded_file = uploaded_files[0] if len(uploaded_files or []) == 1 else None
 
-# ---- On Upload: crop -> upload ROI to OpenAI -> auto-ask initial question -> swap to full PDF ----
-if uploaded_file and not st.session_state.initial_query_done and not st.session_state.file_ids:
+# ---- Files added or swapped since the conversation started: start over with the new set ----
+# (a second bill added after the first was read makes a comparison of both; removing every file
+# keeps the conversation on screen)
+upload_key = frozenset(sha256_bytes(f.getvalue()) for f in uploaded_files or [])
+if upload_key and st.session_state.bill is not None and upload_key != st.session_state.upload_key:
+    if st.session_state.bill_id:
+        get_bill_service().close_session(st.session_state.bill_id)
+    else:
+        sessions.close(st.session_state.bill)
+    st.session_state.bill = st.session_state.bill_id = None
+    st.toast("The uploaded bills changed, so this is a new conversation.")
+
+# ---- On Upload of several bills: index them for comparison (no uploads, no model call yet) ----
+if len(uploaded_files or []) > 1 and st.session_state.bill is None:
     if not os.environ.get("OPENAI_API_KEY"):
         st.error("Missing OPENAI_API_KEY in environment. Please set it and refresh.")
         st.stop()
+    if len(uploaded_files) > COMPARE_MAX_BILLS:
+        st.warning(f"Comparing the first {COMPARE_MAX_BILLS} bills only.")
+    # Runs here even with BILL_SERVICE: indexing is local, and questions go to the model inline
+    bill = BillSet(get_openai_client(), get_upload_cache(), get_background_pool(), get_response_cache())
+    sessions.touch(bill)
+    with st.spinner(f"Reading {min(len(uploaded_files), COMPARE_MAX_BILLS)} bills…"):
+        bill.load([(f.name, f.getvalue()) for f in uploaded_files])
+    st.session_state.bill = bill
+    st.session_state.upload_key = upload_key
+    st.rerun()
 
-    with st.spinner("Processing PDF (cropping ROI)…"):
-        # Save the uploaded PDF to disk
-        local_pdf_path = uploaded_file.name
-        with open(local_pdf_path, "wb") as f:
-            f.write(uploaded_file.read())
-        st.session_state.full_pdf_path = local_pdf_path
-
-        # Crop ROI and save as a new (single-page) PDF for vision
-        roi_pdf_path = f"roi_{uploaded_file.name}.pdf"
-        crop_roi_to_pdf(local_pdf_path, roi_pdf_path, page_number=0, bbox=ROI_BBOX, dpi=500)
-
-        # Upload the cropped ROI-PDF to OpenAI
-        client = OpenAI(api_key=os.environ["OPENAI_API_KEY"])
-        with open(roi_pdf_path, "rb") as f:
-            roi_obj = client.files.create(file=f, purpose="user_data")
-        st.session_state.roi_file_id = roi_obj.id
-        st.session_state.file_ids = [roi_obj.id]
-
-    # Create agent & auto-ask the initial meter-reading question (using ROI)
-    agent = create_agent(context=st.session_state.file_ids)
-    st.session_state.history.append(("user", INITIAL_QUESTION))
-
-    with st.spinner("Asking the model for the meter reading…"):
-        # Build the LangChain-style message history for the agent
-        messages = []
-        for role, text in st.session_state.history:
-            if role == "user":
-                messages.append(HumanMessage(content=text))
-            elif role == "bot":
-                messages.append(AIMessage(content=text))
-        # Final user message (the initial question)
-        messages.append(HumanMessage(content=INITIAL_QUESTION))
-
-        resp = agent.invoke({"messages": messages})
-        ai_msg = ""
-        if isinstance(resp, dict) and "messages" in resp:
-            ai_msgs = [m for m in resp["messages"] if isinstance(m, AIMessage)]
-            if ai_msgs:
-                ai_msg = ai_msgs[-1].content or ""
-
-        # Ensure the follow-up line is present for the very first response
-        followup = "Would you like to know anything else from the uploaded bill?"
-        if followup.lower() not in (ai_msg or "").lower():
-            if (ai_msg or "").strip():
-                ai_msg = f"{ai_msg.strip()}\n\n{followup}"
-            else:
-                ai_msg = followup
-
-        st.session_state.history.append(("bot", ai_msg))
-
-        # Swap ROI file for full PDF for all subsequent turns
-        swap_roi_for_full_pdf()
-
-        st.session_state.initial_query_done = True
+# ---- On Upload: crop -> read locally or ask the model about the ROI image -> swap to full PDF ----
+if uploaded_file and st.session_state.bill is None:
+    if not os.environ.get("OPENAI_API_KEY"):
+        st.error("Missing OPENAI_API_KEY in environment. Please set it and refresh.")
+        st.stop()
+
+    if BILL_SERVICE:
+        # Keep the uploaded PDF in memory (no temp files to collide between users)
+        pdf_bytes = uploaded_file.getvalue()
+        st.chat_message("user").write(INITIAL_QUESTION)
+        job = wait_for_job(lambda service: service.submit_upload(uploaded_file.name, pdf_bytes),
+                           "Reading the meter…")
+        if job["result"]["swap_error"]:
+            st.error(f"Failed to upload the full bill: {job['result']['swap_error']}")
+        st.session_state.bill_id = job["session_id"]
+        st.session_state.bill = get_bill_service().session(job["session_id"])
+        st.session_state.upload_key = upload_key
         st.rerun()
 
+    bill = BillSession(get_openai_client(), get_upload_cache(), get_background_pool(), get_response_cache())
+    sessions.touch(bill)
+    with st.spinner("Processing PDF (cropping ROI)…"):
+        # Keep the uploaded PDF in memory (no temp files to collide between users)
+        with span("read_upload", bill.trace) as timing:
+            pdf_bytes = uploaded_file.getvalue()
+            timing["bytes"] = len(pdf_bytes)
+        bill.load(uploaded_file.name, pdf_bytes)
+
+    st.chat_message("user").write(INITIAL_QUESTION)
+    try:
+        ai_msg, source = bill.first_turn(
+            run=lambda agent, messages: run_agent(agent, messages, "Asking the model for the meter reading…")
+        )
+    except Exception as e:
+        # Retries/backoff already ran (resilience.py); the next rerun starts the bill over
+        sessions.close(bill)
+        st.error(describe_error(e))
+        st.stop()
+    if source == "local":
+        st.chat_message("assistant").write(ai_msg)
+
+    # Swap ROI file for full PDF for all subsequent turns
+    with st.spinner("Loading the full bill…"):
+        try:
+            bill.swap_roi_for_full_pdf()
+        except Exception as e:
+            st.error(f"Failed to upload the full bill: {describe_error(e)}")
+
+    st.session_state.bill = bill
+    st.session_state.upload_key = upload_key
+    st.rerun()
+
+bill = st.session_state.bill
+
 # ---- Show chat history (after upload) ----
-if st.session_state.history:
-    for role, text in st.session_state.history:
+if bill is not None:
+    if st.session_state.bill_id:
+        try:
+            get_bill_service().touch(st.session_state.bill_id)
+        except UnknownSession:
+            pass  # the next question says it expired
+    else:
+        sessions.touch(bill)
+    if bill.history_dropped:
+        st.caption(f"{bill.history_dropped} earlier messages are no longer shown.")
+    for role, text in bill.history:
         if role == "user":
             st.chat_message("user").write(text)
         else:
             st.chat_message("assistant").write(text)
 
 # ---- Chat input (enabled only after a PDF is uploaded & initial turn is done) ----
-if st.session_state.full_file_id:
-    if prompt := st.chat_input("Ask anything else from this bill…"):
-        st.session_state.history.append(("user", prompt))
-        with st.spinner("Thinking…"):
-            # Recreate agent each turn to ensure it has the latest (full) file_ids
-            agent = create_agent(context=st.session_state.file_ids)
-
-            # Build history for the agent call
-            messages = []
-            for role, text in st.session_state.history:
-                if role == "user":
-                    messages.append(HumanMessage(content=text))
-                elif role == "bot":
-                    messages.append(AIMessage(content=text))
-            messages.append(HumanMessage(content=prompt))
-
-            ai_msg = ""
-            resp = agent.invoke({"messages": messages})
-            if isinstance(resp, dict) and "messages" in resp:
-                ai_msgs = [m for m in resp["messages"] if isinstance(m, AIMessage)]
-                if ai_msgs:
-                    ai_msg = ai_msgs[-1].content or ""
-
-            st.session_state.history.append(("bot", ai_msg))
+if bill is not None and bill.ready:
+    placeholder = "Compare these bills…" if isinstance(bill, BillSet) else "Ask anything else from this bill…"
+    if prompt := st.chat_input(placeholder):
+        st.chat_message("user").write(prompt)
+        # Routed inside: answer from parsed fields, from extracted text, or from the full PDF
+        if BILL_SERVICE and st.session_state.bill_id:
+            wait_for_job(lambda service: service.submit_question(st.session_state.bill_id, prompt), "Thinking…")
             st.rerun()
+        try:
+            ai_msg, route = bill.ask(prompt, run=lambda agent, messages: run_agent(agent, messages, "Thinking…"))
+        except Exception as e:
+            st.error(describe_error(e))
+            st.stop()
+        if route == "local":
+            st.chat_message("assistant").write(ai_msg)
+        st.rerun()
 else:
     st.info("Please upload a PDF to begin.")
+
+# ---- Debug panel (DEBUG_PANEL=1) ----
+if DEBUG_PANEL:
+    with st.sidebar:
+        st.subheader("Debug")
+        trace = bill.trace if bill is not None else []
+        spans = [e for e in trace if e.get("stage") != "usage"]
+        usage = [e for e in trace if e.get("stage") == "usage"]
+        if spans:
+            st.caption("Stage timings (this session, newest last)")
+            st.dataframe(spans[-30:], hide_index=True)
+        if usage:
+            st.caption("Tokens (this session)")
+            st.json({k: sum(u[k] for u in usage) for k in ("input_tokens", "cached_tokens", "output_tokens")})
+        if bill is not None and bill.roi_render:
+            st.caption("ROI render")
+            st.json(bill.roi_render)
+        response_cache = get_response_cache()
+        st.caption("Caches (process)")
+        st.json({
+            "responses": response_cache.stats() if response_cache else "off",
+            "uploads": get_upload_cache().stats(),
+            "sessions": sessions.stats(),
+        })
+        with st.expander("Prometheus metrics (process)"):
+            st.code(render_prometheus(), language="text")
+
+# After the page is built: nothing above waited for these
+warm_imports()
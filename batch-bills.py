@@ -0,0 +1,209 @@
+# batch_bills.py
+# Headless batch meter reading for folders of bill PDFs.
+# - Cropping + local seven-segment reading run across a process pool (CPU-bound).
+# - Low-confidence bills go to the vision model with bounded API concurrency.
+# - Results are appended to JSONL or CSV as they finish; rerunning with the same --out
+#   skips bills that already have a successful row (failed rows are retried).
+# Usage:
+#   python batch-bills.py bills/ "archive/2024-*/**/*.pdf" --out readings.jsonl --workers 8 --api-concurrency 4
+
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+FIELDS = ["path", "sha256", "reading", "confidence", "source", "dpi", "seconds", "error"]
+
+
+def collect_pdfs(inputs):
+    paths = []
+    for item in inputs:
+        if os.path.isdir(item):
+            matches = glob.glob(os.path.join(item, "**", "*.pdf"), recursive=True)
+        else:
+            matches = glob.glob(item, recursive=True)
+        paths.extend(p for p in matches if p.lower().endswith(".pdf"))
+    return sorted(set(os.path.abspath(p) for p in paths))
+
+
+def load_done(out_path):
+    """Paths with a successful row in an existing output file (the checkpoint)."""
+    if not os.path.exists(out_path):
+        return set()
+    with open(out_path, newline="") as f:
+        if out_path.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        else:
+            rows = [json.loads(line) for line in f if line.strip()]
+    return {r["path"] for r in rows if r.get("reading") and not r.get("error")}
+
+
+class ResultWriter:
+    def __init__(self, out_path):
+        self.csv = out_path.endswith(".csv")
+        new = not os.path.exists(out_path) or os.path.getsize(out_path) == 0
+        self.f = open(out_path, "a", newline="")
+        self.lock = threading.Lock()
+        if self.csv:
+            self.writer = csv.DictWriter(self.f, fieldnames=FIELDS)
+            if new:
+                self.writer.writeheader()
+
+    def write(self, row):
+        row = {k: row.get(k) for k in FIELDS}
+        with self.lock:
+            if self.csv:
+                self.writer.writerow(row)
+            else:
+                self.f.write(json.dumps(row) + "\n")
+            self.f.flush()
+
+    def close(self):
+        self.f.close()
+
+
+def local_stage(path, bbox, dpi, min_confidence, locate=True):
+    """Runs in a worker process: crop + local read. Returns (row, (roi image bytes, mime) or None)."""
+    from meter_reader import read_meter
+    from utils import pixmap_to_bgr, pixmap_to_image_bytes, render_roi
+
+    t0 = time.perf_counter()
+    row = {"path": path}
+    try:
+        with open(path, "rb") as f:
+            pdf_bytes = f.read()
+        row["sha256"] = hashlib.sha256(pdf_bytes).hexdigest()
+        pix, info = render_roi(pdf_bytes, page_number=0, bbox=bbox, dpi=dpi, locate=locate)
+        reading, confidence = read_meter(pixmap_to_bgr(pix), dpi=info["dpi"])
+        row.update(reading=reading, confidence=round(confidence, 3), source="local", dpi=info["dpi"])
+        roi_image = None
+        if not reading or confidence < min_confidence:
+            roi_image = pixmap_to_image_bytes(pix, stream=info.get("stream"))
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+        roi_image = None
+    row["seconds"] = round(time.perf_counter() - t0, 3)
+    return row, roi_image
+
+
+def model_stage(client, row, roi_image, cache=None):
+    """Runs in an API thread: ask the initial question with the ROI sent inline (nothing to upload or delete).
+    With a response cache, the same bill bytes seen again (another path, a rerun) skip the model call."""
+    from agent_factory import INITIAL_QUESTION, HumanMessage, AIMessage, create_agent, parse_meter_reading
+
+    t0 = time.perf_counter()
+    try:
+        agent = create_agent([], client=client, images=[roi_image], cache=cache, doc_hash=row["sha256"],
+                             intent="meter")
+        resp = agent.invoke({"messages": [HumanMessage(content=INITIAL_QUESTION)]})
+        answer = next((m.content for m in resp["messages"] if isinstance(m, AIMessage)), "")
+        row.update(reading=parse_meter_reading(answer), confidence=None,
+                   source="cache" if agent.cache_hit else "model")
+        if not row["reading"]:
+            row["error"] = f"unparsed answer: {answer[:80]!r}"
+    except Exception as e:
+        row["error"] = f"{type(e).__name__}: {e}"
+    row["seconds"] = round(row.get("seconds", 0) + time.perf_counter() - t0, 3)
+    return row
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Read meters for a folder/glob of bill PDFs.")
+    ap.add_argument("inputs", nargs="+", help="Directories, globs or PDF paths")
+    ap.add_argument("--out", default="readings.jsonl", help="Output .jsonl or .csv (also the resume checkpoint)")
+    ap.add_argument("--workers", type=int, default=os.cpu_count(), help="Processes for crop + local read")
+    ap.add_argument("--api-concurrency", type=int, default=4, help="Max concurrent model calls")
+    ap.add_argument("--no-api", action="store_true", help="Local reader only; never call the model")
+    ap.add_argument("--min-confidence", type=float, default=None, help="Local read confidence needed to skip the model")
+    ap.add_argument(
+        "--bbox", nargs=4, type=float, metavar=("X0", "Y0", "X1", "Y1"),
+        default=(348, 469, 540, 610), help="Meter ROI in PDF points, origin top-left (a hint unless --no-locate)",
+    )
+    ap.add_argument("--no-locate", action="store_true", help="Crop exactly --bbox instead of finding the meter photo")
+    ap.add_argument(
+        "--dpi", type=lambda v: v if v in ("auto", "native") else int(v), default="native",
+        help='Render DPI, "auto" for adaptive, or "native" to crop the embedded photo as-is (default: native)',
+    )
+    args = ap.parse_args()
+
+    from meter_reader import MIN_CONFIDENCE
+    min_confidence = MIN_CONFIDENCE if args.min_confidence is None else args.min_confidence
+
+    pdfs = collect_pdfs(args.inputs)
+    done = load_done(args.out)
+    todo = [p for p in pdfs if p not in done]
+    print(f"{len(pdfs)} PDFs found, {len(done & set(pdfs))} already done, {len(todo)} to process")
+    if not todo:
+        return 0
+
+    client, cache = None, None
+    if not args.no_api:
+        if not os.environ.get("OPENAI_API_KEY"):
+            print("OPENAI_API_KEY not set; low-confidence bills will be recorded without a reading (or use --no-api)")
+        else:
+            from agent_factory import build_client, build_response_cache
+            client = build_client()
+            cache = build_response_cache()
+
+    writer = ResultWriter(args.out)
+    counts = {"local": 0, "model": 0, "cache": 0, "error": 0}
+    t_start = time.perf_counter()
+
+    def record(row):
+        counts["error" if row.get("error") else row["source"]] += 1
+        writer.write(row)
+
+    try:
+        with ProcessPoolExecutor(max_workers=args.workers) as procs, \
+                ThreadPoolExecutor(max_workers=max(1, args.api_concurrency)) as api:
+            # keep a bounded window of bills in flight instead of queueing thousands of futures; while the
+            # model calls fall behind, stop cropping more (each waiting call holds its ROI image)
+            queue = iter(todo)
+            pending, api_futures = set(), set()
+            api_backlog = 4 * max(1, args.api_concurrency)
+
+            def refill():
+                while len(pending) < 4 * args.workers and len(api_futures) < api_backlog:
+                    path = next(queue, None)
+                    if path is None:
+                        break
+                    pending.add(procs.submit(local_stage, path, tuple(args.bbox), args.dpi, min_confidence,
+                                             not args.no_locate))
+
+            refill()
+            while pending or api_futures:
+                finished, _ = wait(pending | api_futures, return_when=FIRST_COMPLETED)
+                for fut in finished:
+                    if fut in api_futures:
+                        api_futures.discard(fut)
+                        record(fut.result())
+                        continue
+                    pending.discard(fut)
+                    row, roi_image = fut.result()
+                    if roi_image is None or row.get("error"):
+                        record(row)
+                    elif client is None:
+                        row["error"] = row.get("error") or "low confidence; model disabled"
+                        record(row)
+                    else:
+                        # the API pool's worker count bounds concurrent model calls
+                        api_futures.add(api.submit(model_stage, client, row, roi_image, cache))
+                refill()
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - t_start
+    print(f"Done in {elapsed:.1f}s ({len(todo) / elapsed:.1f} bills/s): "
+          f"{counts['local']} local, {counts['model']} model, {counts['cache']} cached, "
+          f"{counts['error']} errors -> {args.out}")
+    return 0 if counts["error"] == 0 else 2
+
+
+if __name__ == "__main__":
+    sys.exit(main())
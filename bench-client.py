@@ -0,0 +1,62 @@
+# bench_client.py
+# Per-turn overhead of building a fresh OpenAI client every turn (old app.py behaviour)
+# vs. reusing one pooled client, measured against the local stub API (no network needed).
+# Real runs also pay a TLS handshake per fresh client, so the gap here is a lower bound.
+# Usage:
+#   python bench-client.py --turns 200
+
+import argparse
+import statistics
+import sys
+import time
+
+from openai import OpenAI
+
+from agent_factory import HumanMessage, build_client, create_agent
+from stub_openai import StubOpenAIServer
+
+
+def time_turns(make_agent, turns):
+    samples = []
+    messages = [HumanMessage(content="What is the amount payable?")]
+    for _ in range(turns):
+        t0 = time.perf_counter()
+        agent = make_agent()
+        agent.invoke({"messages": messages})
+        samples.append(time.perf_counter() - t0)
+    return samples
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark per-turn client construction overhead.")
+    ap.add_argument("--turns", type=int, default=200)
+    args = ap.parse_args()
+
+    server = StubOpenAIServer().start()
+    try:
+        file_ids = ["file-bench"]
+
+        def fresh():
+            return create_agent(file_ids, client=OpenAI(api_key="sk-bench", base_url=server.base_url))
+
+        shared = build_client(api_key="sk-bench", base_url=server.base_url)
+
+        def pooled():
+            return create_agent(file_ids, client=shared)
+
+        time_turns(pooled, 5)  # warm imports / first connection
+        results = {"fresh client": time_turns(fresh, args.turns), "pooled client": time_turns(pooled, args.turns)}
+    finally:
+        server.stop()
+
+    print(f"{'variant':<16}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    for name, samples in results.items():
+        ordered = sorted(samples)
+        p95 = ordered[int(len(ordered) * 0.95) - 1]
+        print(f"{name:<16}{statistics.mean(samples) * 1000:>10.2f}"
+              f"{ordered[len(ordered) // 2] * 1000:>10.2f}{p95 * 1000:>10.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
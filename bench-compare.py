@@ -0,0 +1,130 @@
+# bench_compare.py
+# Comparison mode benchmark: a year of monthly bills in one conversation, answered (a) the naive way,
+# every full PDF attached to the conversation, and (b) by bill_compare.BillSet from its index plus
+# only the pages each question needs. Reports input tokens and latency per question against the stub
+# API (--token-latency makes prompt size cost time), and indexing time sequential vs concurrent.
+# Usage:
+#   python bench-compare.py --bills 12 --pages 4
+#   python bench-compare.py --bills 6 --scanned 2 --token-latency 0.05 --json bench-compare.json
+
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from agent_factory import build_client
+from bill_compare import BillSet, index_bill
+from bill_session import BillSession, invoke_agent, upload_pdf
+from stub_openai import StubOpenAIServer, parse_latency
+from synthetic_bills import make_bill_pdf
+from upload_cache import UploadCache
+
+QUESTIONS = [
+    "How did my units consumed change over these months?",
+    "Compare the amount payable on each bill",
+    "Why was my bill so much higher in summer?",
+    "Explain how the tariff slabs affected my highest bill",
+    "Which month had the highest units and what did it cost?",
+]
+
+
+def make_bills(count, pages, scanned):
+    # the last `scanned` bills are flattened to images, like a scan without a text layer
+    return [(f"bill_{month + 1:02d}.pdf",
+             make_bill_pdf(f"{4000 + 250 * month:05d}.00", pages=pages, seed=month, fields=True, month=month,
+                           rasterize=month >= count - scanned))
+            for month in range(count)]
+
+
+def usage_since(trace, start):
+    return sum(e["input_tokens"] for e in trace[start:] if e.get("stage") == "usage")
+
+
+def ask_all_pdfs(client, upload_cache, pool, bills, questions):
+    """Baseline: every full PDF attached to the conversation (once, then carried by the chain)."""
+    session = BillSession(client, upload_cache, pool)
+    session.file_ids = list(pool.map(lambda bill: upload_pdf(client, *bill, upload_cache, session.trace), bills))
+    rows = []
+    for question in questions:
+        start, t0 = len(session.trace), time.perf_counter()
+        session._remember("user", question)
+        agent = session.make_agent()
+        session._remember("bot", invoke_agent(agent, session.messages()))
+        session.remember_chain(agent)
+        rows.append({"question": question, "route": "file", "input_tokens": usage_since(session.trace, start),
+                     "ms": round((time.perf_counter() - t0) * 1000, 1)})
+    session.close()
+    return rows
+
+
+def ask_index(client, upload_cache, pool, bills, questions):
+    session = BillSet(client, upload_cache, pool)
+    session.load(bills)
+    rows = []
+    for question in questions:
+        start, t0 = len(session.trace), time.perf_counter()
+        _, route = session.ask(question)
+        rows.append({"question": question, "route": route, "input_tokens": usage_since(session.trace, start),
+                     "ms": round((time.perf_counter() - t0) * 1000, 1)})
+    session.close()
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark multi-bill comparison: all PDFs vs the bill index.")
+    ap.add_argument("--bills", type=int, default=12)
+    ap.add_argument("--pages", type=int, default=4, help="Pages per bill")
+    ap.add_argument("--scanned", type=int, default=0, help="How many of the bills have no text layer")
+    ap.add_argument("--latency", type=parse_latency, default=parse_latency("files.create=0.2,responses.create=0.5"))
+    ap.add_argument("--token-latency", type=float, default=0.02, help="Stub seconds per 1k input tokens")
+    ap.add_argument("--json", help="Also write the results to this JSON file")
+    args = ap.parse_args()
+
+    bills = make_bills(args.bills, args.pages, args.scanned)
+    t0 = time.perf_counter()
+    for bill in bills:
+        index_bill(*bill)
+    sequential_ms = (time.perf_counter() - t0) * 1000
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=len(bills)) as executor:
+        list(executor.map(index_bill, *zip(*bills)))
+    concurrent_ms = (time.perf_counter() - t0) * 1000
+
+    server = StubOpenAIServer(latency=args.latency, jitter=0.0, token_latency=args.token_latency).start()
+    tmp = tempfile.mkdtemp()
+    try:
+        client = build_client(api_key="sk-bench", base_url=server.base_url)
+        pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="bill-io")
+        results = {}
+        for mode, fn in (("all_pdfs", ask_all_pdfs), ("index", ask_index)):
+            upload_cache = UploadCache(path=os.path.join(tmp, f"uploads-{mode}.sqlite3"))
+            t0 = time.perf_counter()
+            rows = fn(client, upload_cache, pool, bills, QUESTIONS)
+            results[mode] = {"questions": rows, "total_ms": round((time.perf_counter() - t0) * 1000, 1),
+                             "input_tokens": sum(r["input_tokens"] for r in rows)}
+        pool.shutdown()
+    finally:
+        server.stop()
+
+    print(f"{args.bills} bills x {args.pages} pages ({args.scanned} scanned); "
+          f"indexing: sequential {sequential_ms:.0f} ms, concurrent {concurrent_ms:.0f} ms\n")
+    print(f"{'question':<56}{'all-PDF tok':>12}{'ms':>8}{'index tok':>11}{'ms':>8}  route")
+    for naive, indexed in zip(results["all_pdfs"]["questions"], results["index"]["questions"]):
+        print(f"{naive['question'][:54]:<56}{naive['input_tokens']:>12,}{naive['ms']:>8.0f}"
+              f"{indexed['input_tokens']:>11,}{indexed['ms']:>8.0f}  {indexed['route']}")
+    for mode, r in results.items():
+        print(f"{mode:<10} total {r['input_tokens']:>9,} input tokens, {r['total_ms']:>8.0f} ms "
+              f"(including uploads / indexing)")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k != "json"},
+                       "index_ms": {"sequential": sequential_ms, "concurrent": concurrent_ms},
+                       "modes": results}, f, indent=2, default=str)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
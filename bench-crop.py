@@ -0,0 +1,99 @@
+# bench_crop.py
+# Compare the old disk round-trip ROI crop against the in-memory crop_roi_pdf_bytes().
+# Each variant runs in a fresh process so peak RSS is per-variant, not cumulative.
+# Usage:
+#   python bench-crop.py --pdf bill1.pdf bill2.pdf --repeat 5
+#   python bench-crop.py                 # uses a synthetic bill
+
+import argparse
+import io
+import multiprocessing as mp
+import os
+import resource
+import sys
+import tempfile
+import time
+
+ROI_BBOX = (348, 469, 540, 610)
+
+
+def legacy_crop(pdf_bytes, name, bbox, dpi, workdir):
+    """The pre-bytes path from app.py/utils.py: save upload, reopen, PIL copy, PNG, save ROI PDF, reread."""
+    import fitz
+    from PIL import Image
+
+    local_pdf_path = os.path.join(workdir, name)
+    with open(local_pdf_path, "wb") as f:
+        f.write(pdf_bytes)
+    roi_pdf_path = os.path.join(workdir, f"roi_{name}.pdf")
+
+    doc = fitz.open(local_pdf_path)
+    pix = doc[0].get_pixmap(clip=fitz.Rect(*bbox), dpi=dpi)
+    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+    buf = io.BytesIO()
+    img.save(buf, format="PNG")
+    out = fitz.open()
+    new_page = out.new_page(width=img.width, height=img.height)
+    new_page.insert_image(fitz.Rect(0, 0, img.width, img.height), stream=buf.getvalue())
+    out.save(roi_pdf_path)
+    out.close()
+    doc.close()
+
+    with open(roi_pdf_path, "rb") as f:
+        return f.read()
+
+
+def run_variant(variant, pdf_bytes, name, dpi, repeat, queue):
+    from utils import crop_roi_pdf_bytes
+
+    times = []
+    size = 0
+    with tempfile.TemporaryDirectory() as workdir:
+        for _ in range(repeat):
+            t0 = time.perf_counter()
+            if variant == "legacy":
+                data = legacy_crop(pdf_bytes, name, ROI_BBOX, dpi, workdir)
+            else:
+                data = crop_roi_pdf_bytes(pdf_bytes, page_number=0, bbox=ROI_BBOX, dpi=dpi)
+            times.append(time.perf_counter() - t0)
+            size = len(data)
+    peak_kb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss  # KiB on Linux
+    queue.put((min(times), sorted(times)[len(times) // 2], peak_kb, size))
+
+
+def measure(variant, pdf_bytes, name, dpi, repeat):
+    ctx = mp.get_context("spawn")
+    queue = ctx.Queue()
+    proc = ctx.Process(target=run_variant, args=(variant, pdf_bytes, name, dpi, repeat, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark legacy vs in-memory ROI cropping.")
+    ap.add_argument("--pdf", nargs="*", default=[], help="Bill PDFs (default: one synthetic bill)")
+    ap.add_argument("--dpi", type=int, default=500, help="Render DPI (default: 500, as in app.py)")
+    ap.add_argument("--repeat", type=int, default=5, help="Runs per bill and variant")
+    args = ap.parse_args()
+
+    bills = []
+    for path in args.pdf:
+        with open(path, "rb") as f:
+            bills.append((os.path.basename(path), f.read()))
+    if not bills:
+        from synthetic_bills import make_bill_pdf
+        bills.append(("synthetic.pdf", make_bill_pdf()))
+
+    print(f"{'bill':<28}{'variant':<10}{'best ms':>10}{'median ms':>11}{'peak RSS MiB':>14}{'ROI bytes':>12}")
+    for name, pdf_bytes in bills:
+        for variant in ("legacy", "bytes"):
+            best, median, peak_kb, size = measure(variant, pdf_bytes, name, args.dpi, args.repeat)
+            print(f"{name[:27]:<28}{variant:<10}{best * 1000:>10.1f}{median * 1000:>11.1f}"
+                  f"{peak_kb / 1024:>14.1f}{size:>12}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+# bench_dot_filter.py
+# Old per-label dot filter (cleaned[labels == i] = 255 for every component) vs. the lookup-table
+# filter in preprocess_meter.filter_components_by_area, on synthetic noisy meter ROIs at several DPIs.
+# Checks the outputs are pixel-identical.
+# Usage:
+#   python bench-dot-filter.py --dpi 200 300 500 600
+
+import argparse
+import sys
+import time
+
+import cv2
+import numpy as np
+
+from preprocess_meter import dot_area_bounds, filter_components_by_area
+from synthetic_bills import draw_seven_segment
+
+ROI_PT = (192, 141)  # ROI_BBOX size in points
+
+
+def legacy_filter(mask, min_area, max_area):
+    num_labels, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    cleaned = np.zeros_like(mask)
+    for i in range(1, num_labels):
+        area = stats[i, cv2.CC_STAT_AREA]
+        if min_area <= area <= max_area:
+            cleaned[labels == i] = 255
+    return cleaned
+
+
+def noisy_dot_mask(dpi, seed=0):
+    """Black-hat + Otsu mask (the input of the dot filter) for a grainy ROI rendered at `dpi`."""
+    rng = np.random.default_rng(seed)
+    w, h = int(ROI_PT[0] * dpi / 72), int(ROI_PT[1] * dpi / 72)
+    photo = cv2.resize(draw_seven_segment("04512.37", noise=0, seed=seed), (w, h))
+    gray = cv2.cvtColor(photo, cv2.COLOR_RGB2GRAY).astype(np.float32)
+    gray -= (rng.random(gray.shape) < 0.02) * rng.uniform(40, 120, gray.shape)  # dust / sensor specks
+    gray = np.clip(gray + rng.normal(0, 8, gray.shape), 0, 255).astype(np.uint8)
+    k = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3))
+    blackhat = cv2.morphologyEx(gray, cv2.MORPH_BLACKHAT, k)
+    bh_norm = cv2.normalize(blackhat, None, 0, 255, cv2.NORM_MINMAX)
+    _, mask = cv2.threshold(bh_norm, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    return mask
+
+
+def best_of(fn, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        out = fn()
+        best = min(best, time.perf_counter() - t0)
+    return best, out
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the dot-mask connected-component filter.")
+    ap.add_argument("--dpi", type=int, nargs="+", default=[200, 300, 500, 600])
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    print(f"{'dpi':>5}{'size':>12}{'labels':>9}{'loop ms':>11}{'lut ms':>9}{'speedup':>9}  identical")
+    ok = True
+    for dpi in args.dpi:
+        mask = noisy_dot_mask(dpi)
+        lo, hi = dot_area_bounds(dpi)
+        labels = cv2.connectedComponentsWithStats(mask, connectivity=8)[0] - 1
+        t_loop, out_loop = best_of(lambda: legacy_filter(mask, lo, hi), 1 if labels > 2000 else args.repeat)
+        t_lut, out_lut = best_of(lambda: filter_components_by_area(mask, lo, hi), args.repeat)
+        same = np.array_equal(out_loop, out_lut)
+        ok &= same
+        print(f"{dpi:>5}{f'{mask.shape[1]}x{mask.shape[0]}':>12}{labels:>9}{t_loop * 1000:>11.1f}"
+              f"{t_lut * 1000:>9.2f}{t_loop / t_lut:>8.0f}x  {same}")
+    return 0 if ok else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+# bench_dpi.py
+# ROI payload size, render time and local reading accuracy per DPI (fixed DPIs vs "auto" vs "native").
+# Accuracy uses meter_reader.read_meter against the known reading of each bill; with --pdf,
+# pass ground truth as path=reading (e.g. bills/jan.pdf=04512.37).
+# Usage:
+#   python bench-dpi.py                          # synthetic sample set
+#   python bench-dpi.py --pdf jan.pdf=04512.37 feb.pdf=04633.10 --dpi 150 300 500 auto native
+
+import argparse
+import statistics
+import sys
+import time
+
+from meter_reader import read_meter
+from utils import pixmap_to_bgr, pixmap_to_pdf_bytes, render_roi
+
+ROI_BBOX = (348, 469, 540, 610)
+SYNTHETIC_READINGS = ["04512.37", "12345.67", "00098.10", "77777.77", "31415.92", "88008.80"]
+
+
+def sample_set():
+    from synthetic_bills import make_bill_pdf
+    bills = []
+    for i, reading in enumerate(SYNTHETIC_READINGS):
+        for embed in ("png", "jpeg"):
+            bills.append((f"synthetic-{i}-{embed}", make_bill_pdf(reading, embed=embed, seed=i), reading))
+        bills.append((f"synthetic-{i}-scan", make_bill_pdf(reading, rasterize=True, seed=i), reading))
+    return bills
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark ROI render DPI: size, time, accuracy.")
+    ap.add_argument("--pdf", nargs="*", default=[], help="path=reading pairs (default: synthetic set)")
+    ap.add_argument("--dpi", nargs="+", default=["150", "200", "300", "400", "500", "auto", "native"])
+    args = ap.parse_args()
+
+    bills = []
+    for item in args.pdf:
+        path, _, reading = item.partition("=")
+        with open(path, "rb") as f:
+            bills.append((path, f.read(), reading or None))
+    if not bills:
+        bills = sample_set()
+
+    print(f"{len(bills)} bills\n{'dpi':>6}{'chosen':>10}{'ROI KiB':>10}{'render ms':>11}{'read ms':>9}{'accuracy':>10}")
+    for dpi_arg in args.dpi:
+        dpi = dpi_arg if dpi_arg in ("auto", "native") else int(dpi_arg)
+        sizes, render_ms, read_ms, chosen, correct, scored = [], [], [], [], 0, 0
+        for _, pdf_bytes, truth in bills:
+            t0 = time.perf_counter()
+            pix, info = render_roi(pdf_bytes, page_number=0, bbox=ROI_BBOX, dpi=dpi)
+            roi_pdf = pixmap_to_pdf_bytes(pix, stream=info.get("stream"))
+            render_ms.append((time.perf_counter() - t0) * 1000)
+            sizes.append(len(roi_pdf) / 1024)
+            chosen.append(info["dpi"])
+
+            t0 = time.perf_counter()
+            reading, _ = read_meter(pixmap_to_bgr(pix), dpi=info["dpi"])
+            read_ms.append((time.perf_counter() - t0) * 1000)
+            if truth:
+                scored += 1
+                correct += reading == truth
+        accuracy = f"{correct / scored:.0%}" if scored else "n/a"
+        chosen_txt = f"{min(chosen)}-{max(chosen)}" if min(chosen) != max(chosen) else str(chosen[0])
+        print(f"{dpi_arg:>6}{chosen_txt:>10}{statistics.mean(sizes):>10.0f}{statistics.median(render_ms):>11.1f}"
+              f"{statistics.median(read_ms):>9.1f}{accuracy:>10}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,71 @@
+# bench_first_turn.py
+# First-turn cost when the local reader defers to the model: ROI wrapped in a PDF + files.create +
+# responses.create (+ files.delete later) vs. the ROI sent inline as a base64 input_image.
+# Runs against the local stub API; --latency adds a simulated round trip to every API call.
+# Usage:
+#   python bench-first-turn.py --latency 0.15 --turns 20
+
+import argparse
+import statistics
+import sys
+import time
+
+from agent_factory import HumanMessage, INITIAL_QUESTION, build_client, create_agent
+from stub_openai import StubOpenAIServer
+from synthetic_bills import METER_BBOX, make_bill_pdf
+from utils import pixmap_to_image_bytes, pixmap_to_pdf_bytes, render_roi
+
+
+def pdf_turn(client, pix, info):
+    """Old path: returns (critical-path seconds, payload bytes); the delete runs off the critical path."""
+    t0 = time.perf_counter()
+    roi_pdf = pixmap_to_pdf_bytes(pix, stream=info.get("stream"))
+    file_id = client.files.create(file=("roi.pdf", roi_pdf, "application/pdf"), purpose="user_data").id
+    create_agent([file_id], client=client).invoke({"messages": [HumanMessage(content=INITIAL_QUESTION)]})
+    elapsed = time.perf_counter() - t0
+    client.files.delete(file_id)
+    return elapsed, len(roi_pdf)
+
+
+def image_turn(client, pix, info):
+    t0 = time.perf_counter()
+    roi_image = pixmap_to_image_bytes(pix, stream=info.get("stream"))
+    agent = create_agent([], client=client, images=[roi_image])
+    agent.invoke({"messages": [HumanMessage(content=INITIAL_QUESTION)]})
+    return time.perf_counter() - t0, len(roi_image[0])
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the first model turn: ROI PDF upload vs inline image.")
+    ap.add_argument("--latency", type=float, default=0.05, help="Simulated seconds per API call")
+    ap.add_argument("--turns", type=int, default=20)
+    ap.add_argument("--dpi", default="native", help='ROI render DPI, "auto" or "native"')
+    args = ap.parse_args()
+    dpi = args.dpi if args.dpi in ("auto", "native") else int(args.dpi)
+
+    rois = {}
+    for embed in ("png", "jpeg"):
+        rois[embed] = render_roi(make_bill_pdf(embed=embed), 0, METER_BBOX, dpi=dpi, locate=True)
+
+    server = StubOpenAIServer(latency=args.latency).start()
+    try:
+        client = build_client(api_key="sk-bench", base_url=server.base_url)
+        image_turn(client, *rois["png"])  # warm imports / first connection
+        print(f"{'photo':<7}{'variant':<9}{'payload KiB':>12}{'p50 ms':>9}{'p95 ms':>9}{'API calls':>11}")
+        for embed, (pix, info) in rois.items():
+            for name, fn, calls in (("pdf", pdf_turn, 3), ("image", image_turn, 1)):
+                samples, size = [], 0
+                for _ in range(args.turns):
+                    elapsed, size = fn(client, pix, info)
+                    samples.append(elapsed)
+                ordered = sorted(samples)
+                p95 = ordered[max(0, int(len(ordered) * 0.95) - 1)]
+                print(f"{embed:<7}{name:<9}{size / 1024:>12.0f}{statistics.median(samples) * 1000:>9.1f}"
+                      f"{p95 * 1000:>9.1f}{calls:>11}")
+    finally:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
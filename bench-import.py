@@ -0,0 +1,85 @@
+# bench_import.py
+# Cold-start import cost of the app's modules and the CLIs, from `python -X importtime` in fresh
+# interpreters: best-of-N total per target, the slowest top-level imports and which heavy modules
+# (openai, cv2, matplotlib, ...) got loaded at start-up. --budget makes it a CI gate (exit 1 when a
+# target's import time is over budget). Streamlit itself isn't counted: every app start pays it anyway.
+# Usage:
+#   python bench-import.py
+#   python bench-import.py --repeat 7 --budget app=400,serve-bills=500 --json bench-import.json
+
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+
+APP_MODULES = ("agent_factory", "bill_compare", "bill_service", "bill_session", "bill_fields", "metrics",
+               "resilience", "session_manager", "upload_cache")  # what app.py imports besides streamlit
+TARGETS = {
+    "app": ["-c", "import " + ", ".join(APP_MODULES)],
+    "serve-bills": ["serve-bills.py", "--help"],
+    "batch-bills": ["batch-bills.py", "--help"],
+    "gc-uploads": ["gc-uploads.py", "--help"],
+    "preprocess_meter": ["preprocess_meter.py", "--help"],
+    "test-cropping": ["test-cropping.py", "--help"],
+}
+HEAVY = ("openai", "httpx", "langchain", "cv2", "matplotlib", "fitz", "numpy", "PIL")
+_LINE = re.compile(r"import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)")
+
+
+def import_profile(args):
+    """{module: cumulative us} for the top-level imports of one fresh interpreter, plus every module seen."""
+    proc = subprocess.run([sys.executable, "-X", "importtime", *args], capture_output=True, text=True,
+                          cwd=os.path.dirname(os.path.abspath(__file__)))
+    top, seen = {}, set()
+    for m in _LINE.finditer(proc.stderr):
+        seen.add(m.group(4))
+        if len(m.group(3)) == 1:  # one space: imported directly by the script, not by another module
+            top[m.group(4)] = top.get(m.group(4), 0) + int(m.group(2))
+    return top, seen
+
+
+def parse_budget(spec):
+    pairs = (item.split("=", 1) for item in (spec or "").split(",") if item.strip())
+    return {target.strip(): float(ms) for target, ms in pairs}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark cold-start import time of the app and CLIs.")
+    ap.add_argument("--targets", default=",".join(TARGETS), help="Comma-separated subset of " + ", ".join(TARGETS))
+    ap.add_argument("--repeat", type=int, default=5, help="Fresh interpreters per target (best one counts)")
+    ap.add_argument("--top", type=int, default=5, help="Slowest top-level imports to list per target")
+    ap.add_argument("--budget", type=parse_budget, default={}, help="Import-time budgets in ms, e.g. app=400")
+    ap.add_argument("--json", help="Also write the results to this JSON file")
+    args = ap.parse_args()
+
+    results, over = {}, []
+    print(f"{'target':<18}{'import ms':>10}{'budget':>9}  heavy modules loaded / slowest imports")
+    for target in args.targets.split(","):
+        runs = [import_profile(TARGETS[target]) for _ in range(args.repeat)]
+        top, seen = min(runs, key=lambda run: sum(run[0].values()))
+        total_ms = sum(top.values()) / 1000
+        heavy = sorted(name for name in HEAVY if name in seen)
+        budget = args.budget.get(target)
+        flag = "" if budget is None else f"{budget:.0f}" + (" !" if total_ms > budget else "")
+        if budget is not None and total_ms > budget:
+            over.append(target)
+        slowest = sorted(top.items(), key=lambda kv: -kv[1])[:args.top]
+        results[target] = {"import_ms": round(total_ms, 1), "heavy": heavy,
+                           "slowest": {name: round(us / 1000, 1) for name, us in slowest}}
+        print(f"{target:<18}{total_ms:>10.0f}{flag:>9}  {', '.join(heavy) or '-'}")
+        print(f"{'':<37}  " + ", ".join(f"{name} {us / 1000:.0f}" for name, us in slowest))
+
+    missing = [target for target in args.budget if target not in results]
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k != "json"}, "targets": results}, f, indent=2)
+    if over or missing:
+        print(f"\nFAIL: over budget {over}, unknown targets {missing}")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,77 @@
+# bench_locate.py
+# Meter photo localization (utils.locate_meter_roi) on synthetic bills the fixed ROI_BBOX gets wrong:
+# rotated pages, scanned (rasterized) pages and a meter photo moved to another spot on the template.
+# Reports locate time, the method used, IoU with the true photo rect and how the crop area compares
+# to the fixed box.
+# Usage:
+#   python bench-locate.py --repeat 5
+
+import argparse
+import statistics
+import sys
+import time
+
+import fitz  # PyMuPDF
+
+from synthetic_bills import METER_BBOX, make_bill_pdf
+from utils import locate_meter_roi
+
+MOVED_BBOX = (60, 560, 252, 701)  # same size as METER_BBOX, bottom-left of the page
+
+
+def fixtures():
+    cases = []
+    for rotation in (0, 90, 180, 270):
+        cases.append((f"rot{rotation}", make_bill_pdf(rotation=rotation), METER_BBOX))
+        cases.append((f"rot{rotation}-scan", make_bill_pdf(rotation=rotation, rasterize=True), METER_BBOX))
+    cases.append(("moved", make_bill_pdf(bbox=MOVED_BBOX), MOVED_BBOX))
+    cases.append(("moved-scan", make_bill_pdf(bbox=MOVED_BBOX, rasterize=True), MOVED_BBOX))
+    cases.append(("jpeg", make_bill_pdf(embed="jpeg"), METER_BBOX))
+    return cases
+
+
+def photo_rect(bbox):
+    """Where the meter photo actually lands (insert_image keeps its aspect ratio inside bbox),
+    in unrotated page coordinates."""
+    doc = fitz.open(stream=make_bill_pdf(bbox=bbox, logo=False), filetype="pdf")
+    rect = fitz.Rect(doc[0].get_image_info()[0]["bbox"])
+    doc.close()
+    return rect
+
+
+def iou(a, b):
+    inter = abs(a & b)
+    union = abs(a) + abs(b) - inter
+    return inter / union if union else 0.0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark meter photo localization.")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    print(f"{'case':<14}{'method':>9}{'ms':>8}{'IoU':>7}{'fixed IoU':>11}{'area vs fixed':>15}")
+    ious = []
+    for name, pdf_bytes, truth_bbox in fixtures():
+        doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+        page = doc[0]
+        rot = page.rotation_matrix
+        truth = photo_rect(truth_bbox) * rot
+        fixed = fitz.Rect(*METER_BBOX)  # what a plain clip=ROI_BBOX crops on the visible page
+        times = []
+        for _ in range(args.repeat):
+            t0 = time.perf_counter()
+            rect, method = locate_meter_roi(page, hint_bbox=METER_BBOX)
+            times.append((time.perf_counter() - t0) * 1000)
+        doc.close()
+        score = iou(rect, truth) if rect is not None else 0.0
+        ious.append(score)
+        area = abs(rect) / abs(fixed) if rect is not None else 0.0
+        print(f"{name:<14}{method:>9}{statistics.median(times):>8.1f}{score:>7.2f}"
+              f"{iou(fixed, truth):>11.2f}{area:>14.2f}x")
+    print(f"mean IoU {statistics.mean(ious):.2f}, min {min(ious):.2f}")
+    return 0 if min(ious) >= 0.7 else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
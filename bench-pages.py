@@ -0,0 +1,88 @@
+# bench_pages.py
+# Follow-up turns on a multi-page bill with page slicing off (whole bill every turn) and on (only the
+# pages a question is about). Reports pages sent, input tokens and turn latency per question against
+# the local stub API; --token-latency makes the stub's response time grow with the prompt.
+# Usage:
+#   python bench-pages.py --pages 6 --token-latency 0.05
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bill_session
+from agent_factory import build_client
+from bill_session import BillSession
+from stub_openai import StubOpenAIServer
+from synthetic_bills import make_bill_pdf
+from upload_cache import UploadCache
+
+QUESTIONS = [
+    "Which slab rates apply to my bill?",
+    "Show my billing history for March",
+    "How can I pay online?",
+    "Why is the fuel price adjustment so high?",
+    "How does my consumption compare with previous months?",
+    "Is the meter photo clear?",
+    "Summarize everything on this bill",
+]
+
+
+def run(client, upload_cache, pool, pdf_bytes, slicing):
+    bill_session.PAGE_SLICING = slicing
+    session = BillSession(client, upload_cache, pool)
+    session.load("bill.pdf", pdf_bytes)
+    session.first_turn()
+    session.swap_roi_for_full_pdf()
+    rows = []
+    for question in QUESTIONS:
+        mark = len(session.trace)
+        t0 = time.perf_counter()
+        _, route = session.ask(question)
+        ms = (time.perf_counter() - t0) * 1000
+        new = session.trace[mark:]
+        turn = next((e for e in new if e["stage"] == "followup_turn"), {})
+        tokens = sum(e["input_tokens"] for e in new if e["stage"] == "usage")
+        rows.append((question, route, turn.get("pages", "-"), tokens, ms))
+    return rows
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark page-aware slicing on multi-page bills.")
+    ap.add_argument("--pages", type=int, default=6, help="Pages in the synthetic bill")
+    ap.add_argument("--scan", action="store_true", help="Rasterize the bill (no text layer)")
+    ap.add_argument("--latency", type=float, default=0.05, help="Stub seconds per call")
+    ap.add_argument("--token-latency", type=float, default=0.02, help="Stub seconds per 1k input tokens")
+    args = ap.parse_args()
+
+    pdf_bytes = make_bill_pdf(pages=args.pages, fields=True, rasterize=args.scan)
+    server = StubOpenAIServer(latency=args.latency, token_latency=args.token_latency).start()
+    tmp = tempfile.mkdtemp()
+    pool = ThreadPoolExecutor(max_workers=4)
+    try:
+        client = build_client(api_key="sk-bench", base_url=server.base_url)
+        run(client, UploadCache(path=os.path.join(tmp, "warmup.sqlite3")), pool, make_bill_pdf(), True)
+        results = {}
+        for slicing in (False, True):
+            upload_cache = UploadCache(path=os.path.join(tmp, f"uploads-{slicing}.sqlite3"))
+            results[slicing] = run(client, upload_cache, pool, pdf_bytes, slicing)
+    finally:
+        pool.shutdown()
+        server.stop()
+
+    print(f"{args.pages}-page {'scanned' if args.scan else 'digital'} bill, {len(pdf_bytes) // 1024} KiB\n")
+    print(f"{'question':<54}{'route':>6}{'pages':>7}{'tokens full':>13}{'sliced':>8}{'ms full':>9}{'sliced':>8}")
+    for full, sliced in zip(results[False], results[True]):
+        print(f"{full[0][:52]:<54}{sliced[1]:>6}{str(sliced[2]):>7}{full[3]:>13}{sliced[3]:>8}"
+              f"{full[4]:>9.0f}{sliced[4]:>8.0f}")
+    for slicing, rows in results.items():
+        print(f"{'sliced' if slicing else 'full':<7} total input tokens {sum(r[3] for r in rows):>7}, "
+              f"mean turn {statistics.mean(r[4] for r in rows):.0f} ms")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
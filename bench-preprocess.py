@@ -0,0 +1,101 @@
+# bench_preprocess.py
+# Throughput of meter-ROI preprocessing for bulk runs, in images/s: the previous one-image pipeline
+# (full-resolution sigma-25 background, CLAHE and kernels built per call) vs preprocess_meter's
+# preprocess_masks (downsampled background, reused CLAHE/kernels) vs preprocess_batch across a process
+# pool -- with shared-memory buffers, and with pickled arrays for comparison. Also reports how many mask
+# pixels differ from the previous pipeline.
+# Usage:
+#   python bench-preprocess.py --images 256 --dpi 500
+#   python bench-preprocess.py --images 512 --dpi 300 --processes 4
+
+import argparse
+import multiprocessing
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import cv2
+import numpy as np
+
+import preprocess_meter
+from preprocess_meter import dot_area_bounds, filter_components_by_area, init_batch_worker, preprocess_batch
+from synthetic_bills import make_bill_pdf
+from utils import pixmap_to_bgr, render_roi
+
+ROI_BBOX = (348, 469, 540, 610)
+
+
+def legacy_preprocess(img_bgr, dpi=None):
+    """preprocess_masks()["combo"] as it was: full-resolution background blur, objects built per call."""
+    gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+    bg = np.clip(cv2.GaussianBlur(gray, (0, 0), sigmaX=25, sigmaY=25), 1, None)
+    norm = cv2.divide(gray, bg, scale=255)
+    hi = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8, 8)).apply(norm)
+    den = cv2.bilateralFilter(hi, d=7, sigmaColor=25, sigmaSpace=7)
+    digits = cv2.adaptiveThreshold(den, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C, cv2.THRESH_BINARY_INV, 35, 7)
+    digits = cv2.morphologyEx(digits, cv2.MORPH_OPEN, np.ones((2, 2), np.uint8), iterations=1)
+    blackhat = cv2.morphologyEx(den, cv2.MORPH_BLACKHAT, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3, 3)))
+    bh_norm = cv2.normalize(blackhat, None, 0, 255, cv2.NORM_MINMAX)
+    _, dot_mask = cv2.threshold(bh_norm, 0, 255, cv2.THRESH_BINARY + cv2.THRESH_OTSU)
+    combo = cv2.bitwise_or(digits, filter_components_by_area(dot_mask, *dot_area_bounds(dpi)))
+    return cv2.morphologyEx(combo, cv2.MORPH_DILATE, np.ones((2, 2), np.uint8), iterations=1)
+
+
+def _mask(img, dpi):
+    return preprocess_meter.preprocess_masks(img, dpi=dpi)["combo"]
+
+
+def roi_images(count, dpi, templates=16):
+    """count ROIs rendered at dpi from a few synthetic bills (PNG, JPEG and scanned)."""
+    rois = []
+    for i in range(templates):
+        pdf = make_bill_pdf(f"{(i * 7919) % 100000:05d}.{i % 100:02d}", embed="jpeg" if i % 2 else "png",
+                            rasterize=i % 3 == 0, seed=i)
+        pix, _ = render_roi(pdf, page_number=0, bbox=ROI_BBOX, dpi=dpi)
+        rois.append(pixmap_to_bgr(pix))
+    return [rois[i % templates] for i in range(count)]
+
+
+def timed(fn):
+    t0 = time.perf_counter()
+    out = fn()
+    return out, time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark batch preprocessing of meter ROIs (images/s).")
+    ap.add_argument("--images", type=int, default=256)
+    ap.add_argument("--dpi", type=int, default=500, help="ROI render DPI")
+    ap.add_argument("--processes", type=int, default=os.cpu_count())
+    args = ap.parse_args()
+
+    images = roi_images(args.images, args.dpi)
+    h, w = images[0].shape[:2]
+    reference, legacy_s = timed(lambda: [legacy_preprocess(img, args.dpi) for img in images])
+    rows = [("legacy, one by one", legacy_s)]
+    masks, s = timed(lambda: [_mask(img, args.dpi) for img in images])
+    rows.append(("preprocess_masks, one by one", s))
+    diff = np.mean([(a != b).mean() for a, b in zip(reference, masks)])
+
+    with ProcessPoolExecutor(args.processes, initializer=init_batch_worker,
+                             mp_context=multiprocessing.get_context("spawn")) as pool:
+        list(pool.map(_mask, images[:args.processes], [args.dpi] * args.processes))  # start the workers
+        chunk = max(1, len(images) // (args.processes * 4))
+        pickled, s = timed(lambda: list(pool.map(_mask, images, [args.dpi] * len(images), chunksize=chunk)))
+        rows.append((f"process pool x{args.processes}, pickled", s))
+        shared, s = timed(lambda: preprocess_batch(images, dpi=args.dpi, executor=pool))
+        rows.append((f"preprocess_batch x{args.processes}, shared memory", s))
+    same = all(np.array_equal(a, b) for a, b in zip(masks, shared)) and \
+        all(np.array_equal(a, b) for a, b in zip(masks, pickled))
+
+    print(f"{len(images)} ROIs of {w}x{h} px ({args.dpi} DPI), {os.cpu_count()} CPUs\n")
+    print(f"{'pipeline':<42}{'images/s':>10}{'speedup':>9}")
+    for name, seconds in rows:
+        print(f"{name:<42}{len(images) / seconds:>10.1f}{legacy_s / seconds:>8.1f}x")
+    print(f"\nmask pixels differing from legacy: {diff:.3%}; batch masks identical to one-by-one: {same}")
+    return 0 if same else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
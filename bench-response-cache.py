@@ -0,0 +1,69 @@
+# bench_response_cache.py
+# Per-turn latency and hit rate with the response cache off / in memory / in SQLite, for sessions that
+# re-upload a small set of bills and ask the usual questions. Runs against the local stub API;
+# --latency stands in for a real model call.
+# Usage:
+#   python bench-response-cache.py --sessions 50 --bills 5 --latency 0.3
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import tempfile
+import time
+
+from agent_factory import INITIAL_QUESTION, HumanMessage, build_client, build_response_cache, create_agent
+from stub_openai import StubOpenAIServer
+
+QUESTIONS = [
+    "What is the amount payable?",
+    "What is the due date?",
+    "How many units were consumed?",
+    "What is the tariff?",
+    "Is there anything about arrears on it?",  # context-dependent wording: never cached
+]
+
+
+def run_sessions(client, cache, sessions, bills, seed=0):
+    rng = random.Random(seed)
+    samples = []
+    for _ in range(sessions):
+        doc_hash = f"bill-{rng.randrange(bills)}"
+        previous_id = None
+        for question in [INITIAL_QUESTION] + rng.sample(QUESTIONS, 3):
+            agent = create_agent([f"file-{doc_hash}"], client=client, previous_response_id=previous_id,
+                                 cache=cache, doc_hash=doc_hash)
+            t0 = time.perf_counter()
+            agent.invoke({"messages": [HumanMessage(content=question)]})
+            samples.append(time.perf_counter() - t0)
+            previous_id = agent.response_id
+    return samples
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark the response cache backends.")
+    ap.add_argument("--sessions", type=int, default=50)
+    ap.add_argument("--bills", type=int, default=5, help="Distinct bills the sessions re-upload")
+    ap.add_argument("--latency", type=float, default=0.1, help="Simulated seconds per model call")
+    args = ap.parse_args()
+
+    server = StubOpenAIServer(latency=args.latency).start()
+    tmp = tempfile.mkdtemp()
+    try:
+        client = build_client(api_key="sk-bench", base_url=server.base_url)
+        print(f"{'cache':<8}{'turns':>7}{'mean ms':>10}{'p50 ms':>9}{'p95 ms':>9}{'hit rate':>10}")
+        for kind in ("off", "memory", "sqlite"):
+            cache = build_response_cache(kind, path=os.path.join(tmp, "responses.sqlite3"))
+            samples = sorted(run_sessions(client, cache, args.sessions, args.bills))
+            p95 = samples[int(len(samples) * 0.95) - 1]
+            hit_rate = f"{cache.stats()['hit_rate']:.0%}" if cache else "-"
+            print(f"{kind:<8}{len(samples):>7}{statistics.mean(samples) * 1000:>10.1f}"
+                  f"{samples[len(samples) // 2] * 1000:>9.2f}{p95 * 1000:>9.1f}{hit_rate:>10}")
+    finally:
+        server.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,217 @@
+# bench_service.py
+# Load test for the serving layer: simulated users upload a bill, wait for the first answer and ask
+# follow-ups, at rising concurrency, against one process -- one pod. "service" users go through the
+# HTTP API of bill_service.py (submit + poll); "inline" users run a blocking BillSession on their own
+# thread, which is what a Streamlit script thread per user does. The stub API runs in a separate
+# process so its CPU isn't billed to the pod. Reports sessions/s per level, session p50/p95 and 503s.
+# Usage:
+#   python bench-service.py --users 8,32,128
+#   python bench-service.py --users 256 --mode service --workers 128 --queue 64 --json bench-service.json
+#   python bench-service.py --users 128 --mode service --poll 0.1     # short polling instead of ?wait=
+
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import httpx
+
+import bill_service
+from agent_factory import build_client
+from bill_service import BillService, start_api_server
+from bill_session import BillSession
+from synthetic_bills import make_bill_pdf
+from upload_cache import UploadCache
+
+FOLLOWUPS = [
+    "Which tariff am I on?",
+    "Summarize the charges on this bill",
+    "How does my consumption compare with previous months?",
+]
+
+
+def start_stub(latency, jitter):
+    """The stub API in its own process; returns (process, base_url)."""
+    proc = subprocess.Popen(
+        [sys.executable, "stub_openai.py", "--port", "0", "--latency", latency, "--jitter", str(jitter)],
+        stdout=subprocess.PIPE, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    line = proc.stdout.readline()  # "Stub OpenAI API on http://127.0.0.1:<port>/v1 (...)"
+    return proc, line.split(" on ", 1)[1].split()[0]
+
+
+class Bills:
+    """Distinct bill bytes per session (a unique trailing comment defeats the upload cache) over a few
+    rendered templates; about model_share of them need the model for the first turn."""
+
+    def __init__(self, model_share, templates=16):
+        self.templates = [
+            make_bill_pdf("" if i < round(templates * model_share) else f"{(i * 7919) % 100000:05d}.{i % 100:02d}",
+                          embed="jpeg" if i % 2 else "png", seed=i)
+            for i in range(templates)
+        ]
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def take(self):
+        with self._lock:
+            n, self._next = self._next, self._next + 1
+        return self.templates[n % len(self.templates)] + f"\n% bench session {n}\n".encode()
+
+
+def service_user(http, bills, rounds, followups, poll, rejects):
+    """One user against the HTTP API; returns session times in ms."""
+    def submit(path, params=(), **kwargs):
+        while True:
+            resp = http.post(path, params={**dict(params), **({} if poll else {"wait": 20})}, **kwargs)
+            if resp.status_code != 503:
+                resp.raise_for_status()
+                return resp.json()
+            rejects.append(1)
+            time.sleep(float(resp.headers.get("Retry-After", "1")))
+
+    def finished(job):
+        while job["status"] in bill_service.PENDING:
+            if poll:
+                time.sleep(poll)
+            job = http.get(f"/v1/jobs/{job['id']}", params={} if poll else {"wait": 20}).json()
+        if job["status"] != "done":
+            raise RuntimeError(job["error"])
+        return job
+
+    times = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        job = finished(submit("/v1/bills", params={"name": "bill.pdf"}, content=bills.take()))
+        session_id = job["result"]["session_id"]
+        for question in followups:
+            finished(submit(f"/v1/bills/{session_id}/questions", json={"question": question}))
+        http.delete(f"/v1/bills/{session_id}")
+        times.append((time.perf_counter() - t0) * 1000)
+    return times
+
+
+def inline_user(client, upload_cache, pool, bills, rounds, followups):
+    times = []
+    for _ in range(rounds):
+        t0 = time.perf_counter()
+        session = BillSession(client, upload_cache, pool)
+        session.load("bill.pdf", bills.take())
+        session.first_turn()
+        session.swap_roi_for_full_pdf()
+        for question in followups:
+            session.ask(question)
+        session.close()
+        times.append((time.perf_counter() - t0) * 1000)
+    return times
+
+
+def run_level(users, user_fn):
+    errors = []
+
+    def one(i):
+        try:
+            return user_fn(i)
+        except Exception as e:
+            errors.append(f"{type(e).__name__}: {e}")
+            return []
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=users) as clients:
+        times = [ms for user_times in clients.map(one, range(users)) for ms in user_times]
+    return times, time.perf_counter() - t0, errors
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Load-test the bill service (sessions/s per pod).")
+    ap.add_argument("--users", default="8,32,128", help="Concurrent users per level, comma-separated")
+    ap.add_argument("--rounds", type=int, default=2, help="Sessions per user per level")
+    ap.add_argument("--followups", type=int, default=2)
+    ap.add_argument("--mode", default="both", choices=["both", "service", "inline"])
+    ap.add_argument("--model-share", type=float, default=0.3, help="Share of bills the local reader can't read")
+    ap.add_argument("--latency", default="files.create=0.3,files.delete=0.1,responses.create=1.0",
+                    help="Stub latency, seconds or per endpoint")
+    ap.add_argument("--jitter", type=float, default=0.2)
+    ap.add_argument("--workers", type=int, default=bill_service.JOB_WORKERS)
+    ap.add_argument("--queue", type=int, default=bill_service.JOB_QUEUE_MAX)
+    ap.add_argument("--processes", type=int, default=bill_service.RENDER_PROCESSES)
+    ap.add_argument("--poll", type=float, default=0.0,
+                    help="Seconds between short polls; 0 long-polls (?wait=20 on submit and poll)")
+    ap.add_argument("--json", help="Also write the results to this JSON file")
+    args = ap.parse_args()
+
+    levels = [int(u) for u in args.users.split(",")]
+    followups = [FOLLOWUPS[i % len(FOLLOWUPS)] for i in range(args.followups)]
+    modes = ["inline", "service"] if args.mode == "both" else [args.mode]
+    bills = Bills(args.model_share)
+    stub, base_url = start_stub(args.latency, args.jitter)
+    tmp = tempfile.mkdtemp()
+    results = []
+    try:
+        client = build_client(api_key="sk-bench", base_url=base_url)
+        for mode in modes:
+            upload_cache = UploadCache(path=os.path.join(tmp, f"uploads-{mode}.sqlite3"))
+            if mode == "service":
+                service = BillService(client, upload_cache, workers=args.workers, queue_max=args.queue,
+                                      processes=args.processes).start()
+                api = start_api_server(service, port=0, host="127.0.0.1")
+                url = f"http://127.0.0.1:{api.server_address[1]}"
+                # Built up front: each client's SSL context costs more CPU than a session's requests
+                https = [httpx.Client(base_url=url, limits=httpx.Limits(max_connections=1), timeout=120)
+                         for _ in range(max(levels))]
+                pool = None
+            else:
+                pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="bill-io")
+            if mode == "service":
+                def user(i, rounds, rejects):
+                    return service_user(https[i], bills, rounds, followups, args.poll, rejects)
+            else:
+                def user(i, rounds, rejects):
+                    return inline_user(client, upload_cache, pool, bills, rounds, followups)
+            try:
+                run_level(1, lambda i: user(i, 1, []))  # warm imports and connections, not reported
+                for users in levels:
+                    rejects = []
+                    times, wall, errors = run_level(users, lambda i: user(i, args.rounds, rejects))
+                    ordered = sorted(times) or [0.0]
+                    results.append({
+                        "mode": mode, "users": users, "sessions": len(times), "errors": len(errors),
+                        "sessions_per_s": round(len(times) / wall, 2),
+                        "p50_ms": round(statistics.median(ordered), 1),
+                        "p95_ms": round(ordered[int(0.95 * (len(ordered) - 1))], 1),
+                        "rejected": len(rejects), "first_error": errors[0] if errors else None,
+                    })
+            finally:
+                if mode == "service":
+                    for http in https:
+                        http.close()
+                    api.shutdown()
+                    service.stop()
+                else:
+                    pool.shutdown()
+    finally:
+        stub.terminate()
+
+    print(f"stub latency {args.latency}, {args.followups} follow-ups per session, {args.rounds} sessions per user, "
+          f"service: {args.workers} workers, queue {args.queue}, {args.processes} render processes\n")
+    print(f"{'mode':<9}{'users':>6}{'sessions':>10}{'sess/s':>9}{'p50 ms':>9}{'p95 ms':>9}{'503s':>7}{'errors':>8}")
+    for r in results:
+        print(f"{r['mode']:<9}{r['users']:>6}{r['sessions']:>10}{r['sessions_per_s']:>9.2f}{r['p50_ms']:>9.0f}"
+              f"{r['p95_ms']:>9.0f}{r['rejected']:>7}{r['errors']:>8}")
+    for r in results:
+        if r["first_error"]:
+            print(f"{r['mode']} x{r['users']}: {r['first_error']}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "levels": results}, f, indent=2)
+    return 1 if any(r["errors"] for r in results) else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
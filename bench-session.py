@@ -0,0 +1,203 @@
+# bench_session.py
+# End-to-end session benchmark: upload -> crop -> first turn -> swap -> follow-ups, through the same
+# BillSession the app uses, for N simulated sessions (C at a time) against the local stub API.
+# Reports p50/p95 per stage and session throughput; --budget turns it into a CI gate (exit 1 when a
+# stage's p95 is over budget). Also prints input / cached / output tokens per model. No network or API key needed.
+# Usage:
+#   python bench-session.py --sessions 40 --concurrency 8
+#   python bench-session.py --latency files.create=0.3,responses.create=0.8 --jitter 0.2 --stream-delay 0.01
+#   python bench-session.py --budget session=2500,first_turn=900 --json bench-session.json
+#   python bench-session.py --faults responses.create=0.2 --retry-after 0.3 --slow 0.04=3 --hedge --model-share 1
+
+import argparse
+import json
+import os
+import statistics
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import bill_session
+import resilience
+from agent_factory import build_client, build_response_cache
+from bill_session import BillSession, invoke_agent
+from metrics import EVENTS, TOKENS
+from stub_openai import StubOpenAIServer, parse_faults, parse_latency, parse_slow
+from synthetic_bills import make_bill_pdf
+from upload_cache import UploadCache
+
+FOLLOWUPS = [
+    "What is the reference number?",
+    "What is the amount payable?",
+    "Which tariff am I on?",
+    "Is the meter photo clear?",
+]
+ANSWERS = [
+    ("reading on the meter", "the electricity meter reads: 04512.37"),
+    ("amount payable", "The amount payable is Rs. 4,210."),
+]
+
+
+def make_bills(count, model_share):
+    """Distinct synthetic bills; about model_share of them have a blank display the local reader can't read."""
+    bills = []
+    for i in range(count):
+        blank = i < round(count * model_share)
+        reading = "" if blank else f"{(i * 7919) % 100000:05d}.{i % 100:02d}"
+        bills.append(make_bill_pdf(reading, embed="jpeg" if i % 2 else "png", seed=i))
+    return bills
+
+
+def stream_agent(agent, messages):
+    # What the app does with STREAM_RESPONSES: consume the deltas as they arrive
+    return "".join(agent.stream({"messages": messages}))
+
+
+def run_session(client, upload_cache, pool, response_cache, pdf_bytes, followups, run):
+    session = BillSession(client, upload_cache, pool, response_cache)
+    t0 = time.perf_counter()
+    t_load = time.perf_counter()
+    session.load("bill.pdf", pdf_bytes)
+    load_ms = (time.perf_counter() - t_load) * 1000
+    _, source = session.first_turn(run=run)
+    session.swap_roi_for_full_pdf()
+    for question in followups:
+        session.ask(question, run=run)
+    spans = [e for e in session.trace if "ms" in e]
+    spans.append({"stage": "load", "ms": load_ms})
+    spans.append({"stage": "session", "ms": (time.perf_counter() - t0) * 1000})
+    session.close()  # what the app's session manager does once the session goes idle
+    return spans, source
+
+
+def percentile(ordered, q):
+    return ordered[min(len(ordered) - 1, max(0, int(round(q * (len(ordered) - 1)))))]
+
+
+def parse_budget(spec):
+    pairs = (item.split("=", 1) for item in (spec or "").split(",") if item.strip())
+    return {stage.strip(): float(ms) for stage, ms in pairs}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Benchmark full bill sessions against the stub OpenAI API.")
+    ap.add_argument("--sessions", type=int, default=40)
+    ap.add_argument("--concurrency", type=int, default=8, help="Sessions running at once")
+    ap.add_argument("--followups", type=int, default=3, help="Follow-up questions per session")
+    ap.add_argument("--model-share", type=float, default=0.3, help="Share of bills the local reader can't read")
+    ap.add_argument("--latency", type=parse_latency, default=parse_latency("files.create=0.15,responses.create=0.3"),
+                    help='Stub latency: seconds, or per endpoint "files.create=0.3,responses.create=0.8"')
+    ap.add_argument("--jitter", type=float, default=0.2)
+    ap.add_argument("--stream-delay", type=float, default=0.0, help="Stub seconds per streamed delta")
+    ap.add_argument("--token-latency", type=float, default=0.0, help="Stub seconds per 1k input tokens")
+    ap.add_argument("--faults", type=parse_faults, default={},
+                    help='Stub failure share per endpoint, e.g. "responses.create=0.2,files.create=0.1"')
+    ap.add_argument("--fault-status", type=int, default=429)
+    ap.add_argument("--retry-after", type=float, default=None, help="Retry-After seconds the stub sends")
+    ap.add_argument("--slow", type=parse_slow, default=(0.0, 0.0), help='Stub long tail "share=seconds"')
+    ap.add_argument("--attempts", type=int, default=resilience.RETRY_ATTEMPTS, help="Tries per API call")
+    ap.add_argument("--rps", type=float, default=resilience.RATE_LIMIT_RPS, help="Client rate limit (0: off)")
+    ap.add_argument("--hedge", action="store_true", help="Hedge the first model turn at its p95")
+    ap.add_argument("--invoke", action="store_true", help="Blocking invoke instead of streaming")
+    ap.add_argument("--response-cache", default="off", choices=["off", "memory", "sqlite"])
+    ap.add_argument("--budget", type=parse_budget, default={}, help="p95 budgets in ms, e.g. session=2500,load=300")
+    ap.add_argument("--json", help="Also write the results to this JSON file")
+    args = ap.parse_args()
+
+    bills = make_bills(args.sessions, args.model_share)
+    followups = [FOLLOWUPS[i % len(FOLLOWUPS)] for i in range(args.followups)]
+    run = invoke_agent if args.invoke else stream_agent
+    resilience.RETRY_ATTEMPTS = args.attempts
+    resilience.LIMITER = resilience.RateLimiter(args.rps, resilience.RATE_LIMIT_BURST)
+    bill_session.HEDGE_FIRST_TURN = args.hedge
+
+    server = StubOpenAIServer(latency=args.latency, jitter=args.jitter, stream_delay=args.stream_delay,
+                              token_latency=args.token_latency, answers=ANSWERS, faults=args.faults,
+                              fault_status=args.fault_status, retry_after=args.retry_after,
+                              slow_share=args.slow[0], slow_latency=args.slow[1]).start()
+    tmp = tempfile.mkdtemp()
+    samples, sources, errors = {}, {}, []
+    lock = threading.Lock()
+    try:
+        client = build_client(api_key="sk-bench", base_url=server.base_url)
+        upload_cache = UploadCache(path=os.path.join(tmp, "uploads.sqlite3"))
+        response_cache = build_response_cache(args.response_cache, path=os.path.join(tmp, "responses.sqlite3"))
+        pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="bill-io")  # the app's background pool
+
+        def one(pdf_bytes):
+            try:
+                spans, source = run_session(client, upload_cache, pool, response_cache, pdf_bytes, followups, run)
+            except Exception as e:
+                with lock:
+                    errors.append(f"{type(e).__name__}: {e}")
+                return
+            with lock:
+                sources[source] = sources.get(source, 0) + 1
+                for entry in spans:
+                    samples.setdefault(entry["stage"], []).append(entry["ms"])
+
+        # warm imports, the connection pool and OpenCV before timing
+        run_session(client, upload_cache, pool, None, make_bill_pdf(seed=10_000), followups[:1], run)
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.concurrency) as sessions:
+            list(sessions.map(one, bills))
+        wall = time.perf_counter() - t0
+        pool.shutdown()
+        leaked = upload_cache.stats()["references"]
+    finally:
+        server.stop()
+
+    done = len(samples.get("session", []))
+    print(f"{done}/{args.sessions} sessions, concurrency {args.concurrency}, {args.followups} follow-ups each, "
+          f"first turn: {sources}")
+    print(f"throughput: {done / wall:.2f} sessions/s, {done * (1 + args.followups) / wall:.1f} turns/s "
+          f"({wall:.1f}s wall)")
+    print(f"stub calls: { {k: v['calls'] for k, v in server.stats.items()} }, "
+          f"faults: { {k: v.get('faults', 0) for k, v in server.stats.items() if v.get('faults')} }")
+    events = {}
+    for key, value in EVENTS._values.items():
+        event = dict(key)["event"]
+        if event in ("retry", "hedge", "deadline_exceeded"):
+            events[event] = events.get(event, 0) + value
+    print(f"resilience events: {events}")
+    tokens = {}
+    for key, value in TOKENS._values.items():
+        labels = dict(key)
+        tokens.setdefault(labels["model"], {}).setdefault(labels["kind"], 0)
+        tokens[labels["model"]][labels["kind"]] += value
+    for model, kinds in sorted(tokens.items()):
+        print(f"{model}: {kinds.get('input', 0):,} input tokens, {kinds.get('cached_input', 0):,} cached "
+              f"({kinds.get('cached_input', 0) / max(1, kinds.get('input', 0)):.0%}), "
+              f"{kinds.get('output', 0):,} output")
+    print(f"after close: {leaked} upload references held, {len(server.files)} remote files kept by the cache\n")
+    print(f"{'stage':<22}{'n':>6}{'p50 ms':>10}{'p95 ms':>10}{'max ms':>10}{'budget':>10}")
+    results, over = {}, []
+    for stage in sorted(samples, key=lambda s: -statistics.median(samples[s])):
+        ordered = sorted(samples[stage])
+        p50, p95 = percentile(ordered, 0.5), percentile(ordered, 0.95)
+        budget = args.budget.get(stage)
+        flag = "" if budget is None else (f"{budget:.0f}" + (" !" if p95 > budget else ""))
+        if budget is not None and p95 > budget:
+            over.append(stage)
+        results[stage] = {"n": len(ordered), "p50_ms": round(p50, 2), "p95_ms": round(p95, 2),
+                          "max_ms": round(ordered[-1], 2)}
+        print(f"{stage:<22}{len(ordered):>6}{p50:>10.1f}{p95:>10.1f}{ordered[-1]:>10.1f}{flag:>10}")
+
+    missing = [stage for stage in args.budget if stage not in samples]
+    for e in errors[:5]:
+        print(f"error: {e}")
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": {k: v for k, v in vars(args).items() if k != "json"},
+                       "throughput_sessions_per_s": done / wall, "errors": len(errors),
+                       "tokens": tokens, "stages": results}, f, indent=2, default=str)
+    if over or missing or errors:
+        print(f"\nFAIL: over budget {over}, missing stages {missing}, {len(errors)} session errors")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
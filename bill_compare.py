@@ -0,0 +1,200 @@
+# bill_compare.py
+# Comparison mode: several bills (e.g. a year of monthly bills) in one conversation. Each bill is
+# parsed once, concurrently, into a compact index -- its fields and per-page text/terms from
+# bill_fields.py -- and nothing is uploaded up front. Questions are answered from that index:
+#   "local" -> one field across all bills (table, change, highest/lowest), no model call
+#   "text"  -> model gets a fields table of every bill plus only the pages each bill needs
+#   "file"  -> as "text", plus page slices of scanned bills (or of the meter page, for photo questions)
+# A turn never attaches every full PDF.
+
+import hashlib
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+from bill_fields import FIELD_LABELS, SUMMARY_PAGE, VISUAL_KEYWORDS, _field_asked, extract_bill_info, select_pages
+from bill_session import BillSession, invoke_agent, upload_pdf
+from metrics import count, span
+from upload_cache import sha256_bytes
+from utils import slice_pdf_bytes
+
+COMPARE_MAX_BILLS = int(os.environ.get("COMPARE_MAX_BILLS", "12"))
+COMPARE_CONTEXT_MAX_CHARS = int(os.environ.get("COMPARE_CONTEXT_MAX_CHARS", "16000"))  # page text, all bills
+# Questions that need reasoning over the numbers, not just the numbers side by side
+REASONING_KEYWORDS = ("why", "explain", "reason", "cause", "breakdown", "break down", "calculate",
+                      "estimate", "predict", "should", "how is", "after due")
+NUMERIC_FIELDS = ("units_consumed", "payable_amount", "arrears")
+TABLE_FIELDS = ("units_consumed", "payable_amount", "due_date", "arrears", "tariff")
+
+_MONTHS = {m: i for i, m in enumerate(("JAN", "FEB", "MAR", "APR", "MAY", "JUN",
+                                        "JUL", "AUG", "SEP", "OCT", "NOV", "DEC"), 1)}
+
+
+def period_key(text):
+    """(year, month) of "JUN-24", "17-JUN-24" or "17/06/2024"; None if it isn't a date."""
+    m = re.search(r"(?:\d{1,2}[-/ ])?([A-Za-z]{3}|\d{1,2})[-/ ](\d{2,4})\s*$", text or "")
+    if not m:
+        return None
+    month = _MONTHS.get(m.group(1).upper()) if m.group(1).isalpha() else int(m.group(1))
+    year = int(m.group(2))
+    if not month or month > 12:
+        return None
+    return (year + 2000 if year < 100 else year, month)
+
+
+def index_bill(name, pdf_bytes):
+    """One bill's entry in the comparison index. Plain data, so it can be built in another process."""
+    info = extract_bill_info(pdf_bytes)
+    fields = info["fields"]
+    period = fields.get("bill_month") or fields.get("due_date")
+    return {"name": name, "doc_hash": sha256_bytes(pdf_bytes), "info": info,
+            "label": period or name, "period": period_key(period)}
+
+
+def _number(value):
+    try:
+        return float(str(value).replace(",", ""))
+    except ValueError:
+        return None
+
+
+def field_table(bills, fields=TABLE_FIELDS):
+    """Markdown table, one row per bill; columns are the fields at least one bill has."""
+    fields = [f for f in fields if any(f in b["info"]["fields"] for b in bills)]
+    lines = ["| Bill | " + " | ".join(FIELD_LABELS[f] for f in fields) + " |",
+             "|---" * (len(fields) + 1) + "|"]
+    for b in bills:
+        values = [b["info"]["fields"].get(f, "—") for f in fields]
+        if not b["info"]["has_text_layer"]:
+            values = ["(scanned)"] * len(fields)
+        lines.append(f"| {b['label']} | " + " | ".join(values) + " |")
+    return "\n".join(lines)
+
+
+def field_answer(bills, field):
+    """Local answer for one field across bills; numeric fields also get the change and extremes."""
+    rows = [(b["label"], b["info"]["fields"][field]) for b in bills]
+    lines = [f"{FIELD_LABELS[field]} by bill:"] + [f"- {label}: {value}" for label, value in rows]
+    numbers = [(label, _number(value)) for label, value in rows if _number(value) is not None]
+    if field in NUMERIC_FIELDS and len(numbers) >= 2:
+        (first_label, first), (last_label, last) = numbers[0], numbers[-1]
+        change = f"{last - first:+,.0f}" + (f" ({(last - first) / first:+.0%})" if first else "")
+        high = max(numbers, key=lambda row: row[1])
+        low = min(numbers, key=lambda row: row[1])
+        lines.append(f"\nChange from {first_label} to {last_label}: {change}. "
+                     f"Highest: {high[0]} ({high[1]:,.0f}), lowest: {low[0]} ({low[1]:,.0f}).")
+    return "\n".join(lines)
+
+
+class BillSet(BillSession):
+    """Conversation over several bills. Shares BillSession's history, response chain, turn and cleanup
+    plumbing; the bills are index entries in self.bills (oldest first) and their bytes stay in memory
+    only to slice pages for the model when a question needs the PDF itself."""
+
+    def __init__(self, client, upload_cache, pool, response_cache=None):
+        super().__init__(client, upload_cache, pool, response_cache)
+        self.bills = []
+        self._pdfs = {}  # doc_hash -> bill bytes
+
+    @property
+    def ready(self):
+        return bool(self.bills)
+
+    def load(self, files, executor=None):
+        """Index (name, pdf_bytes) pairs concurrently (on executor, default a thread per bill), oldest
+        first; bills without a billing month or due date keep their upload order at the end.
+        Returns the overview shown as the first answer."""
+        files = list(files)[:COMPARE_MAX_BILLS]
+        with span("index_bills", self.trace, bills=len(files)):
+            if executor is None:
+                with ThreadPoolExecutor(max_workers=len(files), thread_name_prefix="bill-index") as executor:
+                    entries = list(executor.map(index_bill, *zip(*files)))
+            else:
+                entries = list(executor.map(index_bill, *zip(*files)))
+        order = sorted(range(len(entries)),
+                       key=lambda i: (entries[i]["period"] is None, entries[i]["period"] or (), i))
+        self.bills = [entries[i] for i in order]
+        self._pdfs = {entry["doc_hash"]: data for entry, (_, data) in zip(entries, files)}
+        self.name = f"{len(self.bills)} bills"
+        # the response cache's document key: the set of bills, in order
+        self.doc_hash = hashlib.sha256("".join(b["doc_hash"] for b in self.bills).encode()).hexdigest()
+        scanned = [b["label"] for b in self.bills if not b["info"]["has_text_layer"]]
+        overview = f"I read {len(self.bills)} bills:\n\n" + field_table(self.bills)
+        if scanned:
+            overview += f"\n\nScanned, so read from the PDF when a question needs them: {', '.join(scanned)}."
+        self._remember("bot", overview)
+        return overview
+
+    def ask(self, question, run=invoke_agent):
+        """Comparison turn: a question naming exactly one field (bill_fields._field_asked -- no period,
+        charge or tax besides it) is answered across bills locally; anything else goes to the model
+        with the index plus the pages each bill needs. Returns (answer, route); same failure contract
+        as BillSession.ask."""
+        q = question.lower()
+        with self._asking(question):
+            field = _field_asked(q)
+            if (field and not any(k in q for k in REASONING_KEYWORDS + VISUAL_KEYWORDS)
+                    and all(field in b["info"]["fields"] for b in self.bills)):
+                answer, route = field_answer(self.bills, field), "local"
+            else:
+                context, file_ids = self.context_for(question)
+                route = "file" if file_ids else "text"
+                agent = self.make_agent(file_ids=file_ids, context_text=context,
+                                        intent="file" if file_ids else "compare")
+                with span("compare_turn", self.trace, route=route, bills=len(self.bills), chars=len(context)):
+                    answer = run(agent, self.messages())
+                self.remember_chain(agent)
+            self._remember("bot", answer)
+        count("compare_route", route=route)
+        return answer, route
+
+    def context_for(self, question):
+        """(context text, file_ids): the fields table, then per bill the text of the pages
+        select_pages picks (the summary page when it isn't confident), with pages identical to one
+        already included (tariff slabs, notices) referenced instead of repeated. Scanned bills, and
+        every bill for questions about the meter photo, contribute a page slice instead."""
+        visual = any(k in question.lower() for k in VISUAL_KEYWORDS)
+        budget = COMPARE_CONTEXT_MAX_CHARS // max(1, len(self.bills))
+        parts = [f"Comparing {len(self.bills)} bills, oldest first.\n\n"
+                 f"Fields extracted from each bill:\n{field_table(self.bills)}"]
+        seen, to_slice = {}, []
+        for bill in self.bills:
+            info = bill["info"]
+            pages = select_pages(question, info) or [SUMMARY_PAGE]
+            if visual or not info["has_text_layer"]:
+                to_slice.append((bill, pages))
+                parts.append(f"=== {bill['label']} ({bill['name']}) ===\nattached as a PDF of page(s) "
+                             + ", ".join(str(p + 1) for p in pages))
+                continue
+            text = []
+            for pno in pages:
+                page = info["pages"][pno]
+                if page in seen:
+                    text.append(f"[page {pno + 1}] same as {seen[page]}")
+                else:
+                    seen[page] = f"{bill['label']} page {pno + 1}"
+                    text.append(f"[page {pno + 1}] {page}")
+            parts.append(f"=== {bill['label']} ({bill['name']}) ===\n" + "\n".join(text)[:budget])
+        file_ids = [fid for fid in self.pool.map(lambda args: self.slice_file_id_for(*args), to_slice) if fid]
+        return "\n\n".join(parts), file_ids
+
+    def slice_file_id_for(self, bill, pages):
+        """file_id of `pages` of one bill (the whole bill when that's every page), uploaded once per
+        session; None if the upload fails -- the model still has the table."""
+        key = (bill["doc_hash"], tuple(pages))
+        if key not in self.slice_file_ids:
+            data = self._pdfs[bill["doc_hash"]]
+            name = bill["name"]
+            if len(pages) < bill["info"]["page_count"]:
+                with span("slice_pdf", self.trace, pages=len(pages)):
+                    data = slice_pdf_bytes(data, pages)
+                name = f"p{'-'.join(str(p + 1) for p in pages)}_{name}"
+            try:
+                self.slice_file_ids[key] = upload_pdf(self.client, name, data, self.upload_cache, self.trace)
+            except Exception:
+                return None
+        return self.slice_file_ids[key]
+
+    def close(self):
+        super().close()
+        self._pdfs = {}
@@ -0,0 +1,213 @@
+# bill_fields.py
+# Reads the text layer of digitally generated bills (most LESCO bills have one) once per upload,
+# pulls out the fields people usually ask about, and routes questions:
+#   "local" -> answered from the parsed fields, no model call
+#   "text"  -> model gets a compact extracted-text context instead of the PDF
+#   "file"  -> model gets the PDF (scanned bills, or questions the text can't cover)
+# and picks the pages a question is about (select_pages), so multi-page bills can send a trimmed
+# sub-document / page text instead of every tariff table and advert page.
+
+import math
+import re
+import fitz  # PyMuPDF
+
+MIN_TEXT_CHARS = 200        # less than this and we treat the bill as a scan
+CONTEXT_MAX_CHARS = 6000    # cap for the extracted-text context sent to the model
+LABEL_WINDOW = 120          # how far after a label to look for its value
+SUMMARY_PAGE = 0            # page with the bill summary and meter photo (the ROI crop's page_number)
+PAGE_MIN_SCORE = 1.0        # best page must score at least this, else send the whole bill
+PAGE_KEEP_RATIO = 0.5       # keep other pages scoring at least this fraction of the best
+PAGE_FIELD_BOOST = 1.0      # score for a page holding the label of the field the question asks about
+
+_AMOUNT = r"(?:Rs\.?\s*)?(\d{1,3}(?:,\d{3})+(?:\.\d+)?|\d+(?:\.\d+)?)"
+_DATE = r"(\d{1,2}[-/ ](?:[A-Za-z]{3}|\d{1,2})[-/ ]\d{2,4})"
+
+# field -> (label regex, value regex); first value after the label wins
+FIELD_PATTERNS = {
+    "reference_no": (r"REF(?:ERENCE)?\.?\s*(?:NO|NUMBER)", r"(\d{2}\s?\d{5}\s?\d{7}(?:\s?[A-Z]\b)?)"),
+    "units_consumed": (r"UNITS?\s*CONSUMED", r"(\d[\d,]*)"),
+    "due_date": (r"DUE\s*DATE", _DATE),
+    "payable_amount": (r"PAYABLE\s*WITHIN\s*DUE\s*DATE|AMOUNT\s*PAYABLE|NET\s*PAYABLE", _AMOUNT),
+    "arrears": (r"ARREARS?", _AMOUNT),
+    "tariff": (r"TARIFF", r"\b([A-E]-?\d{1,2}[a-zA-Z]?(?:\s?\(\d{2}\))?)"),
+    "bill_month": (r"BILL(?:ING)?\s*MONTH", r"\b([A-Z]{3}[-\s]?\d{2,4})\b"),
+}
+
+FIELD_LABELS = {
+    "reference_no": "Reference number",
+    "units_consumed": "Units consumed",
+    "due_date": "Due date",
+    "payable_amount": "Amount payable within due date",
+    "arrears": "Arrears",
+    "tariff": "Tariff",
+    "bill_month": "Billing month",
+}
+
+# keywords hinting at a field, for page selection only (select_pages); too loose to answer from
+FIELD_KEYWORDS = {
+    "reference_no": ("reference", "ref no", "ref. no", "consumer number", "account number"),
+    "units_consumed": ("units", "consumed", "consumption", "kwh"),
+    "due_date": ("due date", "last date", "deadline", "when should i pay", "when do i pay", "due"),
+    "payable_amount": ("payable", "amount", "how much", "total bill", "bill amount", "cost", "pay"),
+    "arrears": ("arrear", "outstanding", "previous balance"),
+    "tariff": ("tariff",),
+    "bill_month": ("billing month", "bill month", "which month", "billing period"),
+}
+
+# phrases that ask for exactly one field; a question naming one of them (and nothing in
+# OTHER_TERMS) is answered from the parsed fields without a model call
+FIELD_PHRASES = {
+    "reference_no": ("reference number", "reference no", "ref no", "ref. no", "consumer number",
+                     "account number"),
+    "units_consumed": ("units consumed", "units did i consume", "units did i use", "units used",
+                       "how many units", "kwh consumed"),
+    "due_date": ("due date", "last date to pay", "last date of payment", "when should i pay", "when do i pay",
+                 "payment deadline"),
+    "payable_amount": ("amount payable", "payable amount", "net payable", "bill amount", "total bill",
+                       "how much is my bill", "how much is the bill", "how much do i have to pay",
+                       "how much do i need to pay", "how much should i pay"),
+    "arrears": ("arrears", "arrear", "outstanding balance", "previous balance"),
+    "tariff": ("tariff",),
+    "bill_month": ("billing month", "bill month", "which month is this bill", "billing period"),
+}
+# other charges, taxes, slabs and time periods: the field's value on this bill isn't the answer
+OTHER_TERMS = re.compile(
+    r"\b(?:gst|tax|taxes|duty|fpa|fuel|adjustment|surcharge|fee|fees|rent|rate|rates|per unit|cost|charges?"
+    r"|slabs?|peak|off-peak|last (?:month|year|bill)|previous (?:month|year|bill)|next (?:month|year|bill)"
+    r"|this year|ago|history|average|each month|per month|monthly|yearly|annual"
+    r"|jan(?:uary)?|feb(?:ruary)?|mar(?:ch)?|apr(?:il)?|may|june?|july?|aug(?:ust)?|sep(?:t|tember)?"
+    r"|oct(?:ober)?|nov(?:ember)?|dec(?:ember)?|20\d\d)\b"
+)
+
+# questions about the meter photo need the actual PDF, not its text
+VISUAL_KEYWORDS = ("meter", "reading", "photo", "picture", "image")
+# anything that needs reasoning over the bill goes to the model
+COMPLEX_KEYWORDS = ("why", "explain", "breakdown", "break down", "compare", "calculate", "how is", "difference", "after due")
+
+
+_STOPWORDS = frozenset(
+    "the and for are was what which who how much many does did this that with from have has any "
+    "bill bills my me you your is of on in to it its can please tell there".split()
+)
+
+
+def _terms(text):
+    """Lower-cased words (3+ letters, crude plural strip) and numbers of a page or question."""
+    terms = set()
+    for word in re.findall(r"[a-z]{3,}|\d+", text.lower()):
+        if word not in _STOPWORDS:
+            terms.add(word[:-1] if len(word) > 4 and word.endswith("s") else word)
+    return terms
+
+
+def _parse_fields(text):
+    fields = {}
+    for name, (label, value) in FIELD_PATTERNS.items():
+        for m in re.finditer(label, text, flags=re.IGNORECASE):
+            found = re.search(value, text[m.end():m.end() + LABEL_WINDOW])
+            if found:
+                fields[name] = " ".join(found.group(1).split())
+                break
+    return fields
+
+
+def extract_bill_info(pdf_bytes):
+    """Parse the bill's text layer once. Returns a dict meant to be cached in session state:
+    {"has_text_layer", "fields", "pages": [page text, ...], "page_count", "page_terms": [set, ...]}"""
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        pages = [" ".join(page.get_text("text").split()) for page in doc]
+    finally:
+        doc.close()
+    full_text = "\n".join(pages)
+    has_text = len(full_text) >= MIN_TEXT_CHARS
+    return {
+        "has_text_layer": has_text,
+        "fields": _parse_fields(full_text) if has_text else {},
+        "pages": pages if has_text else [],
+        "page_count": len(pages),
+        "page_terms": [_terms(text) for text in pages] if has_text else [],
+    }
+
+
+def _field_hinted(q):
+    """The field a (lower-cased) question's keywords point to most, or None (page selection only)."""
+    scores = {f: sum(w in q for w in words) for f, words in FIELD_KEYWORDS.items()}
+    ranked = sorted(scores.items(), key=lambda kv: kv[1], reverse=True)
+    field, best = ranked[0]
+    return field if best and best > ranked[1][1] else None
+
+
+def _field_asked(q):
+    """The one field a (lower-cased) question asks for by name, or None: no field phrase, phrases of
+    several fields, or another charge / slab / period mentioned ("GST", "last month", "june")."""
+    if OTHER_TERMS.search(q):
+        return None
+    asked = {field for field, phrases in FIELD_PHRASES.items()
+             if any(re.search(r"\b" + re.escape(p) + r"\b", q) for p in phrases)}
+    return asked.pop() if len(asked) == 1 else None
+
+
+def select_pages(question, info):
+    """0-based pages of a multi-page bill that `question` is about, or None to use the whole bill
+    (single page, no text layer, nothing scores well, or nearly every page would be picked).
+    Pages are scored by question terms weighted by how few pages contain them, plus a boost for
+    the page holding the label of the field asked about."""
+    count = (info or {}).get("page_count", 0)
+    if count < 2:
+        return None
+    q = question.lower()
+    if any(k in q for k in VISUAL_KEYWORDS):
+        return [SUMMARY_PAGE]
+    page_terms = info.get("page_terms") or []
+    if not page_terms:
+        return None  # scan: nothing to score, send it all
+
+    scores = [0.0] * count
+    for term in _terms(question):
+        hits = [i for i, terms in enumerate(page_terms) if term in terms]
+        if hits:
+            weight = math.log(count / len(hits))  # words on every page say nothing
+            for i in hits:
+                scores[i] += weight
+    field = _field_hinted(q)
+    if field:
+        label = FIELD_PATTERNS[field][0]
+        for i, text in enumerate(info["pages"]):
+            if re.search(label, text, flags=re.IGNORECASE):
+                scores[i] += PAGE_FIELD_BOOST
+
+    best = max(scores)
+    if best < PAGE_MIN_SCORE:
+        return None
+    # the summary page rides along: amounts, units and dates are what most answers lean on
+    pages = [i for i, score in enumerate(scores) if score >= best * PAGE_KEEP_RATIO or i == SUMMARY_PAGE]
+    return pages if len(pages) < count else None
+
+
+def compact_context(info, max_chars=CONTEXT_MAX_CHARS, pages=None):
+    """Parsed fields first, then page text (only `pages` when given), trimmed to max_chars."""
+    lines = [f"{FIELD_LABELS[k]}: {v}" for k, v in info["fields"].items()]
+    header = "Extracted bill fields:\n" + "\n".join(lines) + "\n\n" if lines else ""
+    picked = range(len(info["pages"])) if pages is None else pages
+    body = "\n".join(f"[page {i + 1}] {info['pages'][i]}" for i in picked)
+    return (header + "Bill text:\n" + body)[:max_chars]
+
+
+def route_question(question, info, pages=None):
+    """Decide how to answer `question` for a bill parsed by extract_bill_info().
+    pages (from select_pages) limits the "text" context to those pages.
+    Returns ("local", answer), ("text", context) or ("file", None)."""
+    if not info or not info.get("has_text_layer"):
+        return "file", None
+
+    q = question.lower()
+    if any(k in q for k in VISUAL_KEYWORDS):
+        return "file", None
+    if not any(k in q for k in COMPLEX_KEYWORDS):
+        # only a question naming exactly one field (and no other charge or period) is answered locally
+        field = _field_asked(q)
+        if field in info["fields"]:
+            return "local", f"{FIELD_LABELS[field]}: {info['fields'][field]}"
+
+    return "text", compact_context(info, pages=pages)
@@ -0,0 +1,441 @@
+# bill_service.py
+# Serving layer decoupled from Streamlit reruns. Bill sessions run as jobs on one asyncio event loop
+# (a daemon thread): model calls and uploads go through a shared AsyncOpenAI client, the CPU-bound
+# render/read step (bill_session.prepare_bill) runs in a process pool, and a bounded queue refuses
+# work beyond what the process can hold instead of piling it up. Callers submit a job and poll it:
+# app.py with BILL_SERVICE=1, and internal tools over the small HTTP API below (serve-bills.py).
+#   POST   /v1/bills?name=bill.pdf         body: the PDF       -> 202 job (first turn)
+#   POST   /v1/bills/<session>/questions   {"question": "..."} -> 202 job (follow-up)
+#   GET    /v1/jobs/<job>                                      -> job: status, result or error
+#   GET    /v1/bills/<session>                                 -> history
+#   DELETE /v1/bills/<session>
+#   GET    /healthz (queue / session stats), /metrics (Prometheus)
+# The API listens on loopback by default; binding another address needs BILL_API_TOKEN, which every
+# request except /healthz must then send as "Authorization: Bearer <token>" (401 otherwise).
+# A full queue answers 503 with Retry-After (ServiceBusy in-process). Every job endpoint takes ?wait=<s>:
+# the request is held until the job finishes (200) or that many seconds pass (202/200 with it pending).
+# Waiting users then cost a parked handler thread instead of a request every 100 ms each; at a few
+# hundred users, short polling alone saturates the process.
+
+import asyncio
+import hmac
+import ipaddress
+import json
+import multiprocessing
+import os
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+from agent_factory import build_async_client
+from bill_session import BillSession
+from metrics import count, log_event, observe, render_prometheus
+from resilience import describe_error
+from session_manager import SessionManager
+
+JOB_QUEUE_MAX = int(os.environ.get("BILL_JOB_QUEUE_MAX", "256"))  # waiting jobs beyond this are refused
+JOB_WORKERS = int(os.environ.get("BILL_JOB_WORKERS", "64"))  # jobs in flight, mostly awaiting the API
+RENDER_PROCESSES = int(os.environ.get("BILL_RENDER_PROCESSES", str(os.cpu_count() or 1)))
+JOB_RESULT_TTL = float(os.environ.get("BILL_JOB_RESULT_TTL", "600"))  # seconds a finished job stays pollable
+API_MAX_WAIT = 30  # seconds a long-poll may hold a request
+REAP_INTERVAL = 30  # seconds between idle-session sweeps on the loop
+BUSY_RETRY_AFTER = 1  # seconds, sent with 503
+API_PORT = int(os.environ.get("BILL_API_PORT", "8700"))
+API_HOST = os.environ.get("BILL_API_HOST", "127.0.0.1")
+API_TOKEN = os.environ.get("BILL_API_TOKEN") or None  # required to bind anything but loopback
+API_MAX_UPLOAD = int(os.environ.get("BILL_API_MAX_UPLOAD", str(20 * 1024 * 1024)))  # bytes
+
+PENDING = ("queued", "running")
+
+
+class ServiceBusy(Exception):
+    """The job queue is full; try again in a moment."""
+
+
+class UnknownSession(KeyError):
+    """No live session with that id (never created, closed, or reaped while idle)."""
+
+
+def _warm():
+    # Runs once per render process so the first bills don't pay for the imports
+    return os.getpid()
+
+
+class BillService:
+    """One per process (pod). start() runs the event loop; every public method is thread-safe and
+    returns plain dicts, so Streamlit reruns and HTTP handler threads use it the same way.
+    client is the shared sync client: remote deletes and upload GC stay on the background pool.
+    render_pool is the executor for the CPU-bound render/read step; by default start() spawns `processes`
+    worker processes. Spawned workers re-import the parent's __main__, which is only harmless for a
+    script with a __main__ guard (serve-bills.py); under `streamlit run` __main__ is app.py, so the app
+    passes a thread pool instead. The service shuts the pool down in stop() either way."""
+
+    def __init__(self, client, upload_cache, response_cache=None, workers=JOB_WORKERS, queue_max=JOB_QUEUE_MAX,
+                 processes=RENDER_PROCESSES, render_pool=None):
+        self.client = client
+        self.upload_cache = upload_cache
+        self.response_cache = response_cache
+        self.workers = workers
+        self.queue_max = queue_max
+        self.processes = processes
+        self.async_client = None  # built on the loop in start()
+        self.pool = ThreadPoolExecutor(max_workers=8, thread_name_prefix="bill-io")
+        # Reaped on the loop (_reaper), and sessions are only ever closed there (_close_bill)
+        self._sessions = SessionManager(lambda: self.client, upload_cache, self.pool, closer=self._close_bill)
+        self._render_pool = render_pool
+        self._loop = None
+        self._queue = None
+        self._running = 0
+        self._jobs = {}  # job id -> job dict (copied out under the lock)
+        self._done = {}  # job id -> threading.Event set when it finishes
+        self._bills = {}  # session id -> (BillSession, asyncio.Lock serializing its turns)
+        self._lock = threading.Lock()
+
+    # ---- lifecycle ----
+    def start(self):
+        if self._render_pool is None:
+            # spawn, not fork: the loop thread and the HTTP connection pools don't survive a fork
+            self._render_pool = ProcessPoolExecutor(self.processes, mp_context=multiprocessing.get_context("spawn"))
+            for future in [self._render_pool.submit(_warm) for _ in range(self.processes)]:
+                future.result()
+        self._loop = asyncio.new_event_loop()
+        ready = threading.Event()
+        threading.Thread(target=self._run, args=(ready,), daemon=True, name="bill-service").start()
+        ready.wait()
+        return self
+
+    def _run(self, ready):
+        asyncio.set_event_loop(self._loop)
+        self._loop.run_until_complete(self._setup())
+        ready.set()
+        self._loop.run_forever()
+
+    async def _setup(self):
+        self.async_client = build_async_client(self.client.api_key, str(self.client.base_url),
+                                               max_connections=self.workers)
+        self._queue = asyncio.Queue(self.queue_max)
+        for _ in range(self.workers):
+            self._loop.create_task(self._worker())
+        self._loop.create_task(self._reaper())
+
+    def stop(self):
+        """Cancel outstanding jobs, close every session and release the pools."""
+        if self._loop is None:
+            return
+        asyncio.run_coroutine_threadsafe(self._shutdown(), self._loop).result(timeout=30)
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._loop = None
+        self._sessions.close_all()  # the loop is gone, so _close_bill closes them right here
+        self._render_pool.shutdown(cancel_futures=True)
+        self.pool.shutdown()
+
+    async def _shutdown(self):
+        tasks = [t for t in asyncio.all_tasks() if t is not asyncio.current_task()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        await self.async_client.close()
+
+    # ---- submitting and polling ----
+    def submit_upload(self, name, pdf_bytes):
+        """Queue a new bill: load, first turn, swap to the full PDF. The job's session_id is what
+        follow-ups are asked against. Raises ServiceBusy when the queue is full."""
+        session_id = uuid.uuid4().hex
+        bill = BillSession(self.client, self.upload_cache, self.pool, self.response_cache, self.async_client)
+        with self._lock:
+            self._bills[session_id] = (bill, asyncio.Lock())
+        self._sessions.touch(bill)
+        try:
+            return self._submit("upload", session_id, self._upload, name, pdf_bytes)
+        except ServiceBusy:
+            self.close_session(session_id)
+            raise
+
+    def submit_question(self, session_id, question):
+        """Queue a follow-up. Raises UnknownSession or ServiceBusy."""
+        self.touch(session_id)
+        return self._submit("ask", session_id, self._ask, question)
+
+    def touch(self, session_id):
+        """Mark a session as in use (e.g. a rerun showing it), so it isn't closed as idle."""
+        self._sessions.touch(self._bill(session_id)[0])
+
+    def job(self, job_id):
+        """Snapshot of a job (None once unknown or expired)."""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return dict(job) if job is not None else None
+
+    def wait(self, job_id, timeout=None):
+        """Block until a job finishes (or timeout seconds pass); returns its snapshot like job()."""
+        with self._lock:
+            done = self._done.get(job_id)
+        if done is not None:
+            done.wait(timeout)
+        return self.job(job_id)
+
+    def session(self, session_id):
+        """The live BillSession (for in-process callers that render its history), or None."""
+        try:
+            return self._bill(session_id)[0]
+        except UnknownSession:
+            return None
+
+    def close_session(self, session_id):
+        with self._lock:
+            entry = self._bills.get(session_id)
+        if entry is not None:
+            self._sessions.close(entry[0])
+            with self._lock:
+                self._bills.pop(session_id, None)
+
+    def _close_bill(self, bill):
+        # SessionManager's closer. BillSession isn't thread-safe and its background upload is a task of
+        # this loop, so closing happens on the loop, once the session's running turn (if any) is done
+        if self._loop is None:
+            bill.close()
+            return
+        with self._lock:
+            lock = next((lock for b, lock in self._bills.values() if b is bill), None)
+        asyncio.run_coroutine_threadsafe(self._aclose(bill, lock), self._loop)
+
+    async def _aclose(self, bill, lock):
+        if lock is None:
+            bill.close()
+            return
+        async with lock:
+            bill.close()
+
+    def stats(self):
+        with self._lock:
+            jobs = len(self._jobs)
+            bills = len(self._bills)
+        return {"queued": self._queue.qsize() if self._queue else 0, "running": self._running, "jobs": jobs,
+                "sessions": bills, "workers": self.workers, "queue_max": self.queue_max,
+                "render_processes": self.processes}
+
+    def _bill(self, session_id):
+        with self._lock:
+            entry = self._bills.get(session_id)
+        if entry is None or entry[0].closed:
+            raise UnknownSession(session_id)
+        return entry
+
+    def _submit(self, kind, session_id, fn, *args):
+        now = time.time()
+        job = {"id": uuid.uuid4().hex, "kind": kind, "session_id": session_id, "status": "queued",
+               "result": None, "error": None, "submitted": now, "started": None, "finished": None}
+        with self._lock:
+            self._jobs[job["id"]] = job
+            self._done[job["id"]] = threading.Event()
+        if not asyncio.run_coroutine_threadsafe(self._enqueue(job, fn, session_id, args), self._loop).result():
+            with self._lock:
+                del self._jobs[job["id"]], self._done[job["id"]]
+            count("job_rejected", kind=kind)
+            raise ServiceBusy(f"{self.queue_max} jobs already waiting")
+        return dict(job)
+
+    async def _enqueue(self, job, fn, session_id, args):
+        try:
+            self._queue.put_nowait((job, fn, session_id, args))
+            return True
+        except asyncio.QueueFull:
+            return False
+
+    # ---- running jobs (on the loop) ----
+    async def _worker(self):
+        while True:
+            job, fn, session_id, args = await self._queue.get()
+            self._running += 1
+            self._update(job, status="running", started=time.time())
+            observe("job_queue_wait", job["started"] - job["submitted"])
+            try:
+                result = await fn(session_id, *args)
+            except Exception as e:
+                self._update(job, status="failed", error=describe_error(e), finished=time.time())
+                log_event("job_failed", kind=job["kind"], error=f"{type(e).__name__}: {e}")
+            else:
+                self._update(job, status="done", result=result, finished=time.time())
+            finally:
+                self._running -= 1
+                self._queue.task_done()
+                with self._lock:
+                    self._done[job["id"]].set()
+            observe(f"job_{job['kind']}", job["finished"] - job["started"])
+            count("job", kind=job["kind"], status=job["status"])
+
+    def _update(self, job, **fields):
+        with self._lock:
+            job.update(fields)
+
+    async def _upload(self, session_id, name, pdf_bytes):
+        bill, lock = self._bill(session_id)
+        async with lock:
+            try:
+                await bill.aload(name, pdf_bytes, self._render_pool)
+                answer, source = await bill.afirst_turn()
+            except Exception:
+                self.close_session(session_id)  # nothing to continue from
+                raise
+            swap_error = None
+            try:
+                await bill.aswap_roi_for_full_pdf()
+            except Exception as e:
+                swap_error = describe_error(e)  # parsed fields / page text still answer follow-ups
+        return {"session_id": session_id, "answer": answer, "source": source, "swap_error": swap_error}
+
+    async def _ask(self, session_id, question):
+        bill, lock = self._bill(session_id)
+        async with lock:
+            answer, route = await bill.aask(question)
+        return {"session_id": session_id, "answer": answer, "route": route}
+
+    async def _reaper(self):
+        # Idle sessions are closed by the session manager; forget them and expired jobs here
+        while True:
+            await asyncio.sleep(REAP_INTERVAL)
+            self._sessions.reap()
+            cutoff = time.time() - JOB_RESULT_TTL
+            with self._lock:
+                for session_id in [sid for sid, (bill, _) in self._bills.items() if bill.closed]:
+                    del self._bills[session_id]
+                for job_id in [jid for jid, job in self._jobs.items()
+                               if job["status"] not in PENDING and job["finished"] < cutoff]:
+                    del self._jobs[job_id], self._done[job_id]
+
+
+# ---- HTTP API ----
+class _ApiHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive for pollers
+    disable_nagle_algorithm = True  # headers and body go out in separate writes; don't wait on delayed ACKs
+    service = None  # set per server by start_api_server
+    token = None  # likewise; None means no Authorization check (loopback only)
+
+    def log_message(self, fmt, *args):
+        pass
+
+    def _send(self, status, payload=None, headers=()):
+        body = b"" if payload is None else json.dumps(payload, default=str).encode()
+        self.send_response(status)
+        for name, value in headers:
+            self.send_header(name, value)
+        if payload is not None:
+            self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        """Whether the request carries the API token (always, when there is none); sends 401 if not."""
+        if self.token is None or hmac.compare_digest(self.headers.get("Authorization", ""), f"Bearer {self.token}"):
+            return True
+        self._send(401, {"error": "missing or wrong API token"}, headers=[("WWW-Authenticate", "Bearer"),
+                                                                            ("Connection", "close")])
+        self.close_connection = True
+        return False
+
+    def _parts(self):
+        return [p for p in urlparse(self.path).path.split("/") if p]
+
+    def _wait(self):
+        try:
+            return min(float(parse_qs(urlparse(self.path).query).get("wait", ["0"])[0]), API_MAX_WAIT)
+        except ValueError:
+            return 0
+
+    def _submitted(self, submit):
+        try:
+            job = submit()
+            if self._wait() > 0:
+                job = self.service.wait(job["id"], self._wait())
+            self._send(202 if job["status"] in PENDING else 200, job)
+        except ServiceBusy as e:
+            self._send(503, {"error": str(e)}, headers=[("Retry-After", str(BUSY_RETRY_AFTER))])
+        except UnknownSession:
+            self._send(404, {"error": "unknown session"})
+
+    def do_POST(self):
+        if not self._authorized():
+            return
+        parts = self._parts()
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > API_MAX_UPLOAD:
+            self._send(413, {"error": f"body over {API_MAX_UPLOAD} bytes"}, headers=[("Connection", "close")])
+            self.close_connection = True
+            return
+        body = self.rfile.read(length)
+        if parts == ["v1", "bills"]:
+            name = parse_qs(urlparse(self.path).query).get("name", ["bill.pdf"])[0]
+            if not body.startswith(b"%PDF"):
+                return self._send(400, {"error": "body must be a PDF"})
+            return self._submitted(lambda: self.service.submit_upload(name, body))
+        if len(parts) == 4 and parts[:2] == ["v1", "bills"] and parts[3] == "questions":
+            try:
+                question = (json.loads(body or b"{}").get("question") or "").strip()
+            except (ValueError, AttributeError):
+                question = ""
+            if not question:
+                return self._send(400, {"error": 'expected {"question": "..."}'})
+            return self._submitted(lambda: self.service.submit_question(parts[2], question))
+        self._send(404, {"error": "not found"})
+
+    def do_GET(self):
+        parts = self._parts()
+        if parts == ["healthz"]:
+            return self._send(200, self.service.stats())
+        if not self._authorized():
+            return
+        if parts == ["metrics"]:
+            body = render_prometheus().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain; version=0.0.4")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            return self.wfile.write(body)
+        if len(parts) == 3 and parts[:2] == ["v1", "jobs"]:
+            wait = self._wait()
+            job = self.service.wait(parts[2], wait) if wait > 0 else self.service.job(parts[2])
+            return self._send(200, job) if job is not None else self._send(404, {"error": "unknown job"})
+        if len(parts) == 3 and parts[:2] == ["v1", "bills"]:
+            bill = self.service.session(parts[2])
+            if bill is None:
+                return self._send(404, {"error": "unknown session"})
+            return self._send(200, {"session_id": parts[2], "history": [
+                {"role": role, "text": text} for role, text in list(bill.history)
+            ]})
+        self._send(404, {"error": "not found"})
+
+    def do_DELETE(self):
+        if not self._authorized():
+            return
+        parts = self._parts()
+        if len(parts) == 3 and parts[:2] == ["v1", "bills"]:
+            self.service.close_session(parts[2])
+            return self._send(204)
+        self._send(404, {"error": "not found"})
+
+
+class _ApiServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # listen backlog; the default of 5 drops connects under a polling burst
+
+
+def _is_loopback(host):
+    try:
+        return ipaddress.ip_address(host).is_loopback
+    except ValueError:
+        return host == "localhost"
+
+
+def start_api_server(service, port=API_PORT, host=API_HOST, token=API_TOKEN):
+    """Serve the HTTP API for `service` on a daemon thread; returns the server (port 0 picks one).
+    The API has no users of its own, so any bind but loopback needs a bearer token."""
+    if token is None and not _is_loopback(host):
+        raise ValueError(f"refusing to serve the bill API on {host} without a token (set BILL_API_TOKEN)")
+    handler = type("BillApiHandler", (_ApiHandler,), {"service": service, "token": token})
+    server = _ApiServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True, name="bill-api").start()
+    return server
@@ -0,0 +1,531 @@
+# bill_session.py
+# One bill conversation without any UI: upload -> ROI crop -> local read or first model turn ->
+# swap to the full PDF -> routed follow-ups (on multi-page bills, only the pages a question is
+# about). app.py drives a BillSession from Streamlit; bench-session.py drives many of them
+# concurrently against the stub API. session_manager.py closes idle sessions (releasing their
+# uploads) on long-running servers. The a*-methods (aload, afirst_turn, aswap_roi_for_full_pdf,
+# aask) are the same steps on the event loop of bill_service.py.
+
+import asyncio
+import contextlib
+import os
+from collections import deque
+
+from agent_factory import INITIAL_QUESTION, AIMessage, HumanMessage, create_agent, request_timeout
+from bill_fields import extract_bill_info, route_question, select_pages
+from metrics import count, replay, span
+from resilience import HEDGE_FIRST_TURN, acall_with_retries, call_with_retries
+from upload_cache import sha256_bytes
+from utils import pixmap_to_bgr, pixmap_to_image_bytes, pixmap_to_pdf_bytes, render_roi, slice_pdf_bytes
+
+# Template meter area (PyMuPDF page space: points, origin top-left). With ROI_LOCATE it is only a
+# hint for picking between candidate photos and the fallback when no photo is found.
+ROI_BBOX = (348, 469, 540, 610)  # (x0, y0, x1, y1)
+ROI_LOCATE = True  # find the meter photo on the page (embedded image or low-DPI contour pass)
+# "native": crop the embedded meter photo at its own resolution (JPEGs pass through untouched);
+# falls back to "auto" -- modest DPI first, higher only if digit strokes are too thin. Or an int.
+ROI_DPI = "native"
+LOCAL_READER = True  # try the seven-segment reader before asking the vision model
+ROI_AS_IMAGE = True  # send the ROI inline as input_image (no ROI upload/delete); False uploads an ROI PDF
+# Follow-ups on multi-page bills send only the relevant pages (sub-PDF / page text); the full PDF is
+# still uploaded in the background and used whenever page selection isn't confident
+PAGE_SLICING = True
+
+FOLLOWUP_LINE = "Would you like to know anything else from the uploaded bill?"
+# Messages kept per session (oldest dropped first). With chained responses the model keeps the full
+# conversation server-side; this only bounds what the process holds and what window mode can resend.
+HISTORY_MAX_MESSAGES = int(os.environ.get("SESSION_HISTORY_MAX", "40"))
+# Every upload's filename starts with this, so orphan GC only ever touches this app's files
+UPLOAD_PREFIX = "billqa_"
+
+
+def upload_pdf(client, name, data, cache, trace=None):
+    """Upload PDF bytes via the content-addressed cache; returns the (possibly reused) file_id.
+    Transient failures are retried within the upload deadline (see resilience.py)."""
+    def _upload(payload):
+        with span("files.create", trace, bytes=len(payload)):
+            return call_with_retries(
+                lambda remaining: client.files.create(
+                    file=(UPLOAD_PREFIX + name, payload, "application/pdf"), purpose="user_data",
+                    timeout=request_timeout(remaining),
+                ).id,
+                "files.create",
+            )
+    return cache.acquire(data, _upload, lambda file_id: remote_file_exists(client, file_id))
+
+
+async def aupload_pdf(async_client, name, data, cache, trace=None):
+    """upload_pdf() on the AsyncOpenAI client."""
+    async def _upload(payload):
+        with span("files.create", trace, bytes=len(payload)):
+            resp = await acall_with_retries(
+                lambda remaining: async_client.files.create(
+                    file=(UPLOAD_PREFIX + name, payload, "application/pdf"), purpose="user_data",
+                    timeout=request_timeout(remaining),
+                ),
+                "files.create",
+            )
+            return resp.id
+    async def _exists(file_id):
+        return await aremote_file_exists(async_client, file_id)
+    return await cache.aacquire(data, _upload, _exists)
+
+
+def remote_file_exists(client, file_id):
+    """False only when the API reports the file gone; any other failure assumes it is still there."""
+    from openai import NotFoundError
+    try:
+        call_with_retries(lambda remaining: client.files.retrieve(file_id, timeout=request_timeout(remaining)),
+                          "files.retrieve")
+    except NotFoundError:
+        count("upload_gone")
+        return False
+    except Exception:
+        pass
+    return True
+
+
+async def aremote_file_exists(async_client, file_id):
+    from openai import NotFoundError
+    try:
+        await acall_with_retries(
+            lambda remaining: async_client.files.retrieve(file_id, timeout=request_timeout(remaining)),
+            "files.retrieve",
+        )
+    except NotFoundError:
+        count("upload_gone")
+        return False
+    except Exception:
+        pass
+    return True
+
+
+def delete_upload(client, file_id):
+    call_with_retries(lambda remaining: client.files.delete(file_id, timeout=request_timeout(remaining)),
+                      "files.delete")
+
+
+def release_upload(client, file_id, cache):
+    # Soft-fail; the cache only deletes once no session references the file,
+    # and remote deletes that fail are retried on the next eviction
+    cache.release(file_id)
+    cache.evict(lambda victim: delete_upload(client, victim))
+
+
+def invoke_agent(agent, messages):
+    """Default turn runner: blocking invoke, returns the answer text."""
+    resp = agent.invoke({"messages": messages})
+    ai_msgs = [m for m in resp.get("messages", []) if isinstance(m, AIMessage)]
+    return (ai_msgs[-1].content or "") if ai_msgs else ""
+
+
+async def ainvoke_agent(agent, messages):
+    """invoke_agent() on the agent's async client."""
+    resp = await agent.ainvoke({"messages": messages})
+    ai_msgs = [m for m in resp.get("messages", []) if isinstance(m, AIMessage)]
+    return (ai_msgs[-1].content or "") if ai_msgs else ""
+
+
+def prepare_bill(pdf_bytes, trace=None):
+    """The CPU-bound part of loading a bill: parse the text layer, crop the ROI, try the local reader
+    and encode the ROI for the model. Plain data in and out, so bill_service.py can run it in a process
+    pool. Spans go to trace (a new list when None), returned as prepared["trace"]."""
+    trace = [] if trace is None else trace
+    prepared = {"trace": trace, "local_reading": None, "roi_image": None, "roi_pdf": None}
+
+    # Parse the text layer once; follow-ups can often be answered from it
+    with span("extract_text", trace):
+        prepared["bill_info"] = extract_bill_info(pdf_bytes)
+
+    # Render the ROI once; the local reader and the vision fallback share it
+    with span("render_roi", trace) as timing:
+        roi_pix, roi_info = render_roi(pdf_bytes, page_number=0, bbox=ROI_BBOX, dpi=ROI_DPI, locate=ROI_LOCATE)
+        timing.update(dpi=roi_info["dpi"], source=roi_info["source"], locate=roi_info["locate"])
+    roi_stream = roi_info.pop("stream", None)  # original JPEG bytes, not worth keeping around
+    prepared["roi_render"] = roi_info
+
+    # First pass: read the seven-segment display locally; low-confidence reads, and reads whose digit
+    # count or decimal don't match the meter's layout (read_meter scores those 0), go to the model
+    if LOCAL_READER:
+        from meter_reader import MIN_CONFIDENCE, read_meter  # OpenCV loads with the first bill, not at start-up
+        with span("local_read", trace) as timing:
+            try:
+                reading, confidence = read_meter(pixmap_to_bgr(roi_pix), dpi=roi_info["dpi"])
+                timing["confidence"] = round(confidence, 3)
+                if reading and confidence >= MIN_CONFIDENCE:
+                    prepared["local_reading"] = reading
+            except Exception:
+                pass  # any reader failure just means asking the model
+    if prepared["local_reading"] is not None:
+        return prepared
+
+    if ROI_AS_IMAGE:
+        # Send the ROI inline with the first question: no PDF wrapper, upload or later delete
+        with span("encode_roi", trace, format="image") as timing:
+            prepared["roi_image"] = pixmap_to_image_bytes(roi_pix, stream=roi_stream)
+            roi_info["bytes"] = timing["bytes"] = len(prepared["roi_image"][0])
+    else:
+        # Wrap the ROI render in a new (single-page) PDF for vision
+        with span("encode_roi", trace, format="pdf") as timing:
+            prepared["roi_pdf"] = pixmap_to_pdf_bytes(roi_pix, stream=roi_stream)
+            roi_info["bytes"] = timing["bytes"] = len(prepared["roi_pdf"])
+    return prepared
+
+
+class BillSession:
+    """Conversation state for one uploaded bill. The client, caches and background pool are shared
+    by every session in the process and passed in."""
+
+    def __init__(self, client, upload_cache, pool, response_cache=None, async_client=None):
+        self.client = client
+        self.async_client = async_client  # AsyncOpenAI for the a*-methods (bill_service.py)
+        self.upload_cache = upload_cache
+        self.pool = pool  # uploads/deletes that shouldn't block the caller
+        self.response_cache = response_cache
+        self.history = deque(maxlen=HISTORY_MAX_MESSAGES)  # (role, text) with role "user" or "bot"
+        self.history_dropped = 0  # messages that fell off the front of history
+        self.file_ids = []  # used by the agent each turn
+        self.roi_file_id = None
+        self.full_file_id = None
+        self.full_upload_future = None  # full-PDF upload started at load time (an asyncio.Task in aload)
+        self.slice_file_ids = {}  # page tuple -> file_id of that sub-document
+        self.name = None
+        self.pdf_bytes = None
+        self.doc_hash = None  # SHA-256 of the bill bytes, the response cache's document key
+        self.bill_info = None  # parsed text layer + fields, once per upload
+        self.roi_render = None  # chosen DPI / size of the ROI render, for debugging
+        self.local_reading = None
+        self.last_response_id = None  # Responses API chain (previous_response_id)
+        self.attached_file_ids = []  # files already sent within that chain
+        self.trace = []  # timing spans + token usage (see metrics.py)
+        self.closed = False
+        self._roi_image = None
+
+    @property
+    def ready(self):
+        """Follow-ups can be asked: the full PDF is uploaded."""
+        return bool(self.full_file_id)
+
+    # ---- upload stage ----
+    def load(self, name, pdf_bytes):
+        """Start the full-PDF upload, parse the text layer, crop the ROI and try the local reader.
+        Returns the local meter reading, or None when the first turn needs the model."""
+        self._begin(name, pdf_bytes)
+
+        # Start the full-PDF upload now so it overlaps the crop and the first model call
+        self.full_upload_future = self.pool.submit(
+            upload_pdf, self.client, name, pdf_bytes, self.upload_cache, self.trace
+        )
+        roi_pdf = self._apply(prepare_bill(pdf_bytes, self.trace))
+        if roi_pdf is not None:
+            # Upload the cropped ROI-PDF straight from memory (skipped if already cached)
+            with span("upload_roi", self.trace):
+                self.roi_file_id = upload_pdf(self.client, f"roi_{name}", roi_pdf, self.upload_cache, self.trace)
+            self.file_ids = [self.roi_file_id]
+        return self.local_reading
+
+    async def aload(self, name, pdf_bytes, executor=None):
+        """load() on the event loop: uploads go through the async client and prepare_bill runs in
+        executor (a process pool), or on a worker thread when executor is None."""
+        self._begin(name, pdf_bytes)
+        self.full_upload_future = asyncio.ensure_future(
+            aupload_pdf(self.async_client, name, pdf_bytes, self.upload_cache, self.trace)
+        )
+        if executor is None:
+            prepared = await asyncio.to_thread(prepare_bill, pdf_bytes, self.trace)
+        else:
+            prepared = await asyncio.get_running_loop().run_in_executor(executor, prepare_bill, pdf_bytes)
+            replay(prepared["trace"], self.trace)  # timed in the worker process
+        roi_pdf = self._apply(prepared)
+        if roi_pdf is not None:
+            with span("upload_roi", self.trace):
+                self.roi_file_id = await aupload_pdf(
+                    self.async_client, f"roi_{name}", roi_pdf, self.upload_cache, self.trace
+                )
+            self.file_ids = [self.roi_file_id]
+        return self.local_reading
+
+    def _begin(self, name, pdf_bytes):
+        self.name, self.pdf_bytes = name, pdf_bytes
+        self.doc_hash = sha256_bytes(pdf_bytes)
+
+    def _apply(self, prepared):
+        # Take over what prepare_bill produced; returns the ROI PDF that still needs uploading (or None)
+        self.bill_info = prepared["bill_info"]
+        self.roi_render = prepared["roi_render"]
+        self.local_reading = prepared["local_reading"]
+        self._roi_image = prepared["roi_image"]
+        return prepared["roi_pdf"]
+
+    # ---- agent plumbing ----
+    def make_agent(self, file_ids=None, context_text=None, images=None, first_turn=False, intent=None):
+        """Agent bound to the shared client, continuing this session's response chain; intent picks
+        the model and output budget (agent_factory.route_model)."""
+        return create_agent(
+            context=self.file_ids if file_ids is None else file_ids,
+            client=self.client,
+            previous_response_id=self.last_response_id,
+            attached_file_ids=self.attached_file_ids,
+            context_text=context_text,
+            images=images,
+            cache=self.response_cache,
+            doc_hash=self.doc_hash,
+            trace=self.trace,
+            first_turn=first_turn,
+            hedge=first_turn and HEDGE_FIRST_TURN,
+            async_client=self.async_client,
+            intent=intent,
+        )
+
+    def messages(self):
+        """The history as agent messages (agent_factory.HumanMessage / AIMessage)."""
+        return [HumanMessage(content=text) if role == "user" else AIMessage(content=text)
+                for role, text in self.history]
+
+    def remember_chain(self, agent):
+        # Persist where the conversation left off so the next turn only sends the new question
+        self.last_response_id = agent.response_id
+        self.attached_file_ids = agent.attached_file_ids
+
+    def _remember(self, role, text):
+        if len(self.history) == self.history.maxlen:
+            self.history_dropped += 1
+        self.history.append((role, text))
+
+    @contextlib.contextmanager
+    def _asking(self, question):
+        # The question is in the history for the whole turn (messages() sends it); if any step fails --
+        # page selection, routing, slicing, the model call -- or the turn is cancelled, it's taken back
+        # out, so the history never ends on an unanswered question. The error propagates
+        self._remember("user", question)
+        try:
+            yield
+        except BaseException:
+            self.history.pop()
+            raise
+
+    # ---- turns ----
+    def first_turn(self, run=invoke_agent):
+        """Answer INITIAL_QUESTION from the local reading or the ROI. run(agent, messages) -> text
+        performs a model turn (app.py streams it into the page). Returns (answer, source).
+        If any step fails the error propagates and the question is not kept in the history."""
+        with self._asking(INITIAL_QUESTION):
+            agent, answer = self._start_first_turn(), None
+            if agent is not None:
+                with span("first_turn", self.trace):
+                    answer = run(agent, self.messages())
+            return self._finish_first_turn(agent, answer)
+
+    async def afirst_turn(self):
+        with self._asking(INITIAL_QUESTION):
+            agent, answer = self._start_first_turn(), None
+            if agent is not None:
+                with span("first_turn", self.trace):
+                    answer = await ainvoke_agent(agent, self.messages())
+            return self._finish_first_turn(agent, answer)
+
+    def _start_first_turn(self):
+        # The agent to ask, or None when the local reading answers it
+        if self.local_reading is not None:
+            return None
+        # The first answer is what the user waits on after uploading: hedged when HEDGE_FIRST_TURN
+        return self.make_agent(images=[self._roi_image] if self._roi_image else None, first_turn=True,
+                               intent="meter")
+
+    def _finish_first_turn(self, agent, answer):
+        if agent is None:
+            answer, source = f"the electricity meter reads: {self.local_reading}", "local"
+        else:
+            self.remember_chain(agent)
+            source = "cache" if agent.cache_hit else "model"
+        self._roi_image = None
+
+        # Ensure the follow-up line is present for the very first response
+        if FOLLOWUP_LINE.lower() not in (answer or "").lower():
+            answer = f"{answer.strip()}\n\n{FOLLOWUP_LINE}" if (answer or "").strip() else FOLLOWUP_LINE
+        self._remember("bot", answer)
+        return answer, source
+
+    def swap_roi_for_full_pdf(self):
+        """Release the ROI file and switch to the full PDF (waits for the background upload).
+        Raises if the full-PDF upload failed."""
+        with span("swap_full_pdf", self.trace):
+            self._release_roi()
+            future = self.full_upload_future
+            if future is None and self.pdf_bytes:
+                future = self.pool.submit(
+                    upload_pdf, self.client, self.name, self.pdf_bytes, self.upload_cache, self.trace
+                )
+            if future is not None:
+                try:
+                    self.full_file_id = future.result()
+                    self.file_ids = [self.full_file_id]
+                finally:
+                    self.full_upload_future = None
+
+    async def aswap_roi_for_full_pdf(self):
+        with span("swap_full_pdf", self.trace):
+            self._release_roi()
+            task = self.full_upload_future
+            if task is None and self.pdf_bytes:
+                task = asyncio.ensure_future(
+                    aupload_pdf(self.async_client, self.name, self.pdf_bytes, self.upload_cache, self.trace)
+                )
+            if task is not None:
+                try:
+                    self.full_file_id = await task
+                    self.file_ids = [self.full_file_id]
+                finally:
+                    self.full_upload_future = None
+
+    def _release_roi(self):
+        # Release ROI file if present, without waiting on the remote delete
+        if self.roi_file_id:
+            self.pool.submit(release_upload, self.client, self.roi_file_id, self.upload_cache)
+            self.roi_file_id = None
+
+    def file_ids_in_use(self):
+        """Remote files this session holds a reference to."""
+        return [fid for fid in (self.roi_file_id, self.full_file_id, *self.slice_file_ids.values()) if fid]
+
+    def close(self):
+        """End the session: release its uploads (deleted remotely once no session references them and
+        the upload cache evicts them) and drop the bill bytes. Safe to call more than once."""
+        if self.closed:
+            return
+        self.closed = True
+        for file_id in self.file_ids_in_use():
+            self._release_later(file_id)
+        future = self.full_upload_future
+        if future is not None:
+            # Upload still running: release its reference once it lands
+            future.add_done_callback(
+                lambda f: not f.cancelled() and f.exception() is None and self._release_later(f.result())
+            )
+        self.roi_file_id = self.full_file_id = self.full_upload_future = None
+        self.slice_file_ids = {}
+        self.file_ids = []
+        self.pdf_bytes = self.bill_info = self._roi_image = None
+
+    def _release_later(self, file_id):
+        try:
+            self.pool.submit(release_upload, self.client, file_id, self.upload_cache)
+        except RuntimeError:  # pool already shut down (process exiting): release inline
+            release_upload(self.client, file_id, self.upload_cache)
+
+    def pages_for(self, question):
+        """Pages of a multi-page bill to answer `question` from, or None for the whole bill."""
+        if not PAGE_SLICING:
+            return None
+        pages = select_pages(question, self.bill_info)
+        count("page_select", result="slice" if pages else "full")
+        return pages
+
+    def slice_file_id(self, pages):
+        """file_id of the sub-document with just `pages`, sliced and uploaded once per page set
+        (the upload cache also shares identical slices across sessions). None if the upload fails."""
+        key = tuple(pages)
+        if key not in self.slice_file_ids:
+            name, data = self._slice(key)
+            try:
+                self.slice_file_ids[key] = upload_pdf(self.client, name, data, self.upload_cache, self.trace)
+            except Exception:
+                return None  # the full PDF still answers it
+        return self.slice_file_ids[key]
+
+    async def aslice_file_id(self, pages):
+        key = tuple(pages)
+        if key not in self.slice_file_ids:
+            name, data = await asyncio.to_thread(self._slice, key)
+            try:
+                self.slice_file_ids[key] = await aupload_pdf(self.async_client, name, data, self.upload_cache,
+                                                             self.trace)
+            except Exception:
+                return None
+        return self.slice_file_ids[key]
+
+    def _slice(self, key):
+        with span("slice_pdf", self.trace, pages=len(key)) as timing:
+            data = slice_pdf_bytes(self.pdf_bytes, key)
+            timing["bytes"] = len(data)
+        return f"p{'-'.join(str(p + 1) for p in key)}_{self.name}", data
+
+    def _chain_file_pages(self):
+        """page -> file_id for pages whose PDF (full or a slice) is already in the response chain."""
+        if not self.last_response_id:
+            return {}
+        attached = set(self.attached_file_ids)
+        if self.full_file_id in attached:
+            return dict.fromkeys(range(self.bill_info["page_count"]), self.full_file_id)
+        covered = {}
+        for key, file_id in self.slice_file_ids.items():
+            if file_id in attached:
+                for pno in key:
+                    covered.setdefault(pno, file_id)
+        return covered
+
+    def file_ids_for(self, pages):
+        """file_ids covering `pages`: files already in the chain (not re-sent while it holds, re-sent
+        if the agent has to fall back to a stateless request) plus one new slice of the rest.
+        None when that slice can't be uploaded, i.e. use the full PDF."""
+        file_ids, missing = self._split_pages(pages)
+        if missing:
+            slice_id = self.slice_file_id(missing)
+            if slice_id is None:
+                return None
+            file_ids.append(slice_id)
+        return file_ids
+
+    async def afile_ids_for(self, pages):
+        file_ids, missing = self._split_pages(pages)
+        if missing:
+            slice_id = await self.aslice_file_id(missing)
+            if slice_id is None:
+                return None
+            file_ids.append(slice_id)
+        return file_ids
+
+    def _split_pages(self, pages):
+        # (file_ids already in the chain covering some of pages, the pages none of them covers)
+        covered = self._chain_file_pages()
+        file_ids = list(dict.fromkeys(covered[pno] for pno in pages if pno in covered))
+        return file_ids, [pno for pno in pages if pno not in covered]
+
+    def ask(self, question, run=invoke_agent):
+        """Follow-up turn: answer from parsed fields, from extracted text, or from the PDF
+        (a sub-document of the relevant pages when selection is confident). Returns (answer, route).
+        If any step fails the error propagates and the question is not kept in the history."""
+        with self._asking(question):
+            pages, route, answer = self._start_ask(question)
+            if route != "local":
+                file_ids = self.file_ids_for(pages) if route == "file" and pages else None
+                agent = self._followup_agent(route, answer, file_ids)
+                with span("followup_turn", self.trace, route=route, pages=len(pages) if pages else "all"):
+                    answer = run(agent, self.messages())
+                self.remember_chain(agent)
+            self._remember("bot", answer)
+        return answer, route
+
+    async def aask(self, question):
+        with self._asking(question):
+            pages, route, answer = self._start_ask(question)
+            if route != "local":
+                file_ids = await self.afile_ids_for(pages) if route == "file" and pages else None
+                agent = self._followup_agent(route, answer, file_ids)
+                with span("followup_turn", self.trace, route=route, pages=len(pages) if pages else "all"):
+                    answer = await ainvoke_agent(agent, self.messages())
+                self.remember_chain(agent)
+            self._remember("bot", answer)
+        return answer, route
+
+    def _start_ask(self, question):
+        # (pages, route, payload): payload is the local answer or the extracted text to send
+        pages = self.pages_for(question)
+        route, payload = route_question(question, self.bill_info, pages=pages)
+        return pages, route, payload
+
+    def _followup_agent(self, route, payload, file_ids):
+        # Recreate the agent each turn so it has the latest file_ids
+        if route == "text":
+            return self.make_agent(file_ids=[], context_text=payload, intent="text")
+        return self.make_agent(file_ids=file_ids, intent="file")
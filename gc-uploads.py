@@ -0,0 +1,40 @@
+# gc_uploads.py
+# One-off / cron garbage collection of remote bill uploads, the same pass the app runs every
+# UPLOAD_GC_INTERVAL (with UPLOAD_ORPHAN_GC=1): stale upload-cache references, cache eviction, then this
+# app's orphaned files (prefix billqa_) older than --max-age that the cache no longer knows. Other files
+# are never touched. Point --cache at the cache every app process uses: files known only to another
+# cache look orphaned and would be deleted under its running sessions.
+# Usage:
+#   python gc-uploads.py --dry-run          # list what would be deleted
+#   python gc-uploads.py --max-age 86400
+
+import argparse
+import sys
+
+from agent_factory import build_client
+from session_manager import ORPHAN_MAX_AGE, STALE_REF_AGE, collect_garbage, collect_orphans
+from upload_cache import DEFAULT_PATH, UploadCache
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Delete orphaned remote uploads of the bill Q&A app.")
+    ap.add_argument("--cache", default=DEFAULT_PATH, help="Upload cache SQLite file")
+    ap.add_argument("--max-age", type=float, default=ORPHAN_MAX_AGE, help="Orphan age in seconds")
+    ap.add_argument("--stale-ref-age", type=float, default=STALE_REF_AGE, help="Reference age in seconds")
+    ap.add_argument("--dry-run", action="store_true", help="Only list orphaned files")
+    args = ap.parse_args()
+
+    client = build_client()
+    cache = UploadCache(path=args.cache)
+    if args.dry_run:
+        orphans = collect_orphans(client, cache, args.max_age, dry_run=True)
+        print(f"{len(orphans)} orphaned files older than {args.max_age:.0f}s:")
+        for file_id in orphans:
+            print(f"  {file_id}")
+        return 0
+    print(collect_garbage(client, cache, stale_ref_age=args.stale_ref_age, orphan_max_age=args.max_age))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
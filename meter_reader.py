@@ -0,0 +1,176 @@
+# meter_reader.py
+# Local first-pass reader for seven-segment meter photos, built on preprocess_meter.py.
+# Digits are segmented from the binarized display, segment occupancy is measured for all
+# digits at once with NumPy, and the decimal follows the same placement rule as SYSTEM_PROMPT
+# (only ever immediately before the last two digits). Low-confidence reads should go to the
+# vision model instead; so do reads whose digit row or decimal doesn't match the meter's layout,
+# however clear each digit looks.
+
+import os
+
+import cv2
+import numpy as np
+
+from preprocess_meter import preprocess_masks
+
+MIN_CONFIDENCE = 0.6      # below this, callers fall back to the vision model
+CELL_H, CELL_W = 40, 24   # every digit is resampled to this grid before classification
+# Display layout a confident read must match: METER_DIGITS digits ("" or 0: any count) and METER_DECIMAL
+# "1" = a decimal dot before the last two digits, "0" = no dot, "" = either
+EXPECTED_DIGITS = int(os.environ.get("METER_DIGITS", "7") or 0)
+EXPECTED_DECIMAL = {"1": True, "0": False}.get(os.environ.get("METER_DECIMAL", "1"))
+STRICT_THRESHOLD = 0.8    # second binarization (fraction of the Otsu level) the digit count must survive
+
+# Segment order a..g (top, top-right, bottom-right, bottom, bottom-left, top-left, middle)
+DIGIT_PATTERNS = np.array([
+    # a  b  c  d  e  f  g
+    [1, 1, 1, 1, 1, 1, 0],  # 0
+    [0, 1, 1, 0, 0, 0, 0],  # 1
+    [1, 1, 0, 1, 1, 0, 1],  # 2
+    [1, 1, 1, 1, 0, 0, 1],  # 3
+    [0, 1, 1, 0, 0, 1, 1],  # 4
+    [1, 0, 1, 1, 0, 1, 1],  # 5
+    [1, 0, 1, 1, 1, 1, 1],  # 6
+    [1, 1, 1, 0, 0, 0, 0],  # 7
+    [1, 1, 1, 1, 1, 1, 1],  # 8
+    [1, 1, 1, 1, 0, 1, 1],  # 9
+], dtype=np.float32)
+
+# Sampling windows per segment as (y0, y1, x0, x1) fractions of the digit cell
+_SEGMENT_WINDOWS = [
+    (0.00, 0.14, 0.25, 0.75),  # a
+    (0.15, 0.42, 0.72, 1.00),  # b
+    (0.58, 0.85, 0.72, 1.00),  # c
+    (0.86, 1.00, 0.25, 0.75),  # d
+    (0.58, 0.85, 0.00, 0.28),  # e
+    (0.15, 0.42, 0.00, 0.28),  # f
+    (0.43, 0.57, 0.25, 0.75),  # g
+]
+
+
+def _segment_masks():
+    masks = np.zeros((7, CELL_H, CELL_W), dtype=np.float32)
+    for s, (y0, y1, x0, x1) in enumerate(_SEGMENT_WINDOWS):
+        masks[s, int(y0 * CELL_H):int(np.ceil(y1 * CELL_H)), int(x0 * CELL_W):int(np.ceil(x1 * CELL_W))] = 1
+    return masks / masks.sum(axis=(1, 2), keepdims=True)
+
+
+SEGMENT_MASKS = _segment_masks()
+
+
+def _boxes(mask):
+    n, _, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    return stats[1:n, :4]  # x, y, w, h
+
+
+def _merge_columns(boxes):
+    """Merge pieces that overlap horizontally and touch vertically: LCD segments have gaps
+    between them, so one digit is several components stacked in the same column."""
+    groups = []
+    for x, y, w, h in boxes[np.argsort(boxes[:, 0])]:
+        for g in groups:
+            overlap = min(x + w, g[0] + g[2]) - max(x, g[0])
+            slack = 0.3 * max(h, g[3])
+            if overlap > 0.3 * min(w, g[2]) and y <= g[1] + g[3] + slack and y + h >= g[1] - slack:
+                x1, y1 = max(x + w, g[0] + g[2]), max(y + h, g[1] + g[3])
+                g[0], g[1] = min(x, g[0]), min(y, g[1])
+                g[2], g[3] = x1 - g[0], y1 - g[1]
+                break
+        else:
+            groups.append([x, y, w, h])
+    return np.array(groups, dtype=np.int64).reshape(-1, 4)
+
+
+def find_digit_boxes(binary):
+    """Bounding boxes (x, y, w, h) of the digit row, left to right."""
+    h_img, w_img = binary.shape
+    pieces = _boxes(binary)
+    pieces = pieces[pieces[:, 2] * pieces[:, 3] >= 0.0005 * h_img * w_img]  # drop specks
+    if len(pieces) == 0:
+        return pieces
+    boxes = _merge_columns(pieces)
+    x, y, w, h = boxes.T
+    tall = (h >= 0.12 * h_img) & (h > 1.2 * w) & (h < 0.95 * h_img)
+    if not tall.any():
+        return boxes[:0]
+    # keep the largest group with a common height and baseline (the display row)
+    med_h = np.median(h[tall])
+    med_bottom = np.median((y + h)[tall])
+    row = tall & (np.abs(h - med_h) < 0.2 * med_h) & (np.abs((y + h) - med_bottom) < 0.2 * med_h)
+    return boxes[row][np.argsort(x[row])]
+
+
+def classify_digits(binary, boxes):
+    """Classify all digit boxes at once. Returns (digits str, per-digit confidence array)."""
+    # typical digit width from the non-"1" digits; seven-segment digits are about half as wide as tall
+    wide = boxes[:, 2] >= 0.3 * boxes[:, 3]
+    digit_w = np.median(boxes[wide, 2]) if wide.any() else 0.5 * np.median(boxes[:, 3])
+    cells = np.empty((len(boxes), CELL_H, CELL_W), dtype=np.float32)
+    for i, (x, y, w, h) in enumerate(boxes):
+        if w < 0.5 * digit_w:
+            # a "1" only lights the right-hand segments; widen it leftwards to a full cell
+            x, w = max(0, x + w - int(digit_w)), int(digit_w)
+        crop = binary[y:y + h, x:x + w]
+        cells[i] = cv2.resize(crop, (CELL_W, CELL_H), interpolation=cv2.INTER_AREA) / 255.0
+
+    occupancy = np.einsum("nhw,shw->ns", cells, SEGMENT_MASKS)          # (N, 7) in 0..1
+    on = np.clip((occupancy - 0.2) / 0.4, 0, 1)                          # soft "segment lit"
+    dist = np.abs(on[:, None, :] - DIGIT_PATTERNS[None, :, :]).sum(-1)   # (N, 10)
+    order = np.argsort(dist, axis=1)
+    best = order[:, 0]
+    rows = np.arange(len(boxes))
+    confidence = np.clip(dist[rows, order[:, 1]] - dist[rows, best], 0, 1)
+    return "".join(map(str, best)), confidence
+
+
+def find_decimal_gap(masks, boxes):
+    """Index i such that the decimal dot sits between digit i-1 and digit i, or None.
+    Only the gap before the last two digits is accepted (placement prior from SYSTEM_PROMPT)."""
+    if len(boxes) < 3:
+        return None
+    x, y, w, h = boxes.T
+    med_h = np.median(h)
+    baseline = np.median(y + h)
+    gap = len(boxes) - 2
+    left_edge, right_edge = x[gap - 1] + w[gap - 1], x[gap]
+
+    candidates = np.concatenate([_boxes(masks["dot"]), _boxes(masks["binary"])])
+    if len(candidates) == 0:
+        return None
+    cx = candidates[:, 0] + candidates[:, 2] / 2
+    cy = candidates[:, 1] + candidates[:, 3] / 2
+    small = (candidates[:, 3] < 0.3 * med_h) & (candidates[:, 2] < 0.5 * med_h) & (candidates[:, 2] * candidates[:, 3] >= 4)
+    # strictly between the two digits: specks of the digits' own edges (dot mask) sit on their boxes
+    inline = (cx > left_edge) & (cx < right_edge) & (candidates[:, 0] + candidates[:, 2] <= right_edge + 1)
+    on_baseline = np.abs(cy - baseline) < 0.2 * med_h
+    return gap if (small & inline & on_baseline).any() else None
+
+
+def layout_trusted(den, level, boxes, gap):
+    """Whether the digit row and decimal can be trusted: the expected digit count, the same count at a
+    stricter threshold (a dropped, split or merged digit changes it) and the expected decimal decision."""
+    if EXPECTED_DIGITS and len(boxes) != EXPECTED_DIGITS:
+        return False
+    if EXPECTED_DECIMAL is not None and (gap is not None) != EXPECTED_DECIMAL:
+        return False
+    _, strict = cv2.threshold(den, STRICT_THRESHOLD * level, 255, cv2.THRESH_BINARY_INV)
+    return len(find_digit_boxes(strict)) == len(boxes)
+
+
+def read_meter(img_bgr, dpi=None):
+    """Read a seven-segment meter photo rendered at `dpi`. Returns (reading or None, confidence 0..1);
+    confidence is 0 when the digit row or decimal doesn't pass layout_trusted()."""
+    masks = preprocess_masks(img_bgr, dpi=dpi)
+    # Solid segments: Otsu on the cleaned-up grayscale (adaptive threshold hollows thick strokes)
+    level, binary = cv2.threshold(masks["den"], 0, 255, cv2.THRESH_BINARY_INV + cv2.THRESH_OTSU)
+    masks["binary"] = binary
+
+    boxes = find_digit_boxes(binary)
+    if len(boxes) < 3:
+        return None, 0.0
+    digits, confidence = classify_digits(binary, boxes)
+    gap = find_decimal_gap(masks, boxes)
+    reading = digits if gap is None else f"{digits[:gap]}.{digits[gap:]}"
+    if not layout_trusted(masks["den"], level, boxes, gap):
+        return reading, 0.0
+    return reading, float(confidence.min())
@@ -0,0 +1,223 @@
+# metrics.py
+# Stage timings and token usage for the app and agent, stdlib only.
+# - span("render_roi") times a block: a JSON log line, a Prometheus-style histogram sample and,
+#   when a trace list is passed, an entry for the Streamlit debug panel.
+# - record_usage() turns a Responses API `usage` object into token counters.
+# - render_prometheus() is the text exposition format; start_metrics_server() serves it on /metrics.
+
+import contextlib
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+logger = logging.getLogger("bill_qa")
+
+# JSON log lines go to stderr unless METRICS_LOG=0; METRICS_PORT serves /metrics for Prometheus
+METRICS_LOG = os.environ.get("METRICS_LOG", "1") != "0"
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+TRACE_MAX = 200  # spans kept per session trace
+
+
+def _label_key(labels):
+    return tuple(sorted((k, str(v)) for k, v in labels.items()))
+
+
+def _format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ""
+    return "{" + ",".join(f'{k}="{v}"' for k, v in pairs) + "}"
+
+
+class Counter:
+    def __init__(self, name, help_text):
+        self.name, self.help = name, help_text
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount=1, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels):
+        return self._values.get(_label_key(labels), 0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(key)} {value}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name, help_text, buckets=LATENCY_BUCKETS):
+        self.name, self.help = name, help_text
+        self.buckets = tuple(buckets)
+        self._series = {}  # label key -> [bucket counts..., +Inf count, sum]
+        self._lock = threading.Lock()
+
+    def observe(self, value, **labels):
+        key = _label_key(labels)
+        with self._lock:
+            series = self._series.setdefault(key, [0] * (len(self.buckets) + 1) + [0.0])
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series[i] += 1
+            series[len(self.buckets)] += 1
+            series[-1] += value
+
+    def snapshot(self, **labels):
+        """(count, sum) for one label set."""
+        series = self._series.get(_label_key(labels))
+        return (series[len(self.buckets)], series[-1]) if series else (0, 0.0)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, n in zip(self.buckets, series):
+                    lines.append(f"{self.name}_bucket{_format_labels(key, [('le', bound)])} {n}")
+                n = series[len(self.buckets)]
+                lines.append(f"{self.name}_bucket{_format_labels(key, [('le', '+Inf')])} {n}")
+                lines.append(f"{self.name}_sum{_format_labels(key)} {series[-1]:.6f}")
+                lines.append(f"{self.name}_count{_format_labels(key)} {n}")
+        return lines
+
+
+STAGE_SECONDS = Histogram("bill_stage_seconds", "Wall time per pipeline stage")
+STAGE_ERRORS = Counter("bill_stage_errors_total", "Stages that raised")
+TOKENS = Counter("bill_tokens_total", "Responses API tokens by kind (input, cached_input, output)")
+EVENTS = Counter("bill_events_total", "Pipeline events (cache hits, routes, fallbacks)")
+REGISTRY = [STAGE_SECONDS, STAGE_ERRORS, TOKENS, EVENTS]
+
+
+def log_event(event, **fields):
+    if METRICS_LOG:
+        logger.info(json.dumps({"event": event, "ts": round(time.time(), 3), **fields}, default=str))
+
+
+@contextlib.contextmanager
+def span(stage, trace=None, **fields):
+    """Time a block as `stage`. Yields a dict the block can add fields to (bytes, dpi, ...).
+    fields and anything added end up in the JSON log line and the trace entry, not in metric labels."""
+    extra = {}
+    t0 = time.perf_counter()
+    ok = True
+    try:
+        yield extra
+    except Exception:  # not GeneratorExit: a consumer dropping a stream early isn't a failure
+        ok = False
+        STAGE_ERRORS.inc(stage=stage)
+        raise
+    finally:
+        seconds = time.perf_counter() - t0
+        STAGE_SECONDS.observe(seconds, stage=stage)
+        entry = {"stage": stage, "ms": round(seconds * 1000, 2), "ok": ok, **fields, **extra}
+        log_event("span", **entry)
+        if trace is not None:
+            trace.append(entry)
+            del trace[:-TRACE_MAX]
+
+
+def replay(entries, trace=None):
+    """Record spans timed in another process (bill_service.py's render pool) as if they ran here:
+    histogram, error count, log line and trace entry."""
+    for entry in entries:
+        STAGE_SECONDS.observe(entry["ms"] / 1000, stage=entry["stage"])
+        if not entry["ok"]:
+            STAGE_ERRORS.inc(stage=entry["stage"])
+        log_event("span", **entry)
+        if trace is not None:
+            trace.append(entry)
+    if trace is not None:
+        del trace[:-TRACE_MAX]
+
+
+def observe(stage, seconds):
+    # For timings a span can't wrap (e.g. time to first streamed token)
+    STAGE_SECONDS.observe(seconds, stage=stage)
+
+
+def count(event, amount=1, **labels):
+    EVENTS.inc(amount, event=event, **labels)
+
+
+def usage_dict(usage):
+    """Plain dict of token counts from a Responses API usage object (or dict); None if absent."""
+    if usage is None:
+        return None
+    get = usage.get if isinstance(usage, dict) else lambda k, d=None: getattr(usage, k, d)
+    details = get("input_tokens_details")
+    cached = (details.get("cached_tokens") if isinstance(details, dict)
+              else getattr(details, "cached_tokens", 0)) or 0
+    return {
+        "input_tokens": get("input_tokens", 0) or 0,
+        "cached_tokens": cached,
+        "output_tokens": get("output_tokens", 0) or 0,
+    }
+
+
+def record_usage(usage, model, trace=None):
+    """Count tokens from a response's usage. Returns the usage dict (or None)."""
+    tokens = usage_dict(usage)
+    if tokens is None:
+        return None
+    TOKENS.inc(tokens["input_tokens"], kind="input", model=model)
+    TOKENS.inc(tokens["cached_tokens"], kind="cached_input", model=model)
+    TOKENS.inc(tokens["output_tokens"], kind="output", model=model)
+    log_event("usage", model=model, **tokens)
+    if trace is not None:
+        trace.append({"stage": "usage", "model": model, **tokens})
+        del trace[:-TRACE_MAX]
+    return tokens
+
+
+def render_prometheus():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def log_message(self, fmt, *args):
+        pass
+
+    def do_GET(self):
+        if self.path.rstrip("/") != "/metrics":
+            self.send_response(404)
+            self.end_headers()
+            return
+        body = render_prometheus().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def start_metrics_server(port=METRICS_PORT):
+    """Serve /metrics on a daemon thread; returns the server (or None when port is 0)."""
+    if not port:
+        return None
+    server = ThreadingHTTPServer(("0.0.0.0", port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True, name="metrics-http").start()
+    return server
+
+
+def configure_logging(level=logging.INFO):
+    """One stderr handler printing the JSON lines as-is (idempotent)."""
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        logger.addHandler(handler)
+        logger.setLevel(level)
+        logger.propagate = False
+    return logger
@@ -0,0 +1,222 @@
+# preprocess_meter.py
+# Goal: enhance seven-seg digits and preserve the tiny decimal point.
+# Importable (meter_reader.py builds on preprocess_masks; preprocess_batch serves bulk runs) and runnable:
+#   python preprocess_meter.py --img path/to/img.png --save out.png
+
+import argparse, os
+import multiprocessing
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import shared_memory
+import cv2
+import numpy as np
+
+# Decimal-dot area bounds (pixels) were tuned on ROIs rendered at REFERENCE_DPI
+DOT_AREA_BOUNDS = (2, 120)
+REFERENCE_DPI = 500
+# Illumination background: a sigma-25 Gaussian blur (151 px kernel), by far the costliest stage at
+# 300-500 DPI. It is estimated on an image shrunk by BACKGROUND_DOWNSAMPLE and resized back; the
+# background is smooth, so the masks barely change. 1 = blur at full resolution.
+BACKGROUND_SIGMA = 25
+BACKGROUND_DOWNSAMPLE = 4
+BATCH_PROCESS_MIN = 64  # preprocess_batch fans out across processes from this many images
+
+# Structuring elements, built once
+OPEN_KERNEL = np.ones((2,2), np.uint8)
+DOT_KERNEL = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (3,3))
+_local = threading.local()  # CLAHE objects hold state, so one per thread rather than one per process
+
+
+def _clahe():
+    clahe = getattr(_local, "clahe", None)
+    if clahe is None:
+        clahe = _local.clahe = cv2.createCLAHE(clipLimit=2.0, tileGridSize=(8,8))
+    return clahe
+
+
+def dot_area_bounds(dpi=None):
+    """(min_area, max_area) for the dot filter, scaled from REFERENCE_DPI by area (dpi^2)."""
+    lo, hi = DOT_AREA_BOUNDS
+    if dpi is None or dpi == REFERENCE_DPI:
+        return lo, hi
+    scale = (dpi / REFERENCE_DPI) ** 2
+    return max(1, int(round(lo * scale))), max(1, int(round(hi * scale)))
+
+
+def filter_components_by_area(mask, min_area, max_area):
+    """Keep connected components whose area is within [min_area, max_area].
+    One pass: build a label -> 0/255 lookup table from the stats, then index it with the label image
+    (instead of comparing the whole image against every label)."""
+    _, labels, stats, _ = cv2.connectedComponentsWithStats(mask, connectivity=8)
+    areas = stats[:, cv2.CC_STAT_AREA]
+    lut = np.where((areas >= min_area) & (areas <= max_area), 255, 0).astype(np.uint8)
+    lut[0] = 0  # background
+    return lut[labels]
+
+
+def estimate_background(gray, sigma=BACKGROUND_SIGMA, downsample=BACKGROUND_DOWNSAMPLE):
+    """Gaussian-blurred background for blur-divide; with downsample > 1 the blur runs on an INTER_AREA
+    shrunk copy (sigma scaled to match) and is resized back with INTER_LINEAR."""
+    h, w = gray.shape
+    if downsample <= 1 or min(h, w) < 16 * downsample:
+        return cv2.GaussianBlur(gray, (0,0), sigmaX=sigma, sigmaY=sigma)
+    small = cv2.resize(gray, (w // downsample, h // downsample), interpolation=cv2.INTER_AREA)
+    small = cv2.GaussianBlur(small, (0,0), sigmaX=sigma / downsample, sigmaY=sigma / downsample)
+    return cv2.resize(small, (w, h), interpolation=cv2.INTER_LINEAR)
+
+
+def preprocess_masks(img_bgr, dpi=None, downsample=BACKGROUND_DOWNSAMPLE):
+    """Run the pipeline and return every intermediate stage as a dict:
+    gray, norm, hi, den, digits, bh_norm, dot, combo.
+    dpi is the render DPI of img_bgr; it scales the dot-area bounds (None = tuned default).
+    downsample: see BACKGROUND_DOWNSAMPLE (1 reproduces the full-resolution background)."""
+    # 2) grayscale
+    gray = cv2.cvtColor(img_bgr, cv2.COLOR_BGR2GRAY)
+
+    # 3) illumination normalization (blur-divide)
+    # big kernel to estimate background
+    bg = estimate_background(gray, downsample=downsample)
+    bg = np.clip(bg, 1, None)
+    norm = cv2.divide(gray, bg, scale=255)
+
+    # 4) contrast boost (CLAHE)
+    hi = _clahe().apply(norm)
+
+    # 5) light denoise that won’t kill the dot
+    # (avoid median with large kernel; it erases tiny points)
+    den = cv2.bilateralFilter(hi, d=7, sigmaColor=25, sigmaSpace=7)
+
+    # 6) DIGITS path: adaptive threshold
+    digits = cv2.adaptiveThreshold(
+        den, 255, cv2.ADAPTIVE_THRESH_GAUSSIAN_C,
+        cv2.THRESH_BINARY_INV, 35, 7
+    )
+    # gentle open to break dust specks, keep segments
+    digits = cv2.morphologyEx(digits, cv2.MORPH_OPEN, OPEN_KERNEL, iterations=1)
+
+    # 7) DECIMAL path: black-hat to enhance tiny dark blobs on light background
+    # use a tiny kernel so only dot-size survives
+    blackhat = cv2.morphologyEx(den, cv2.MORPH_BLACKHAT, DOT_KERNEL)
+    # normalize then threshold small responses
+    bh_norm = cv2.normalize(blackhat, None, 0, 255, cv2.NORM_MINMAX)
+    _, dot_mask = cv2.threshold(bh_norm, 0, 255, cv2.THRESH_BINARY+cv2.THRESH_OTSU)
+    # keep only very small components (areas typical of dot; bounds scale with DPI)
+    cleaned_dot = filter_components_by_area(dot_mask, *dot_area_bounds(dpi))
+
+    # 8) Combine
+    combo = cv2.bitwise_or(digits, cleaned_dot)
+
+    # OPTIONAL: thicken a touch to help OCR
+    combo = cv2.morphologyEx(combo, cv2.MORPH_DILATE, OPEN_KERNEL, iterations=1)
+
+    return {"gray": gray, "norm": norm, "hi": hi, "den": den, "digits": digits,
+            "bh_norm": bh_norm, "dot": cleaned_dot, "combo": combo}
+
+
+def preprocess(img_bgr, show_steps=False, dpi=None):
+    """Returns (final mask, original image) -- the original is used for side-by-side previews."""
+    stages = preprocess_masks(img_bgr, dpi=dpi)
+    combo = stages["combo"]
+
+    if show_steps:
+        import matplotlib.pyplot as plt
+        imgs = [img_bgr] + [stages[k] for k in ("gray", "norm", "hi", "den", "digits", "bh_norm", "dot", "combo")]
+        titles = ["original", "Gray", "Blur-Divide", "CLAHE", "Denoised",
+                  "Digits (adaptive)", "Black-hat (norm)", "Dot mask", "Final mask"]
+        for t, im in zip(titles, imgs):
+            plt.figure(); 
+            if im.ndim == 2:
+                plt.imshow(im, cmap='gray')
+            else:
+                plt.imshow(im)
+            plt.title(t); plt.axis('off')
+        plt.show()
+
+    return combo, img_bgr
+
+def init_batch_worker():
+    # One OpenCV thread per worker process: the pool already uses every core
+    cv2.setNumThreads(1)
+
+
+def _preprocess_shared(in_name, out_name, specs, dpi, downsample):
+    """Worker side of preprocess_batch: images are read from / masks written to shared memory.
+    specs: [(input offset, (h, w, 3), output offset), ...]"""
+    src = shared_memory.SharedMemory(name=in_name)
+    dst = shared_memory.SharedMemory(name=out_name)
+    try:
+        for in_off, shape, out_off in specs:
+            img = np.ndarray(shape, np.uint8, buffer=src.buf, offset=in_off)
+            out = np.ndarray(shape[:2], np.uint8, buffer=dst.buf, offset=out_off)
+            out[:] = preprocess_masks(img, dpi=dpi, downsample=downsample)["combo"]
+            del img, out  # views must go before the buffers are closed
+    finally:
+        src.close()
+        dst.close()
+
+
+def preprocess_batch(images, dpi=None, executor=None, processes=None, downsample=BACKGROUND_DOWNSAMPLE):
+    """Final masks (preprocess()'s first value) for a list of BGR images, in order.
+    Fewer than BATCH_PROCESS_MIN images run here, one after another. Larger batches fan out across
+    `executor` (a ProcessPoolExecutor; one with `processes` workers is made for the call if None):
+    the images are packed into one shared-memory block and the masks written into another, so only
+    offsets cross the process boundary instead of pickled arrays."""
+    images = [np.ascontiguousarray(img, dtype=np.uint8) for img in images]
+    if len(images) < BATCH_PROCESS_MIN and executor is None:
+        return [preprocess_masks(img, dpi=dpi, downsample=downsample)["combo"] for img in images]
+
+    specs, in_size, out_size = [], 0, 0
+    for img in images:
+        specs.append((in_size, img.shape, out_size))
+        in_size += img.nbytes
+        out_size += img.shape[0] * img.shape[1]
+    src = shared_memory.SharedMemory(create=True, size=max(1, in_size))
+    dst = shared_memory.SharedMemory(create=True, size=max(1, out_size))
+    own = executor is None
+    if own:
+        # spawn, not fork: OpenCV's thread pool doesn't survive a fork
+        executor = ProcessPoolExecutor(processes or os.cpu_count(), initializer=init_batch_worker,
+                                       mp_context=multiprocessing.get_context("spawn"))
+    try:
+        for (in_off, _, _), img in zip(specs, images):
+            src.buf[in_off:in_off + img.nbytes] = img.reshape(-1)
+        workers = getattr(executor, "_max_workers", 1)
+        chunk = max(1, -(-len(specs) // (workers * 4)))  # a few chunks per worker evens out stragglers
+        futures = [executor.submit(_preprocess_shared, src.name, dst.name, specs[i:i + chunk], dpi, downsample)
+                   for i in range(0, len(specs), chunk)]
+        for future in futures:
+            future.result()
+        out = np.ndarray((out_size,), np.uint8, buffer=dst.buf)
+        masks = [out[off:off + shape[0] * shape[1]].reshape(shape[:2]).copy() for _, shape, off in specs]
+        del out
+        return masks
+    finally:
+        if own:
+            executor.shutdown()
+        src.close(); src.unlink()
+        dst.close(); dst.unlink()
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--img", required=True, help="Path to meter image")
+    ap.add_argument("--save", default="preprocessed.png", help="Output mask path")
+    ap.add_argument("--show", action="store_true", help="Show steps with matplotlib")
+    ap.add_argument("--dpi", type=int, default=None, help="Render DPI of the image (scales dot-area bounds)")
+    args = ap.parse_args()
+
+    img = cv2.imread(args.img)
+    if img is None:
+        raise FileNotFoundError(args.img)
+
+    mask, roi = preprocess(img, show_steps=args.show, dpi=args.dpi)
+
+    cv2.imwrite(args.save, mask)
+    print(f"Saved -> {args.save}")
+
+    # For quick visual check side-by-side
+    vis = np.hstack([cv2.cvtColor(roi, cv2.COLOR_BGR2GRAY), mask])
+    cv2.imwrite(os.path.splitext(args.save)[0] + "_sideby.png", vis)
+
+if __name__ == "__main__":
+    main()
@@ -35,13 +35,24 @@ def main():
         type=float,
         metavar=("X0", "Y0", "X1", "Y1"),
         default=(348, 469, 540, 610),
-        help="Bounding box in PDF points, origin BOTTOM-LEFT (x0 y0 x1 y1)",
+        help="Bounding box in PDF points, origin TOP-LEFT (x0 y0 x1 y1)",
     )
     parser.add_argument("--dpi", type=int, default=400, help="Render DPI (default: 400)")
     parser.add_argument(
-        "--no-sharpen",
+        "--locate",
+        action="store_true",
+        help="Find the meter photo on the page and use --bbox only as a hint",
+    )
+    parser.add_argument(
+        "--sharpen",
         action="store_true",
-        help="Disable the unsharp mask cleanup",
+        help="Apply an unsharp mask to the crop (default: off, the crop as rendered)",
+    )
+    parser.add_argument(
+        "--no-sharpen",
+        dest="sharpen",
+        action="store_false",
+        help="Don't sharpen (the default; kept for existing scripts)",
     )
     args = parser.parse_args()
 
@@ -57,7 +68,8 @@ def main():
         page_number=args.page,
         bbox=bbox,
         dpi=args.dpi,
-        sharpen=not args.no_sharpen,
+        sharpen=args.sharpen,
+        locate=args.locate,
     )
 
     print(f"Saved ROI PDF -> {result}")
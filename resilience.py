@@ -0,0 +1,306 @@
+# resilience.py
+# Retry / deadline / rate-limit / hedging policy for OpenAI calls, stdlib + the openai SDK's exceptions.
+# - call_with_retries() runs one logical call within a deadline, retrying 429/5xx/connection errors with
+#   jittered exponential backoff (Retry-After wins when the server sends it).
+# - LIMITER is a token bucket shared by every session in the process; a 429 also pauses it for everyone.
+# - hedged() starts a second identical request once the first runs past a delay (the first turn's p95).
+# - acall_with_retries() / ahedged() are the same policy for the AsyncOpenAI client (bill_service.py).
+# - describe_error() turns what's left into a message for the UI.
+
+import asyncio
+import os
+import random
+import sys
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from metrics import count, log_event, observe
+
+RETRY_ATTEMPTS = int(os.environ.get("OPENAI_RETRY_ATTEMPTS", "4"))  # tries per call, first one included
+RETRY_BASE_DELAY = float(os.environ.get("OPENAI_RETRY_BASE_DELAY", "0.5"))  # seconds, doubled per retry
+RETRY_MAX_DELAY = float(os.environ.get("OPENAI_RETRY_MAX_DELAY", "8"))
+# Whole-call budget in seconds (all attempts, backoff and rate-limit waits included)
+DEADLINES = {
+    "files.create": float(os.environ.get("OPENAI_DEADLINE_UPLOAD", "60")),
+    "files.delete": float(os.environ.get("OPENAI_DEADLINE_DELETE", "20")),
+    "files.retrieve": float(os.environ.get("OPENAI_DEADLINE_DELETE", "20")),  # same budget as deletes
+    "responses.create": float(os.environ.get("OPENAI_DEADLINE_RESPONSE", "90")),
+}
+# Client-side request rate for the whole process (0 = unlimited); 429 cool-downs apply either way
+RATE_LIMIT_RPS = float(os.environ.get("OPENAI_RATE_LIMIT_RPS", "0"))
+RATE_LIMIT_BURST = int(os.environ.get("OPENAI_RATE_LIMIT_BURST", "10"))
+# Hedged first turn: a second request once the first is slower than the observed p95
+HEDGE_FIRST_TURN = os.environ.get("OPENAI_HEDGE_FIRST_TURN", "0") == "1"
+HEDGE_AFTER = float(os.environ.get("OPENAI_HEDGE_AFTER", "8"))  # seconds, until there are enough samples
+HEDGE_MIN_SAMPLES = 20
+HEDGE_WINDOW = 200  # recent first-turn latencies the p95 is taken over
+
+RETRY_STATUSES = (408, 409, 429)  # plus every 5xx
+
+
+class DeadlineExceeded(TimeoutError):
+    """A call (with its retries) didn't finish within its deadline."""
+
+
+def _sdk():
+    # The openai module once a client has been built, else None: no exception can be one of its
+    # errors before that, and importing it just to check would undo agent_factory's lazy import
+    return sys.modules.get("openai")
+
+
+def retryable(exc):
+    openai = _sdk()
+    if openai is None:
+        return False
+    if isinstance(exc, openai.APIConnectionError):  # includes APITimeoutError
+        return True
+    if isinstance(exc, openai.APIStatusError):
+        if getattr(exc, "code", None) == "insufficient_quota":
+            return False  # a 429 that waiting won't fix
+        return exc.status_code in RETRY_STATUSES or exc.status_code >= 500
+    return False
+
+
+def retry_after(exc):
+    """Seconds the server asked us to wait (Retry-After / retry-after-ms), or None."""
+    response = getattr(exc, "response", None)
+    headers = getattr(response, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass  # HTTP-date form: fall back to our own backoff
+    return None
+
+
+def backoff_delay(attempt, rng=random):
+    """Full-jitter exponential backoff for retry number `attempt` (1-based)."""
+    return rng.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * 2 ** (attempt - 1)))
+
+
+class RateLimiter:
+    """Token bucket shared by all sessions in the process. cool_down() blocks everyone for a while,
+    so one 429 with Retry-After backs off the whole process instead of each session finding out alone."""
+
+    def __init__(self, rate=RATE_LIMIT_RPS, burst=RATE_LIMIT_BURST):
+        self.rate, self.burst = rate, max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated = time.monotonic()
+        self._blocked_until = 0.0
+        self._lock = threading.Lock()
+
+    def _reserve(self, deadline):
+        """Take the next request slot; returns how long to wait before using it. The bucket may go
+        negative, which queues later callers behind this one. Nothing is taken when the wait would
+        pass the deadline (a time.monotonic() value)."""
+        with self._lock:
+            now = time.monotonic()
+            wait_for = max(0.0, self._blocked_until - now)
+            if self.rate:
+                self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens < 1:
+                    wait_for = max(wait_for, (1 - self._tokens) / self.rate)
+            if now + wait_for > deadline:
+                raise DeadlineExceeded("rate limiter wait would pass the deadline")
+            if self.rate:
+                self._tokens -= 1
+            return wait_for
+
+    def acquire(self, deadline):
+        """Wait for a request slot. Returns seconds waited."""
+        wait_for = self._reserve(deadline)
+        if wait_for > 0:
+            time.sleep(wait_for)
+        return wait_for
+
+    async def aacquire(self, deadline):
+        """acquire() for coroutines: waits without blocking the event loop."""
+        wait_for = self._reserve(deadline)
+        if wait_for > 0:
+            await asyncio.sleep(wait_for)
+        return wait_for
+
+    def cool_down(self, seconds):
+        with self._lock:
+            self._blocked_until = max(self._blocked_until, time.monotonic() + seconds)
+
+
+LIMITER = RateLimiter()
+
+
+def _retry_delay(exc, attempt, attempts, endpoint, limiter, end):
+    """Seconds to back off before retrying after `exc`; re-raises it when it isn't worth retrying
+    and raises DeadlineExceeded when the backoff wouldn't fit in the deadline."""
+    if not retryable(exc) or attempt == attempts:
+        raise exc
+    server_wait = retry_after(exc)
+    delay = max(server_wait or 0.0, backoff_delay(attempt))
+    status = getattr(exc, "status_code", type(exc).__name__)
+    count("retry", endpoint=endpoint, status=status)
+    log_event("retry", endpoint=endpoint, status=status, attempt=attempt, delay=round(delay, 3))
+    if status == 429 and server_wait:
+        limiter.cool_down(server_wait)
+    if time.monotonic() + delay >= end:
+        count("deadline_exceeded", endpoint=endpoint)
+        raise DeadlineExceeded(f"{endpoint}: no time left to retry after {status}") from exc
+    return delay
+
+
+def _policy(endpoint, deadline, limiter, attempts):
+    limiter = LIMITER if limiter is None else limiter
+    attempts = RETRY_ATTEMPTS if attempts is None else attempts
+    budget = DEADLINES.get(endpoint, 60.0) if deadline is None else deadline
+    return limiter, attempts, budget, time.monotonic() + budget
+
+
+def call_with_retries(fn, endpoint, deadline=None, limiter=None, attempts=None):
+    """Run fn(timeout) -- one API request given the seconds left -- under the endpoint's deadline,
+    retrying transient failures with backoff. Raises the last error, or DeadlineExceeded."""
+    limiter, attempts, budget, end = _policy(endpoint, deadline, limiter, attempts)
+    for attempt in range(1, attempts + 1):
+        waited = limiter.acquire(end)
+        if waited > 0.001:
+            observe("rate_limit_wait", waited)
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            return fn(remaining)
+        except Exception as e:
+            time.sleep(_retry_delay(e, attempt, attempts, endpoint, limiter, end))
+    count("deadline_exceeded", endpoint=endpoint)
+    raise DeadlineExceeded(f"{endpoint}: deadline of {budget:.0f}s exceeded")
+
+
+async def acall_with_retries(fn, endpoint, deadline=None, limiter=None, attempts=None):
+    """call_with_retries() for the async client: fn(timeout) returns an awaitable."""
+    limiter, attempts, budget, end = _policy(endpoint, deadline, limiter, attempts)
+    for attempt in range(1, attempts + 1):
+        waited = await limiter.aacquire(end)
+        if waited > 0.001:
+            observe("rate_limit_wait", waited)
+        remaining = end - time.monotonic()
+        if remaining <= 0:
+            break
+        try:
+            return await fn(remaining)
+        except Exception as e:
+            await asyncio.sleep(_retry_delay(e, attempt, attempts, endpoint, limiter, end))
+    count("deadline_exceeded", endpoint=endpoint)
+    raise DeadlineExceeded(f"{endpoint}: deadline of {budget:.0f}s exceeded")
+
+
+class LatencyWindow:
+    """Recent latencies (seconds) for a p95."""
+
+    def __init__(self, size=HEDGE_WINDOW):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def p95(self, min_samples=HEDGE_MIN_SAMPLES):
+        with self._lock:
+            ordered = sorted(self._samples)
+        if len(ordered) < min_samples:
+            return None
+        return ordered[int(0.95 * (len(ordered) - 1))]
+
+
+FIRST_TURN_LATENCY = LatencyWindow()
+_hedge_pool = None
+_hedge_pool_lock = threading.Lock()
+
+
+def hedge_delay(window=FIRST_TURN_LATENCY):
+    """When to send the hedge: the observed p95, or HEDGE_AFTER until there are enough samples."""
+    p95 = window.p95()
+    return HEDGE_AFTER if p95 is None else p95
+
+
+def _pool():
+    global _hedge_pool
+    with _hedge_pool_lock:
+        if _hedge_pool is None:
+            _hedge_pool = ThreadPoolExecutor(max_workers=16, thread_name_prefix="hedge")
+        return _hedge_pool
+
+
+def hedged(fn, after, discard=None):
+    """Run fn(); if it hasn't returned within `after` seconds, start a second fn() and return
+    whichever succeeds first. discard(result) gets the slower result if it arrives (e.g. to close
+    a stream). Raises the first error only if both attempts fail."""
+    first = _pool().submit(fn)
+    done, _ = wait([first], timeout=after)
+    if done:
+        return first.result()
+    count("hedge", outcome="sent")
+    second = _pool().submit(fn)
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for future in done:
+            if future.exception() is not None:
+                error = error or future.exception()
+                continue
+            count("hedge", outcome="won" if future is second else "lost")
+            for other in pending:
+                if discard is not None:
+                    other.add_done_callback(lambda f: f.exception() is None and discard(f.result()))
+            return future.result()
+    raise error
+
+
+async def ahedged(fn, after, discard=None):
+    """hedged() for coroutines: fn() returns an awaitable; the slower attempt is cancelled."""
+    first = asyncio.ensure_future(fn())
+    done, _ = await asyncio.wait([first], timeout=after)
+    if done:
+        return first.result()
+    count("hedge", outcome="sent")
+    second = asyncio.ensure_future(fn())
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+        for task in done:
+            if task.exception() is not None:
+                error = error or task.exception()
+                continue
+            count("hedge", outcome="won" if task is second else "lost")
+            for other in pending:
+                other.cancel()
+                if discard is not None:
+                    other.add_done_callback(
+                        lambda t: not t.cancelled() and t.exception() is None and discard(t.result())
+                    )
+            return task.result()
+    raise error
+
+
+def describe_error(exc):
+    """Short user-facing explanation of a failed OpenAI call."""
+    if isinstance(exc, DeadlineExceeded) and exc.__cause__ is not None:
+        return describe_error(exc.__cause__)  # out of time while retrying: say why it kept failing
+    openai = _sdk()
+    if isinstance(exc, DeadlineExceeded) or openai and isinstance(exc, openai.APITimeoutError):
+        return "The AI service took too long to answer. Please try again."
+    if openai is None:
+        return f"Something went wrong: {exc}"
+    if isinstance(exc, openai.RateLimitError):
+        if getattr(exc, "code", None) == "insufficient_quota":
+            return "The OpenAI account is out of quota. Check the plan and billing details."
+        return "The AI service is busy right now (rate limited). Please try again in a minute."
+    if isinstance(exc, openai.APIConnectionError):
+        return "Couldn't reach the AI service. Check the network connection and try again."
+    if isinstance(exc, openai.APIStatusError) and exc.status_code >= 500:
+        return "The AI service had a temporary problem. Please try again."
+    return f"Something went wrong: {exc}"
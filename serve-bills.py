@@ -0,0 +1,54 @@
+# serve_bills.py
+# Runs the bill service (bill_service.py) with its HTTP API, for internal tools and load tests.
+# One process is one pod: a single event loop, a bounded job queue and a render process pool.
+# Usage:
+#   python serve-bills.py --port 8700
+#   python serve-bills.py --workers 128 --queue 512 --processes 4
+#   BILL_API_TOKEN=... python serve-bills.py --host 0.0.0.0   # other hosts: every request needs the token
+#   curl -s --data-binary @bill.pdf 'localhost:8700/v1/bills?name=bill.pdf'     # -> job id
+#   curl -s localhost:8700/v1/jobs/<job>
+
+import argparse
+import sys
+import threading
+
+import bill_service
+from agent_factory import build_client, build_response_cache
+from bill_service import BillService, start_api_server
+from metrics import configure_logging
+from upload_cache import UploadCache
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Serve bill Q&A jobs over HTTP.")
+    ap.add_argument("--host", default=bill_service.API_HOST,
+                    help="Bind address (default loopback; anything else needs BILL_API_TOKEN)")
+    ap.add_argument("--port", type=int, default=bill_service.API_PORT)
+    ap.add_argument("--workers", type=int, default=bill_service.JOB_WORKERS, help="Jobs in flight")
+    ap.add_argument("--queue", type=int, default=bill_service.JOB_QUEUE_MAX, help="Waiting jobs before 503s")
+    ap.add_argument("--processes", type=int, default=bill_service.RENDER_PROCESSES, help="Render processes")
+    ap.add_argument("--base-url", default=None, help="OpenAI-compatible API base URL (e.g. the stub)")
+    args = ap.parse_args()
+
+    configure_logging()
+    service = BillService(build_client(base_url=args.base_url), UploadCache(), build_response_cache(),
+                          workers=args.workers, queue_max=args.queue, processes=args.processes).start()
+    try:
+        server = start_api_server(service, port=args.port, host=args.host)
+    except ValueError as e:
+        service.stop()
+        print(e, file=sys.stderr)
+        return 2
+    print(f"serving on {args.host}:{server.server_address[1]} ({service.stats()})", file=sys.stderr)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.shutdown()
+        service.stop()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,134 @@
+# session_manager.py
+# Keeps a long-running server from leaking: Streamlit never says when a browser session ends, so every
+# BillSession is registered here, touched on each rerun, and closed once idle for SESSION_IDLE_TTL (or
+# when there are more than MAX_SESSIONS). Closing releases the session's uploads so the upload cache can
+# delete them remotely. A periodic GC also reclaims references that no live process accounts for (crashes,
+# restarts) and, when UPLOAD_ORPHAN_GC=1, remote files no cache entry knows.
+
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from bill_session import UPLOAD_PREFIX, delete_upload
+from metrics import count, log_event
+
+SESSION_IDLE_TTL = float(os.environ.get("SESSION_IDLE_TTL", "3600"))  # seconds without a rerun
+MAX_SESSIONS = int(os.environ.get("MAX_SESSIONS", "500"))  # least recently seen are closed beyond this
+GC_INTERVAL = float(os.environ.get("UPLOAD_GC_INTERVAL", "600"))  # seconds between orphan GC runs
+# References untouched this long belong to sessions that are gone (live ones are touched every GC pass)
+STALE_REF_AGE = float(os.environ.get("UPLOAD_STALE_REF_AGE", str(24 * 3600)))
+# Remote files of ours that the upload cache doesn't know are deleted once this old
+ORPHAN_MAX_AGE = float(os.environ.get("UPLOAD_ORPHAN_MAX_AGE", str(2 * 24 * 3600)))
+# Orphan deletion in the periodic GC. Off by default: a file only another process's cache knows looks like
+# an orphan here, and deleting it breaks that process's running sessions. Turn it on only when every
+# process shares one UPLOAD_CACHE_PATH (or there is a single process)
+ORPHAN_GC = os.environ.get("UPLOAD_ORPHAN_GC", "0") == "1"
+
+
+def collect_orphans(client, upload_cache, max_age=ORPHAN_MAX_AGE, dry_run=False):
+    """Delete remote files this app uploaded (filename starts with UPLOAD_PREFIX) that are older than
+    max_age and unknown to the upload cache. Files of other apps on the same account are never
+    touched. Returns the orphaned file_ids (deleted unless dry_run)."""
+    known = upload_cache.known_file_ids()
+    cutoff = time.time() - max_age
+    orphans = [
+        f.id for f in client.files.list(purpose="user_data")
+        if (f.filename or "").startswith(UPLOAD_PREFIX) and f.created_at < cutoff and f.id not in known
+    ]
+    if not dry_run:
+        for file_id in orphans:
+            try:
+                delete_upload(client, file_id)
+            except Exception:
+                pass  # still an orphan next run
+        count("orphan_deleted", len(orphans))
+    return orphans
+
+
+def collect_garbage(client, upload_cache, stale_ref_age=STALE_REF_AGE, orphan_max_age=ORPHAN_MAX_AGE,
+                    delete_orphans=True):
+    """One GC pass: drop stale references, evict what that frees up, then (delete_orphans) delete
+    orphaned remote files."""
+    stale = upload_cache.release_stale_refs(stale_ref_age)
+    evicted = upload_cache.evict(lambda file_id: delete_upload(client, file_id))
+    orphans = collect_orphans(client, upload_cache, orphan_max_age) if delete_orphans else []
+    log_event("upload_gc", stale_refs=stale, evicted=evicted, orphans=len(orphans))
+    return {"stale_refs": stale, "evicted": evicted, "orphans": len(orphans)}
+
+
+class SessionManager:
+    """Live BillSessions of this process. One per process (app.py wraps it in st.cache_resource)."""
+
+    def __init__(self, client_factory, upload_cache, pool, idle_ttl=SESSION_IDLE_TTL, max_sessions=MAX_SESSIONS,
+                 gc_interval=GC_INTERVAL, closer=None, orphan_gc=ORPHAN_GC):
+        self.client_factory = client_factory  # () -> the shared client; only called by GC passes
+        # closer(session) ends a session; bill_service.py passes one that closes it on its event loop
+        self.closer = closer or (lambda session: session.close())
+        self.upload_cache = upload_cache
+        self.pool = pool
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.gc_interval = gc_interval
+        self.orphan_gc = orphan_gc
+        self._sessions = OrderedDict()  # id(session) -> (session, last_seen), least recently seen first
+        self._lock = threading.Lock()
+        self._next_gc = time.monotonic() + gc_interval
+        self._gc_running = False
+
+    def touch(self, session):
+        """Register the session or mark it as seen now (call on every rerun that uses it)."""
+        with self._lock:
+            self._sessions[id(session)] = (session, time.monotonic())
+            self._sessions.move_to_end(id(session))
+
+    def close(self, session):
+        with self._lock:
+            self._sessions.pop(id(session), None)
+        self.closer(session)
+
+    def reap(self):
+        """Close idle sessions and those beyond max_sessions; keep live sessions' uploads fresh; start
+        a background GC pass when one is due. Cheap enough to call on every rerun."""
+        now = time.monotonic()
+        with self._lock:
+            idle = [s for s, seen in self._sessions.values() if now - seen > self.idle_ttl]
+            for session in idle:
+                self._sessions.pop(id(session))
+            over = []
+            while len(self._sessions) > self.max_sessions:
+                over.append(self._sessions.popitem(last=False)[1][0])
+            live = [s for s, _ in self._sessions.values()]
+            gc_due = now >= self._next_gc and not self._gc_running
+            if gc_due:
+                self._next_gc, self._gc_running = now + self.gc_interval, True
+        for reason, closing in (("idle", idle), ("max_sessions", over)):
+            for session in closing:
+                self.closer(session)
+            if closing:
+                count("session_closed", len(closing), reason=reason)
+        if gc_due:
+            in_use = [fid for session in live for fid in session.file_ids_in_use()]
+            self.pool.submit(self._gc, in_use)
+        return len(idle) + len(over)
+
+    def _gc(self, in_use):
+        try:
+            self.upload_cache.touch(in_use)
+            collect_garbage(self.client_factory(), self.upload_cache, delete_orphans=self.orphan_gc)
+        except Exception as e:
+            log_event("upload_gc_failed", error=f"{type(e).__name__}: {e}")
+        finally:
+            with self._lock:
+                self._gc_running = False
+
+    def close_all(self):
+        with self._lock:
+            sessions = [s for s, _ in self._sessions.values()]
+            self._sessions.clear()
+        for session in sessions:
+            self.closer(session)
+
+    def stats(self):
+        with self._lock:
+            return {"sessions": len(self._sessions), "idle_ttl": self.idle_ttl, "max_sessions": self.max_sessions}
@@ -0,0 +1,396 @@
+# stub_openai.py
+# Minimal local stand-in for the OpenAI Files and Responses endpoints, for offline benchmarks.
+# Uploaded files are listed by GET /files until deleted, so remote-storage leaks show up too.
+# Point a client at it with build_client(base_url=server.base_url) -- no network, no API key.
+# Latency can be set per endpoint (files.create, files.delete, responses.create) with jitter, streamed
+# answers can be paced per delta, and answers can be picked by matching the question text. Input tokens
+# are estimated from the request, PAGE_TOKENS per page of attached files and the continued chain's
+# context; --token-latency adds time per 1k of them, so sending fewer pages shows up in latency too.
+# Prompt caching is simulated the way the API reports it: the longest previously seen prefix of input
+# items (per model and prompt_cache_key), or the whole continued chain, counts as cached_tokens once it
+# is at least 1024 tokens (in steps of 128), and cached tokens cost no --token-latency. max_output_tokens
+# below the stub's answer length cuts it off with status "incomplete".
+# --faults makes a share of calls fail (429 with Retry-After by default, or e.g. 503) and --slow sends a
+# share of calls to a long tail, for exercising retries and hedging (resilience.py).
+# Usage:
+#   python stub_openai.py --port 8765          # serve until Ctrl-C
+#   python stub_openai.py --latency files.create=0.4,responses.create=0.9 --jitter 0.2 --stream-delay 0.02
+#   python stub_openai.py --faults responses.create=0.2 --retry-after 0.5 --slow 0.05=3
+
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+DEFAULT_ANSWER = (
+    "the electricity meter reads: 04512.37\n"
+    "Would you like to know anything else from the uploaded bill? e.g., the electricity cost, "
+    "units consumed, or any other detail."
+)
+
+PAGE_TOKENS = 1500  # what one attached PDF page roughly costs (page image + its text)
+CACHE_MIN_TOKENS, CACHE_STEP_TOKENS = 1024, 128  # shortest cacheable prefix, and its granularity
+
+_ids = itertools.count(1)
+
+
+def _next_id(prefix):
+    return f"{prefix}-stub{next(_ids):06d}"
+
+
+def parse_latency(spec):
+    """"0.2" -> 0.2 for every endpoint; "files.create=0.4,responses.create=0.9" -> per-endpoint dict."""
+    if "=" not in spec:
+        return float(spec)
+    pairs = (item.split("=", 1) for item in spec.split(",") if item.strip())
+    return {name.strip(): float(value) for name, value in pairs}
+
+
+def parse_faults(spec):
+    """"responses.create=0.2,files.create=0.1" -> {endpoint: share of calls to fail}."""
+    pairs = (item.split("=", 1) for item in (spec or "").split(",") if item.strip())
+    return {name.strip(): float(value) for name, value in pairs}
+
+
+def parse_slow(spec):
+    """"0.05=3" -> (share of calls, extra seconds)."""
+    share, seconds = spec.split("=", 1)
+    return float(share), float(seconds)
+
+
+def _question_text(request):
+    """Text of the last input_text part in a Responses request (the user's question)."""
+    text = ""
+    for message in request.get("input") or []:
+        content = message.get("content") if isinstance(message, dict) else None
+        if isinstance(content, str):
+            text = content
+        for part in content if isinstance(content, list) else []:
+            if part.get("type") == "input_text":
+                text = part.get("text", "")
+    return text
+
+
+def _file_ids(request):
+    """file_ids of the input_file parts in a Responses request."""
+    ids = []
+    for message in request.get("input") or []:
+        content = message.get("content") if isinstance(message, dict) else None
+        for part in content if isinstance(content, list) else []:
+            if part.get("type") == "input_file" and part.get("file_id"):
+                ids.append(part["file_id"])
+    return ids
+
+
+def _cacheable(tokens):
+    return tokens // CACHE_STEP_TOKENS * CACHE_STEP_TOKENS if tokens >= CACHE_MIN_TOKENS else 0
+
+
+def response_payload(text, model="gpt-4.1", input_tokens=1200, output_tokens=40, response_id=None,
+                     cached_tokens=0, status="completed"):
+    return {
+        "id": response_id or _next_id("resp"),
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": model,
+        "status": status,
+        "incomplete_details": {"reason": "max_output_tokens"} if status == "incomplete" else None,
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+        "output": [
+            {
+                "type": "message",
+                "id": _next_id("msg"),
+                "role": "assistant",
+                "status": status,
+                "content": [{"type": "output_text", "text": text, "annotations": []}],
+            }
+        ],
+        "usage": {
+            "input_tokens": input_tokens,
+            "input_tokens_details": {"cached_tokens": cached_tokens},
+            "output_tokens": output_tokens,
+            "output_tokens_details": {"reasoning_tokens": 0},
+            "total_tokens": input_tokens + output_tokens,
+        },
+    }
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive, like the real API
+    disable_nagle_algorithm = True  # headers and body go out as separate writes
+
+    def log_message(self, fmt, *args):  # keep benchmark output clean
+        pass
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length) if length else b""
+
+    def _send_json(self, payload, status=200):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_fault(self, endpoint):
+        """Fail this call if the server's fault injection says so; True when an error was sent."""
+        status = self.server.fault(endpoint)
+        if not status:
+            return False
+        body = json.dumps({"error": {
+            "message": f"stub fault on {endpoint}", "code": "rate_limit_exceeded" if status == 429 else None,
+            "type": "rate_limit_error" if status == 429 else "server_error", "param": None,
+        }}).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        if self.server.retry_after is not None:
+            self.send_header("Retry-After", f"{self.server.retry_after:g}")
+        self.end_headers()
+        self.wfile.write(body)
+        return True
+
+    def do_POST(self):
+        body = self._read_body()
+        if self.path.rstrip("/").endswith("/files"):
+            if self._send_fault("files.create"):
+                return
+            self.server.record("files.create", len(body))
+            self.server.sleep("files.create")
+            file_id = _next_id("file")
+            # page objects of an uncompressed-xref PDF; good enough to price attached files
+            self.server.file_pages[file_id] = max(1, len(re.findall(rb"/Type\s*/Page\b", body)))
+            name = re.search(rb'filename="([^"]*)"', body)
+            entry = {
+                "id": file_id, "object": "file", "bytes": len(body),
+                "created_at": int(time.time()), "filename": name.group(1).decode() if name else "upload.pdf",
+                "purpose": "user_data", "status": "processed",
+            }
+            self.server.files[file_id] = entry
+            self._send_json(entry)
+        elif self.path.rstrip("/").endswith("/responses"):
+            if self._send_fault("responses.create"):
+                return
+            request = json.loads(body or b"{}")
+            # Roughly what the request would cost: ~4 bytes per token (inline images included)
+            # plus PAGE_TOKENS per page of each attached file, plus the context of the chain it continues
+            input_tokens, cached_tokens = self.server.input_cost(request, len(body))
+            self.server.record("responses.create", len(body), input_tokens=input_tokens, cached_tokens=cached_tokens)
+            self.server.sleep("responses.create", input_tokens - cached_tokens)
+            text = self.server.answer_for(_question_text(request))
+            output_tokens, status = self.server.output_tokens, "completed"
+            if request.get("max_output_tokens") and request["max_output_tokens"] < output_tokens:
+                output_tokens, status = request["max_output_tokens"], "incomplete"
+                text = text[:len(text) * output_tokens // self.server.output_tokens]
+            payload = response_payload(
+                text, model=request.get("model", "gpt-4.1"), input_tokens=input_tokens,
+                output_tokens=output_tokens, cached_tokens=cached_tokens, status=status,
+            )
+            self.server.context_tokens[payload["id"]] = input_tokens + output_tokens
+            if request.get("stream"):
+                self._send_stream(payload)
+            else:
+                self._send_json(payload)
+        else:
+            self._send_json({"error": {"message": f"no stub for {self.path}"}}, status=404)
+
+    def do_GET(self):
+        if self.path.split("?")[0].rstrip("/").endswith("/files"):
+            self.server.record("files.list", 0)
+            files = sorted(self.server.files.values(), key=lambda f: f["created_at"], reverse=True)
+            self._send_json({"object": "list", "data": files, "has_more": False})
+        elif "/files/" in self.path:
+            self.server.record("files.retrieve", 0)
+            entry = self.server.files.get(self.path.split("?")[0].rsplit("/", 1)[-1])
+            if entry:
+                self._send_json(entry)
+            else:
+                self._send_json({"error": {"message": "No such File object", "type": "invalid_request_error",
+                                           "param": "id", "code": None}}, status=404)
+        else:
+            self._send_json({"error": {"message": f"no stub for {self.path}"}}, status=404)
+
+    def do_DELETE(self):
+        self._read_body()
+        if "/files/" in self.path:
+            if self._send_fault("files.delete"):
+                return
+            self.server.record("files.delete", 0)
+            self.server.sleep("files.delete")
+            file_id = self.path.rsplit("/", 1)[-1]
+            self.server.files.pop(file_id, None)
+            self._send_json({"id": file_id, "object": "file", "deleted": True})
+        else:
+            self._send_json({"error": {"message": f"no stub for {self.path}"}}, status=404)
+
+    def _send_stream(self, payload):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+        text = payload["output"][0]["content"][0]["text"]
+        item_id = payload["output"][0]["id"]
+        seq = itertools.count()
+        events = [("response.created", {"response": {**payload, "status": "in_progress", "output": []}})]
+        for i in range(0, len(text), 8):
+            events.append(("response.output_text.delta", {
+                "item_id": item_id, "output_index": 0, "content_index": 0,
+                "delta": text[i:i + 8], "logprobs": [],
+            }))
+        events.append((f"response.{payload['status']}", {"response": payload}))
+        for name, data in events:
+            if name == "response.output_text.delta" and self.server.stream_delay:
+                time.sleep(self.server.stream_delay)
+            data = {"type": name, "sequence_number": next(seq), **data}
+            self.wfile.write(f"event: {name}\ndata: {json.dumps(data)}\n\n".encode())
+            self.wfile.flush()
+
+
+class StubOpenAIServer(ThreadingHTTPServer):
+    daemon_threads = True
+    request_queue_size = 256  # listen backlog for load tests (bench-service.py); the default is 5
+
+    def __init__(self, port=0, latency=0.0, answer=DEFAULT_ANSWER, jitter=0.0, stream_delay=0.0,
+                 answers=(), input_tokens=None, output_tokens=40, seed=0, token_latency=0.0,
+                 faults=None, fault_status=429, retry_after=None, slow_share=0.0, slow_latency=0.0,
+                 prompt_cache=True):
+        super().__init__(("127.0.0.1", port), StubHandler)
+        # seconds added to every call, or {endpoint: seconds} (see parse_latency)
+        self.latency = latency
+        self.jitter = jitter  # +/- fraction of the latency, uniformly random
+        self.stream_delay = stream_delay  # seconds before each streamed text delta
+        self.token_latency = token_latency  # extra seconds per 1k input tokens (prompt processing)
+        self.faults = faults or {}  # endpoint -> share of calls answered with fault_status
+        self.fault_status = fault_status
+        self.retry_after = retry_after  # seconds sent as Retry-After on faults (None: no header)
+        self.slow_share, self.slow_latency = slow_share, slow_latency  # long-tail calls
+        self.answer = answer
+        self.answers = list(answers)  # (substring of the question, answer) pairs, checked in order
+        self.input_tokens = input_tokens  # None: estimate from the request size
+        self.output_tokens = output_tokens
+        self.stats = {}  # endpoint -> {"calls": n, "bytes_in": n} (+ "input_tokens" for responses)
+        self.file_pages = {}  # file_id -> page count of the uploaded PDF
+        self.files = {}  # file_id -> file object, until deleted (listed by GET /files)
+        self.context_tokens = {}  # response id -> tokens a chain continuing it starts with
+        self.prompt_cache = prompt_cache
+        self.prefixes = set()  # (model, prompt_cache_key, hash of the first n input items) seen so far
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}/v1"
+
+    def input_cost(self, request, nbytes):
+        """(input_tokens, cached_tokens) of a responses.create request."""
+        if self.input_tokens:
+            return self.input_tokens, 0
+        chained = self.context_tokens.get(request.get("previous_response_id"), 0)
+        items = request.get("input") or []
+        if isinstance(items, str):
+            items = [items]
+        total = max(1, nbytes // 4) + chained + PAGE_TOKENS * sum(
+            self.file_pages.get(file_id, 1) for file_id in _file_ids(request))
+        if not self.prompt_cache:
+            return total, 0
+        # Walk the input item by item: the longest prefix sent before (same model and cache key) is cached
+        cached, tokens = _cacheable(chained), chained
+        digest = hashlib.sha256(json.dumps([request.get("model"), request.get("prompt_cache_key"),
+                                            request.get("previous_response_id")]).encode())
+        with self._lock:
+            for item in items:
+                digest.update(json.dumps(item, sort_keys=True).encode())
+                tokens += len(json.dumps(item)) // 4 + PAGE_TOKENS * sum(
+                    self.file_pages.get(file_id, 1) for file_id in _file_ids({"input": [item]}))
+                key = digest.copy().hexdigest()
+                if key in self.prefixes:
+                    cached = max(cached, _cacheable(tokens))
+                self.prefixes.add(key)
+        return total, min(cached, total)
+
+    def sleep(self, endpoint, input_tokens=0):
+        latency = self.latency.get(endpoint, 0.0) if isinstance(self.latency, dict) else self.latency
+        latency += self.token_latency * input_tokens / 1000
+        with self._lock:
+            if latency and self.jitter:
+                latency *= 1 + self._rng.uniform(-self.jitter, self.jitter)
+            if self.slow_share and self._rng.random() < self.slow_share:
+                latency += self.slow_latency
+        if latency > 0:
+            time.sleep(latency)
+
+    def record(self, endpoint, nbytes, **totals):
+        with self._lock:
+            entry = self.stats.setdefault(endpoint, {"calls": 0, "bytes_in": 0})
+            entry["calls"] += 1
+            entry["bytes_in"] += nbytes
+            for key, value in totals.items():
+                entry[key] = entry.get(key, 0) + value
+
+    def fault(self, endpoint):
+        """Status to fail this call with, or None."""
+        share = self.faults.get(endpoint, 0.0)
+        with self._lock:
+            if not (share and self._rng.random() < share):
+                return None
+            entry = self.stats.setdefault(endpoint, {"calls": 0, "bytes_in": 0})
+            entry["faults"] = entry.get("faults", 0) + 1
+        return self.fault_status
+
+    def answer_for(self, question):
+        lowered = (question or "").lower()
+        for needle, answer in self.answers:
+            if needle.lower() in lowered:
+                return answer
+        return self.answer
+
+    def start(self):
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Serve a local stub of the OpenAI Files/Responses API.")
+    ap.add_argument("--port", type=int, default=8765)
+    ap.add_argument("--latency", type=parse_latency, default=0.0,
+                    help='Seconds added to every call, or per endpoint: "files.create=0.4,responses.create=0.9"')
+    ap.add_argument("--jitter", type=float, default=0.0, help="Random +/- fraction applied to the latency")
+    ap.add_argument("--stream-delay", type=float, default=0.0, help="Seconds before each streamed delta")
+    ap.add_argument("--token-latency", type=float, default=0.0, help="Extra seconds per 1k input tokens")
+    ap.add_argument("--faults", type=parse_faults, default={},
+                    help='Share of calls to fail per endpoint, e.g. "responses.create=0.2,files.create=0.1"')
+    ap.add_argument("--fault-status", type=int, default=429)
+    ap.add_argument("--retry-after", type=float, default=None, help="Retry-After seconds sent with faults")
+    ap.add_argument("--slow", type=parse_slow, default=(0.0, 0.0), help='Long tail: "share=seconds", e.g. 0.05=3')
+    ap.add_argument("--no-prompt-cache", action="store_true", help="Never report cached input tokens")
+    args = ap.parse_args()
+    server = StubOpenAIServer(port=args.port, latency=args.latency, jitter=args.jitter,
+                              stream_delay=args.stream_delay, token_latency=args.token_latency,
+                              faults=args.faults, fault_status=args.fault_status, retry_after=args.retry_after,
+                              slow_share=args.slow[0], slow_latency=args.slow[1],
+                              prompt_cache=not args.no_prompt_cache)
+    print(f"Stub OpenAI API on {server.base_url} (export OPENAI_BASE_URL to use it)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,164 @@
+# synthetic_bills.py
+# Generates bill-like PDFs with a seven-segment meter photo for the bench-*.py scripts.
+# Nothing here is used by the app itself.
+
+import fitz  # PyMuPDF
+import numpy as np
+
+# Same template box the app crops (PDF points, origin top-left as PyMuPDF uses it)
+METER_BBOX = (348, 469, 540, 610)
+
+# Segment order: a (top), b (top-right), c (bottom-right), d (bottom), e (bottom-left), f (top-left), g (middle)
+SEGMENTS = {
+    "0": "abcdef", "1": "bc", "2": "abdeg", "3": "abcdg", "4": "bcfg",
+    "5": "acdfg", "6": "acdefg", "7": "abc", "8": "abcdefg", "9": "abcdfg",
+}
+
+
+def draw_seven_segment(reading, digit_h=120, margin=40, noise=6.0, seed=0):
+    """Draw `reading` (e.g. "04512.37") as dark LCD segments on a light panel.
+    Returns an HxWx3 uint8 RGB array."""
+    rng = np.random.default_rng(seed)
+    digit_w = digit_h // 2
+    thick = max(3, digit_h // 10)
+    gap = digit_w // 2
+    digits = [c for c in reading if c.isdigit()]
+    width = margin * 2 + len(digits) * (digit_w + gap)
+    height = margin * 2 + digit_h
+    img = np.full((height, width), 205.0)
+
+    x = margin
+    for ch in reading:
+        if ch == ".":
+            # decimal dot sits on the baseline, inline between the previous and next digit
+            cx = x - gap // 2
+            cy = margin + digit_h - thick // 2
+            r = max(2, thick // 2 + 1)
+            img[cy - r:cy + r, cx - r:cx + r] = 35
+            continue
+        top, mid, bot = margin, margin + digit_h // 2, margin + digit_h
+        boxes = {
+            "a": (top, top + thick, x, x + digit_w),
+            "b": (top, mid, x + digit_w - thick, x + digit_w),
+            "c": (mid, bot, x + digit_w - thick, x + digit_w),
+            "d": (bot - thick, bot, x, x + digit_w),
+            "e": (mid, bot, x, x + thick),
+            "f": (top, mid, x, x + thick),
+            "g": (mid - thick // 2, mid + thick - thick // 2, x, x + digit_w),
+        }
+        for seg in SEGMENTS[ch]:
+            y0, y1, x0, x1 = boxes[seg]
+            img[y0:y1, x0:x1] = 35
+        x += digit_w + gap
+
+    # uneven lighting + sensor noise, like a phone photo of the meter
+    yy, xx = np.mgrid[0:height, 0:width]
+    img += 25 * (xx / width) - 12
+    img += rng.normal(0, noise, img.shape)
+    gray = np.clip(img, 0, 255).astype(np.uint8)
+    return np.repeat(gray[:, :, None], 3, axis=2)
+
+
+def ndarray_to_pixmap(rgb):
+    h, w = rgb.shape[:2]
+    return fitz.Pixmap(fitz.csRGB, w, h, np.ascontiguousarray(rgb).tobytes(), False)
+
+
+# Text for fields=True: the bill summary on page 0, then back pages cycling through these
+SUMMARY_LINES = [
+    "CONSUMER NAME MUHAMMAD ASLAM   CONNECTION DATE 12-MAR-2009",
+    "TARIFF A-1a(01)   SANCTIONED LOAD 3 KW   METER NO 4521887",
+    "READING DATE 02-JUN-24   ISSUE DATE 05-JUN-24   DUE DATE 17-JUN-24",
+    "PREVIOUS READING 04210   PRESENT READING 04512   UNITS CONSUMED 302",
+    "COST OF ELECTRICITY 9,860   FUEL PRICE ADJUSTMENT 1,204   ELECTRICITY DUTY 148",
+    "GST 1,870   TV FEE 35   ARREARS 0   AMOUNT PAYABLE WITHIN DUE DATE Rs. 13,117",
+    "LP SURCHARGE 1,312   AMOUNT PAYABLE AFTER DUE DATE 14,429",
+]
+MONTHS = ("JAN", "FEB", "MAR", "APR", "MAY", "JUN", "JUL", "AUG", "SEP", "OCT", "NOV", "DEC")
+MONTHLY_UNITS = (188, 164, 210, 265, 290, 302, 355, 341, 284, 221, 176, 169)  # summer peak, like LESCO homes
+
+
+def summary_lines(month):
+    """SUMMARY_LINES for the bill of `month` (0 = JAN-24, 12 = JAN-25, ...), for comparison benches:
+    billing month, dates, units and amounts all follow the month."""
+    mon, yy = MONTHS[month % 12], 24 + month // 12
+    units = MONTHLY_UNITS[month % 12]
+    cost, fpa = units * 33, units * 4
+    duty, gst = round(cost * 0.015), round((cost + fpa) * 0.17)
+    total = cost + fpa + duty + gst + 35
+    return [
+        f"BILL MONTH {mon}-{yy}   CONSUMER NAME MUHAMMAD ASLAM",
+        "TARIFF A-1a(01)   SANCTIONED LOAD 3 KW   METER NO 4521887",
+        f"READING DATE 02-{mon}-{yy}   ISSUE DATE 05-{mon}-{yy}   DUE DATE 17-{mon}-{yy}",
+        f"PREVIOUS READING {4000 + 250 * month:05d}   PRESENT READING {4000 + 250 * month + units:05d}   "
+        f"UNITS CONSUMED {units}",
+        f"COST OF ELECTRICITY {cost:,}   FUEL PRICE ADJUSTMENT {fpa:,}   ELECTRICITY DUTY {duty}",
+        f"GST {gst:,}   TV FEE 35   ARREARS 0   AMOUNT PAYABLE WITHIN DUE DATE Rs. {total:,}",
+        f"LP SURCHARGE {round(total * 0.1):,}   AMOUNT PAYABLE AFTER DUE DATE {total + round(total * 0.1):,}",
+    ]
+
+
+BACK_PAGES = [
+    ("TARIFF RATES / SLABS", [
+        f"RESIDENTIAL A-1 PROTECTED SLAB {lo}-{lo + 99} UNITS RATE {rate:.2f} PER UNIT FIXED CHARGES NIL"
+        for lo, rate in zip(range(1, 700, 100), (10.06, 15.52, 22.44, 28.91, 33.10, 37.99, 42.72))
+    ]),
+    ("BILLING HISTORY", [
+        f"MONTH {m}-24 UNITS {u} BILL {u * 41:,} PAYMENT {u * 41:,} PAID ON TIME"
+        for m, u in zip(("JAN", "FEB", "MAR", "APR", "MAY"), (188, 164, 210, 265, 290))
+    ]),
+    ("NOTICES / ADVERTISEMENT", [
+        "SAVE ENERGY SWITCH OFF UNNECESSARY LIGHTS AND FANS",
+        "REPORT POWER THEFT ON THE HELPLINE 118 REWARD FOR INFORMATION",
+        "PAY ONLINE THROUGH BANKS MOBILE WALLETS AND E-SAHULAT FRANCHISES",
+        "NET METERING APPLICATIONS NOW ACCEPTED AT ALL CUSTOMER SERVICE CENTRES",
+    ]),
+]
+
+
+def make_bill_pdf(reading="04512.37", bbox=METER_BBOX, pages=1, rotation=0,
+                  embed="png", rasterize=False, seed=0, logo=True, fields=False, month=None):
+    """Build a bill-like PDF in memory and return its bytes.
+
+    embed: "png" or "jpeg" -- how the meter photo is stored in the PDF.
+    rasterize: flatten page 0 into a single page-sized image (like a scanned bill).
+    logo: also place a small decoy image (company logo) so locators can't just take "the" image.
+    fields: give the bill a realistic text layer (summary fields on page 0, tariff slabs, billing
+      history and notices on the back pages) for the text/page-selection paths.
+    month: with fields, the summary of that month's bill (see summary_lines) instead of the fixed one.
+    """
+    doc = fitz.open()
+    photo = ndarray_to_pixmap(draw_seven_segment(reading, seed=seed))
+    photo_bytes = photo.tobytes("jpeg" if embed == "jpeg" else "png")
+    for pno in range(pages):
+        page = doc.new_page(width=595, height=842)  # A4
+        page.insert_text((40, 60), "LAHORE ELECTRIC SUPPLY COMPANY", fontsize=14)
+        if logo:
+            mark = np.zeros((60, 120, 3), dtype=np.uint8)
+            mark[:, :, 0], mark[10:50, 20:100, 1] = 200, 180
+            page.insert_image(fitz.Rect(480, 30, 560, 70), pixmap=ndarray_to_pixmap(mark))
+        page.insert_text((40, 90), f"REFERENCE NO 24 11234 1234567 U   PAGE {pno + 1}", fontsize=9)
+        if pno == 0:
+            page.insert_image(fitz.Rect(*bbox), stream=photo_bytes)
+            lines = (SUMMARY_LINES if month is None else summary_lines(month)) if fields else []
+        else:
+            title, lines = BACK_PAGES[(pno - 1) % len(BACK_PAGES)] if fields else ("TARIFF TABLE / NOTICES", [])
+            page.insert_text((40, 140), title, fontsize=11)
+        for i, line in enumerate(lines):
+            page.insert_text((40, 170 + 16 * i), line, fontsize=8)
+
+    if rasterize:
+        flat = fitz.open()
+        for page in doc:
+            pix = page.get_pixmap(dpi=150)
+            new_page = flat.new_page(width=page.rect.width, height=page.rect.height)
+            new_page.insert_image(new_page.rect, pixmap=pix)
+        doc.close()
+        doc = flat
+
+    if rotation:
+        for page in doc:
+            page.set_rotation(rotation)
+    data = doc.tobytes()
+    doc.close()
+    return data
@@ -15,8 +15,6 @@ import argparse
 import os
 import fitz  # PyMuPDF
 import numpy as np
-import matplotlib.pyplot as plt
-from matplotlib.widgets import RectangleSelector
 
 
 def pixmap_to_ndarray(pix):
@@ -74,6 +72,10 @@ def main():
         print(f"Note: Page has rotation flag {page.rotation}°, but we render without applying it for accurate mapping.")
         print("      The page may appear sideways; selection mapping will still be correct.")
 
+    # matplotlib only now: --help and a bad path don't wait for it
+    import matplotlib.pyplot as plt
+    from matplotlib.widgets import RectangleSelector
+
     # State to hold the last crop for saving
     state = {"last_bbox_pts": None, "last_crop_img": None}
 
@@ -0,0 +1,64 @@
+# test_bill_compare.py
+# Comparison-mode routing over three synthetic monthly bills: which questions BillSet answers from
+# the index, and which go to the model (stubbed, so no API calls). Run with `python -m pytest -q`.
+
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from agent_factory import build_client
+from bill_compare import BillSet
+from synthetic_bills import make_bill_pdf
+
+FILES = [(f"bill_{month}.pdf", make_bill_pdf(fields=True, month=month)) for month in (3, 4, 5)]
+
+LOCAL = [
+    "How many units did I consume?",
+    "What was the amount payable?",
+    "What is the due date?",
+]
+
+# a period or a specific charge narrows the question to something the fields table can't answer
+NOT_LOCAL = [
+    "Compare the GST across my bills",
+    "What was the amount payable last month?",
+    "How many units did I use in June?",
+    "Units consumed in 2024?",
+    "How much fuel adjustment did I pay?",
+    "Why did the amount payable go up?",
+]
+
+
+@pytest.fixture
+def bills():
+    with ThreadPoolExecutor(max_workers=2) as pool:
+        # never called: the model turn is stubbed
+        bill_set = BillSet(build_client(api_key="test"), None, pool)
+        bill_set.load(FILES)
+        yield bill_set
+
+
+def stub_run(agent, messages):
+    return "model answer"
+
+
+@pytest.mark.parametrize("question", LOCAL)
+def test_field_questions_are_answered_from_the_index(bills, question):
+    answer, route = bills.ask(question, run=stub_run)
+    assert route == "local"
+    assert " by bill:" in answer
+
+
+@pytest.mark.parametrize("question", NOT_LOCAL)
+def test_period_and_charge_questions_go_to_the_model(bills, question):
+    answer, route = bills.ask(question, run=stub_run)
+    assert route == "text"
+    assert answer == "model answer"
+
+
+def test_failed_turn_drops_the_question(bills, monkeypatch):
+    before = list(bills.history)
+    monkeypatch.setattr(bills, "context_for", lambda question: 1 / 0)
+    with pytest.raises(ZeroDivisionError):
+        bills.ask("Why did the amount payable go up?", run=stub_run)
+    assert list(bills.history) == before
@@ -0,0 +1,54 @@
+# test_bill_fields.py
+# Question routing on a synthetic digital bill: which questions bill_fields answers locally from the
+# parsed fields, and which must go to the model. Run with `python -m pytest -q`.
+
+import pytest
+
+from bill_fields import extract_bill_info, route_question
+from synthetic_bills import make_bill_pdf
+
+INFO = extract_bill_info(make_bill_pdf(fields=True))
+
+# (question, label of the field answered locally)
+LOCAL = [
+    ("What is the due date?", "Due date"),
+    ("When do I pay?", "Due date"),
+    ("What is the amount payable?", "Amount payable within due date"),
+    ("How much is my bill?", "Amount payable within due date"),
+    ("How many units did I consume?", "Units consumed"),
+    ("Units consumed?", "Units consumed"),
+    ("Which tariff am I on?", "Tariff"),
+    ("What is the reference number?", "Reference number"),
+    ("Do I have any arrears?", "Arrears"),
+]
+
+# questions that mention a field's words but ask about something else: never answered locally
+NOT_LOCAL = [
+    "What is the GST amount?",
+    "How much is the electricity duty?",
+    "What is the cost per unit?",
+    "How much tax am I paying?",
+    "What is the amount of FPA?",
+    "Can I pay online?",
+    "What is the total due?",
+    "Is my bill overdue?",
+    "How many units are in the peak slab?",
+    "How many units were consumed last year in June?",
+    "what was the amount payable last month?",
+    "What are the tariff rates?",
+    "What is the due date and the amount payable?",
+    "Why is the amount payable so high?",
+]
+
+
+@pytest.mark.parametrize("question,label", LOCAL)
+def test_field_questions_are_answered_locally(question, label):
+    route, answer = route_question(question, INFO)
+    assert route == "local"
+    assert answer.startswith(f"{label}: ")
+
+
+@pytest.mark.parametrize("question", NOT_LOCAL)
+def test_other_questions_go_to_the_model(question):
+    route, _ = route_question(question, INFO)
+    assert route == "text"
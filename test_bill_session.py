@@ -0,0 +1,75 @@
+# test_bill_session.py
+# A failed turn leaves the conversation as it was: whichever step raises (page selection, routing,
+# the model call), the question is not kept in the history. No uploads and no API calls: the bill's
+# text layer is parsed in place of load() and the model turn is stubbed.
+
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+import bill_session
+from agent_factory import build_client
+from bill_fields import extract_bill_info
+from bill_session import BillSession
+from synthetic_bills import make_bill_pdf
+
+INFO = extract_bill_info(make_bill_pdf(fields=True, pages=3))
+BEFORE = [("user", "What is the due date?"), ("bot", "Due date: 25-JUN-24")]
+
+
+@pytest.fixture
+def session():
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        bill = BillSession(build_client(api_key="test"), None, pool)  # never called
+        bill.bill_info = INFO
+        bill.history.extend(BEFORE)
+        yield bill
+
+
+def stub_run(agent, messages):
+    return "model answer"
+
+
+def failing_run(agent, messages):
+    raise RuntimeError("model call failed")
+
+
+def fail(*args, **kwargs):
+    raise RuntimeError("step failed")
+
+
+def test_answered_turn_is_kept(session):
+    answer, route = session.ask("Why is my bill so high?", run=stub_run)
+    assert (route, answer) == ("text", "model answer")
+    assert list(session.history) == BEFORE + [("user", "Why is my bill so high?"), ("bot", "model answer")]
+
+
+@pytest.mark.parametrize("step", ["pages_for", "run", "route_question"])
+def test_failed_turn_drops_the_question(session, monkeypatch, step):
+    run = stub_run
+    if step == "run":
+        run = failing_run
+    elif step == "route_question":
+        monkeypatch.setattr(bill_session, "route_question", fail)
+    else:
+        monkeypatch.setattr(session, step, fail)
+    with pytest.raises(RuntimeError):
+        session.ask("Why is my bill so high?", run=run)
+    assert list(session.history) == BEFORE
+
+
+def test_failed_async_turn_drops_the_question(session, monkeypatch):
+    async def failing_ainvoke(agent, messages):
+        raise RuntimeError("model call failed")
+    monkeypatch.setattr(bill_session, "ainvoke_agent", failing_ainvoke)
+    with pytest.raises(RuntimeError):
+        asyncio.run(session.aask("Why is my bill so high?"))
+    assert list(session.history) == BEFORE
+
+
+def test_failed_first_turn_drops_the_question(session):
+    session.history.clear()
+    with pytest.raises(RuntimeError):
+        session.first_turn(run=failing_run)
+    assert list(session.history) == []
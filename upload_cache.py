@@ -0,0 +1,197 @@
+# upload_cache.py
+# Content-addressed cache of OpenAI file IDs, so the same bill bytes are uploaded once.
+# Backed by SQLite so it survives restarts; entries are refcounted per session and only
+# deleted remotely once nobody references them and they are past their TTL / LRU slot.
+
+import asyncio
+import contextlib
+import hashlib
+import os
+import sqlite3
+import threading
+import time
+
+DEFAULT_PATH = os.environ.get("UPLOAD_CACHE_PATH", ".upload_cache.sqlite3")
+DEFAULT_TTL = 7 * 24 * 3600  # seconds an unreferenced upload is kept around
+DEFAULT_MAX_ENTRIES = 500
+# Hits on uploads older than this are checked remotely before reuse: the file may be gone (another
+# pod's orphan GC only knows its own cache file, or it was deleted by hand)
+DEFAULT_VERIFY_AGE = float(os.environ.get("UPLOAD_VERIFY_AGE", "3600"))
+
+
+def sha256_bytes(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+class UploadCache:
+    def __init__(self, path=DEFAULT_PATH, ttl=DEFAULT_TTL, max_entries=DEFAULT_MAX_ENTRIES,
+                 verify_age=DEFAULT_VERIFY_AGE):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.verify_age = verify_age
+        self._lock = threading.Lock()
+        self._pending_deletes = []  # remote file_ids no longer in the table but not yet deleted
+        with self._connect() as conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS uploads (
+                       digest    TEXT PRIMARY KEY,
+                       file_id   TEXT NOT NULL,
+                       size      INTEGER NOT NULL,
+                       refcount  INTEGER NOT NULL DEFAULT 0,
+                       created   REAL NOT NULL,
+                       last_used REAL NOT NULL
+                   )"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS uploads_file_id ON uploads(file_id)")
+
+    @contextlib.contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            yield conn
+        finally:
+            conn.close()
+
+    def acquire(self, data, upload_fn, exists_fn=None):
+        """Return a file_id for `data`, uploading via upload_fn(data) -> file_id only on a miss.
+        Each call takes one reference; pair it with release(file_id). With exists_fn(file_id) -> bool,
+        a hit older than verify_age is checked first and re-uploaded if the remote file is gone."""
+        digest = sha256_bytes(data)
+        hit = self._lookup(digest)
+        if hit and exists_fn and self._stale(hit) and not exists_fn(hit[0]):
+            self._forget(digest, hit[0])
+            hit = None
+        if hit is None:
+            # Upload outside the lock; it's a slow network call
+            return self._store(digest, upload_fn(data), len(data))
+        return hit[0]
+
+    async def aacquire(self, data, upload_fn, exists_fn=None):
+        """acquire() for the event loop: upload_fn(data) and exists_fn(file_id) are coroutine functions,
+        and the SQLite work runs on a worker thread so lock waits don't stall other sessions."""
+        digest = sha256_bytes(data)
+        hit = await asyncio.to_thread(self._lookup, digest)
+        if hit and exists_fn and self._stale(hit) and not await exists_fn(hit[0]):
+            await asyncio.to_thread(self._forget, digest, hit[0])
+            hit = None
+        if hit is None:
+            return await asyncio.to_thread(self._store, digest, await upload_fn(data), len(data))
+        return hit[0]
+
+    def _lookup(self, digest):
+        # (file_id, created) of the live cached upload for digest (taking a reference), or None
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            row = conn.execute(
+                "SELECT file_id, last_used, refcount, created FROM uploads WHERE digest = ?", (digest,)
+            ).fetchone()
+            if row and (row[2] > 0 or now - row[1] <= self.ttl):
+                conn.execute(
+                    "UPDATE uploads SET refcount = refcount + 1, last_used = ? WHERE digest = ?",
+                    (now, digest),
+                )
+                return row[0], row[3]
+        return None
+
+    def _stale(self, hit):
+        return time.time() - hit[1] > self.verify_age
+
+    def _forget(self, digest, file_id):
+        # Drop an entry whose remote file is gone (nothing left to delete); sessions holding it lose their refs
+        with self._lock, self._connect() as conn:
+            conn.execute("DELETE FROM uploads WHERE digest = ? AND file_id = ?", (digest, file_id))
+
+    def _store(self, digest, file_id, size):
+        # Record a fresh upload (taking a reference); returns the file_id to use
+        now = time.time()
+        stale = None
+        with self._lock, self._connect() as conn:
+            row = conn.execute("SELECT file_id, refcount FROM uploads WHERE digest = ?", (digest,)).fetchone()
+            if row and row[1] > 0:
+                # Another session uploaded the same bytes meanwhile; share theirs, drop ours
+                conn.execute(
+                    "UPDATE uploads SET refcount = refcount + 1, last_used = ? WHERE digest = ?",
+                    (now, digest),
+                )
+                stale, file_id = file_id, row[0]
+            else:
+                if row:
+                    stale = row[0]  # expired, unreferenced entry being replaced
+                conn.execute(
+                    "INSERT OR REPLACE INTO uploads (digest, file_id, size, refcount, created, last_used) "
+                    "VALUES (?, ?, ?, 1, ?, ?)",
+                    (digest, file_id, size, now, now),
+                )
+        if stale:
+            with self._lock:
+                self._pending_deletes.append(stale)
+        return file_id
+
+    def release(self, file_id):
+        """Drop one reference. The remote file stays cached until evict() decides otherwise."""
+        with self._lock, self._connect() as conn:
+            conn.execute(
+                "UPDATE uploads SET refcount = MAX(refcount - 1, 0), last_used = ? WHERE file_id = ?",
+                (time.time(), file_id),
+            )
+
+    def touch(self, file_ids):
+        """Mark files as still in use (live sessions), so release_stale_refs() leaves them alone."""
+        with self._lock, self._connect() as conn:
+            conn.executemany("UPDATE uploads SET last_used = ? WHERE file_id = ?",
+                             [(time.time(), fid) for fid in file_ids])
+
+    def release_stale_refs(self, max_age):
+        """Zero the refcount of entries nobody has used for max_age seconds: references left behind by
+        sessions that died without releasing them (crashed or restarted processes). Returns how many."""
+        with self._lock, self._connect() as conn:
+            cur = conn.execute(
+                "UPDATE uploads SET refcount = 0 WHERE refcount > 0 AND last_used < ?", (time.time() - max_age,)
+            )
+            return cur.rowcount
+
+    def known_file_ids(self):
+        """Every remote file_id the cache still accounts for (cached or waiting to be deleted)."""
+        with self._lock, self._connect() as conn:
+            rows = conn.execute("SELECT file_id FROM uploads").fetchall()
+            return {fid for (fid,) in rows} | set(self._pending_deletes)
+
+    def evict(self, delete_fn):
+        """Delete unreferenced entries past their TTL, then the least recently used ones beyond
+        max_entries. delete_fn(file_id) removes the remote file; failed deletes are retried next time."""
+        now = time.time()
+        with self._lock, self._connect() as conn:
+            expired = conn.execute(
+                "SELECT digest, file_id FROM uploads WHERE refcount = 0 AND last_used < ?",
+                (now - self.ttl,),
+            ).fetchall()
+            total = conn.execute("SELECT COUNT(*) FROM uploads").fetchone()[0]
+            overflow = max(0, total - len(expired) - self.max_entries)
+            lru = conn.execute(
+                "SELECT digest, file_id FROM uploads WHERE refcount = 0 AND last_used >= ? "
+                "ORDER BY last_used LIMIT ?",
+                (now - self.ttl, overflow),
+            ).fetchall()
+            # Drop the rows before the remote delete so no session can acquire a dying file_id
+            conn.executemany("DELETE FROM uploads WHERE digest = ?", [(d,) for d, _ in expired + lru])
+            victims = self._pending_deletes + [fid for _, fid in expired + lru]
+            self._pending_deletes = []
+
+        failed = []
+        for file_id in victims:
+            try:
+                delete_fn(file_id)
+            except Exception:
+                failed.append(file_id)
+        with self._lock:
+            self._pending_deletes.extend(failed)
+        return len(victims) - len(failed)
+
+    def stats(self):
+        with self._lock, self._connect() as conn:
+            count, size, refs = conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0), COALESCE(SUM(refcount), 0) FROM uploads"
+            ).fetchone()
+        return {"entries": count, "bytes": size, "references": refs}
@@ -2,37 +2,300 @@
 import fitz  # PyMuPDF
 from PIL import Image, ImageFilter, ImageOps
 import io
+import numpy as np
 
-def crop_roi_to_pdf(in_pdf_path, out_pdf_path, page_number=0, bbox=(100, 500, 200, 550), dpi=400, sharpen=True):
-    """
-    bbox uses PDF coordinates in points (1/72 inch), origin at bottom-left:
-      (x0, y0, x1, y1)
-    """
-    doc = fitz.open(in_pdf_path)
-    page = doc[page_number]
-    rect = fitz.Rect(*bbox)
-
-    # Render the ROI at high DPI to get a crisp bitmap
-    pix = page.get_pixmap(clip=rect, dpi=dpi)
-
-    # Optional: light cleanup for low-res scans
-    img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-    # img = ImageOps.grayscale(img)
-    # img = ImageOps.autocontrast(img)
-    # if sharpen:
-    #     img = img.filter(ImageFilter.UnsharpMask(radius=2, percent=160))
-
-    # Encode as PNG bytes
-    buf = io.BytesIO()
-    img.save(buf, format="PNG")
-    png_bytes = buf.getvalue()
-
-    # Create a new 1-page PDF sized to the image and place the PNG
+
+# Adaptive DPI ("auto"): render at ADAPTIVE_MIN_DPI first and only re-render (up to ADAPTIVE_MAX_DPI)
+# when digit strokes are too thin to read reliably. If the first render is already soft (the embedded
+# photo is lower resolution than the render), more DPI only interpolates, so we keep the small one.
+ADAPTIVE_MIN_DPI = 150
+ADAPTIVE_MAX_DPI = 500
+TARGET_STROKE_PX = 8       # median dark-stroke width we want, in pixels
+TARGET_SHARPNESS = 0.25    # normalized edge contrast, see measure_legibility()
+
+
+def measure_legibility(gray):
+    """(stroke_px, sharpness) for a uint8 grayscale image.
+    stroke_px: median horizontal run length of dark pixels (typical digit stroke width).
+    sharpness: strongest 1% of gradients relative to the dark/light range (~1 = crisp 1-px edges)."""
+    g = gray.astype(np.float32)
+    lo, hi = np.percentile(g, (5, 95))
+    contrast = max(hi - lo, 1.0)
+    grad = np.maximum(np.abs(np.diff(g, axis=1))[:-1, :], np.abs(np.diff(g, axis=0))[:, :-1])
+    sharpness = float(np.percentile(grad, 99) / contrast)
+
+    dark = (g < (lo + hi) / 2).astype(np.int8)
+    edges = np.diff(np.pad(dark, ((0, 0), (1, 1))), axis=1)
+    starts, ends = np.nonzero(edges == 1), np.nonzero(edges == -1)
+    runs = ends[1] - starts[1]  # row-major order pairs each start with its end
+    runs = runs[runs >= 2]
+    stroke_px = float(np.median(runs)) if runs.size else 0.0
+    return stroke_px, sharpness
+
+
+def _pixmap_gray(pix):
+    arr = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    return arr[:, :, :3].mean(axis=2).astype(np.uint8) if pix.n >= 3 else arr[:, :, 0]
+
+
+# Meter photo localization (see locate_meter_roi)
+LOCATE_DPI = 50               # whole-page render for the contour fallback
+LOCATE_AREA_FRAC = (0.005, 0.5)  # photo area as a fraction of the page
+LOCATE_MAX_ASPECT = 4.0       # photo long side / short side (rotation-agnostic)
+LOCATE_PAD_PT = 2             # padding around the located photo, in points
+
+
+def _pick_rect(rects, hint):
+    """Best candidate: most overlap with the hint (the old template box), else the largest."""
+    def score(r):
+        overlap = abs(r & hint) / abs(r) if hint is not None and abs(r) else 0.0
+        return (overlap, abs(r))
+    return max(rects, key=score) if rects else None
+
+
+def _plausible(rect, page_rect):
+    frac = abs(rect) / abs(page_rect)
+    short, long = sorted((rect.width, rect.height))
+    return LOCATE_AREA_FRAC[0] <= frac <= LOCATE_AREA_FRAC[1] and short > 0 and long / short <= LOCATE_MAX_ASPECT
+
+
+def locate_meter_roi(page, hint_bbox=None):
+    """Find the meter photo on `page` and return (rect, method), rect in the page's visible (rotated)
+    coordinates -- the space get_pixmap(clip=...) uses. hint_bbox is the template box in unrotated
+    page coordinates and breaks ties between candidates.
+    method: "image" (embedded image placement), "contour" (low-DPI render), or "template" (hint_bbox)."""
+    rot = page.rotation_matrix
+    hint = fitz.Rect(*hint_bbox) * rot if hint_bbox else None
+
+    # 1) Embedded raster: PyMuPDF knows its placement rect (reported in unrotated coordinates)
+    rects = []
+    for info in page.get_image_info():
+        r = (fitz.Rect(info["bbox"]) * rot) & page.rect
+        if not r.is_empty and _plausible(r, page.rect):
+            rects.append(r)
+    best = _pick_rect(rects, hint)
+    if best is not None:
+        return best + (-LOCATE_PAD_PT, -LOCATE_PAD_PT, LOCATE_PAD_PT, LOCATE_PAD_PT) & page.rect, "image"
+
+    # 2) Scanned / vector bills: find dense non-paper regions on a low-DPI render
+    import cv2
+    pix = page.get_pixmap(dpi=LOCATE_DPI, alpha=False)
+    gray = _pixmap_gray(pix)
+    paper = np.percentile(gray, 90)
+    ink = (gray < paper - 20).astype(np.uint8)
+    # photos are solid blocks of non-paper pixels; text is sparse, so density filters it out
+    dense = (cv2.blur(ink.astype(np.float32), (5, 5)) > 0.6).astype(np.uint8) * 255
+    dense = cv2.morphologyEx(dense, cv2.MORPH_CLOSE, np.ones((3, 3), np.uint8))
+    contours, _ = cv2.findContours(dense, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+    scale = LOCATE_DPI / 72.0
+    rects = []
+    for c in contours:
+        x, y, w, h = cv2.boundingRect(c)
+        r = fitz.Rect(x / scale, y / scale, (x + w) / scale, (y + h) / scale)
+        if _plausible(r, page.rect):
+            rects.append(r)
+    best = _pick_rect(rects, hint)
+    if best is not None:
+        # one low-DPI pixel of slack on each side, plus the usual padding
+        pad = LOCATE_PAD_PT + 1 / scale
+        return best + (-pad, -pad, pad, pad) & page.rect, "contour"
+
+    return (hint & page.rect if hint is not None else None), "template"
+
+
+# Native ROI ("native"): when the clip sits on an embedded raster, crop that image at its own resolution
+# instead of re-rendering (and upsampling) it. Covering this much of the image counts as "the whole image".
+NATIVE_FULL_COVER = 0.98
+# An image wholly inside a larger clip (e.g. a fixed ROI_BBOX around the photo) is still taken if it fills
+# this much of the clip; a logo or icon in a corner of it doesn't
+NATIVE_MIN_CLIP_COVER = 0.25
+
+
+def _embedded_roi(doc, page, rect):
+    """(pixmap, info) for the part of an embedded image under the visible-space clip `rect`, or None
+    when no single unmasked, axis-aligned image covers it. info["stream"] holds the original JPEG
+    bytes when the clip takes the whole image, so it can be embedded without recompression."""
+    clip = rect * page.derotation_matrix  # image placements are reported in unrotated coordinates
+    best, best_key = None, (0.0, 0.0)
+    for img in page.get_image_info(xrefs=True):
+        placed = fitz.Rect(img["bbox"])
+        inter = abs(placed & clip)
+        if not img["xref"] or not inter:
+            continue
+        # how much of the clip the image covers; a small image (logo, icon) inside the clip covers little
+        # of it. The larger image only breaks ties
+        key = (round(inter / abs(clip), 3), abs(placed))
+        if key > best_key:
+            best, best_key = img, key
+    if best is None:
+        return None
+    cover, placed = best_key[0], fitz.Rect(best["bbox"])
+    inside = abs(placed & clip) >= NATIVE_FULL_COVER * abs(placed)
+    if cover < 0.8 and not (inside and cover >= NATIVE_MIN_CLIP_COVER):
+        return None
+    a, b, c, d, _, _ = best["transform"]
+    if abs(b) > 1e-6 or abs(c) > 1e-6 or a <= 0 or d <= 0:
+        return None  # rotated / flipped placement: let the renderer handle it
+    xref = best["xref"]
+    if doc.xref_get_key(xref, "SMask")[0] != "null":
+        return None  # transparency: the rendered page composites it, a raw crop wouldn't
+    jpeg = doc.xref_get_key(xref, "Filter")[1] == "/DCTDecode"
+
+    src = fitz.Pixmap(doc, xref)
+    if src.alpha or src.n != 3:
+        src = fitz.Pixmap(fitz.csRGB, src, 0)
+    w, h = src.width, src.height
+    # clip -> image pixel coordinates through the inverse placement transform (unit square -> page)
+    unit = (fitz.Rect(best["bbox"]) & clip) * ~fitz.Matrix(best["transform"])
+    x0, y0 = max(0, int(unit.x0 * w)), max(0, int(unit.y0 * h))
+    x1, y1 = min(w, int(np.ceil(unit.x1 * w))), min(h, int(np.ceil(unit.y1 * h)))
+    if x1 - x0 < 2 or y1 - y0 < 2:
+        return None
+    native_dpi = int(round(w / (a / 72.0)))
+    full = (x1 - x0) * (y1 - y0) >= NATIVE_FULL_COVER * w * h
+
+    if full and page.rotation == 0:
+        pix = src
+    else:
+        arr = np.frombuffer(src.samples_mv, dtype=np.uint8).reshape(h, src.stride // 3, 3)[y0:y1, x0:x1]
+        arr = np.ascontiguousarray(np.rot90(arr, k=-(page.rotation // 90)))  # match the visible page
+        pix = fitz.Pixmap(fitz.csRGB, arr.shape[1], arr.shape[0], arr.tobytes(), False)
+    stream = None
+    if full and page.rotation == 0 and jpeg:
+        # only JPEG is worth passing through: insert_image() re-encodes other formats anyway
+        stream = doc.extract_image(xref)["image"]
+    return pix, {
+        "dpi": native_dpi, "width": pix.width, "height": pix.height, "renders": 0,
+        "source": "embedded", "stream": stream,
+    }
+
+
+def render_roi(pdf_bytes, page_number=0, bbox=(100, 500, 200, 550), dpi=400, locate=False):
+    """Render the ROI to a pixmap. dpi is an int, "auto" (adaptive, see above) or "native" (crop the
+    embedded image at its own resolution, falling back to "auto" when the ROI isn't an embedded image).
+    locate=True finds the meter photo on the page (see locate_meter_roi) and only uses bbox as a hint.
+    Returns (pixmap, info) where info reports the clip used, the chosen dpi and legibility measurements.
+    For "native", info["stream"] is the original image bytes when they can be passed through as-is."""
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        page = doc[page_number]
+        rect, method = fitz.Rect(*bbox), None
+        if locate:
+            found, method = locate_meter_roi(page, hint_bbox=bbox)
+            rect = found if found is not None else rect * page.rotation_matrix
+        base = {"bbox": tuple(round(v, 1) for v in rect), "locate": method, "source": "render"}
+        if dpi == "native":
+            native = _embedded_roi(doc, page, rect)
+            if native is not None:
+                pix, info = native
+                return pix, {**base, **info}
+            dpi = "auto"
+        if dpi != "auto":
+            pix = page.get_pixmap(clip=rect, dpi=dpi, alpha=False)
+            return pix, {**base, "dpi": dpi, "width": pix.width, "height": pix.height, "renders": 1}
+
+        chosen = ADAPTIVE_MIN_DPI
+        pix = page.get_pixmap(clip=rect, dpi=chosen, alpha=False)
+        stroke_px, sharpness = measure_legibility(_pixmap_gray(pix))
+        renders = 1
+        if stroke_px < TARGET_STROKE_PX and sharpness >= TARGET_SHARPNESS:
+            # stroke width scales linearly with DPI; jump straight to the DPI that should hit the target
+            scale = TARGET_STROKE_PX / stroke_px if stroke_px else ADAPTIVE_MAX_DPI / chosen
+            chosen = int(min(ADAPTIVE_MAX_DPI, max(chosen * 1.5, chosen * scale)))
+            pix = page.get_pixmap(clip=rect, dpi=chosen, alpha=False)
+            stroke_px, sharpness = measure_legibility(_pixmap_gray(pix))
+            renders = 2
+        return pix, {
+            **base, "dpi": chosen, "width": pix.width, "height": pix.height, "renders": renders,
+            "stroke_px": stroke_px, "sharpness": round(sharpness, 3),
+        }
+    finally:
+        doc.close()
+
+
+def pixmap_to_bgr(pix):
+    """HxWx3 uint8 BGR array (OpenCV order) from an RGB pixmap."""
+    rgb = np.frombuffer(pix.samples, dtype=np.uint8).reshape(pix.height, pix.width, pix.n)
+    return np.ascontiguousarray(rgb[:, :, 2::-1])
+
+
+def pixmap_to_pdf_bytes(pix, grayscale=False, autocontrast=False, sharpen=False, stream=None):
+    """Wrap a rendered ROI in a new one-page PDF, sized to the image (pixels become points, 1:1).
+    stream: the ROI's original JPEG bytes (render_roi info["stream"]); embedded as-is when no filter is on."""
     out = fitz.open()
-    page_w, page_h = img.width, img.height  # pixels become points (1:1 here)
+    page_w, page_h = pix.width, pix.height
     new_page = out.new_page(width=page_w, height=page_h)
-    new_page.insert_image(fitz.Rect(0, 0, page_w, page_h), stream=png_bytes)
-    out.save(out_pdf_path)
+    if stream is not None and not (grayscale or autocontrast or sharpen):
+        # Embedded photo taken whole: no decode/re-encode, a JPEG stays the original DCT stream
+        new_page.insert_image(fitz.Rect(0, 0, page_w, page_h), stream=stream)
+    elif grayscale or autocontrast or sharpen:
+        # Optional: light cleanup for low-res scans (needs a PIL copy + PNG round trip)
+        img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
+        if grayscale:
+            img = ImageOps.grayscale(img)
+        if autocontrast:
+            img = ImageOps.autocontrast(img)
+        if sharpen:
+            img = img.filter(ImageFilter.UnsharpMask(radius=2, percent=160))
+        buf = io.BytesIO()
+        img.save(buf, format="PNG")
+        new_page.insert_image(fitz.Rect(0, 0, page_w, page_h), stream=buf.getvalue())
+    else:
+        # No filters: place the pixmap directly, skipping the PIL copy and PNG encode/decode
+        new_page.insert_image(fitz.Rect(0, 0, page_w, page_h), pixmap=pix)
+    data = out.tobytes()
     out.close()
-    doc.close()
+    return data
+
+
+def pixmap_to_image_bytes(pix, stream=None):
+    """(bytes, mime) for sending the ROI inline as an image: the original JPEG when render_roi passed one
+    through, else a lossless PNG of the pixmap (no PDF wrapper)."""
+    if stream is not None:
+        return stream, "image/jpeg"
+    import cv2
+    # zlib level 1: about the same size as pix.tobytes("png") on photo noise, ~4x faster to encode
+    _, buf = cv2.imencode(".png", pixmap_to_bgr(pix), [cv2.IMWRITE_PNG_COMPRESSION, 1])
+    return buf.tobytes(), "image/png"
+
+
+def crop_roi_pdf_bytes(pdf_bytes, page_number=0, bbox=(100, 500, 200, 550), dpi=400,
+                       grayscale=False, autocontrast=False, sharpen=False, locate=False):
+    """
+    In-memory version of crop_roi_to_pdf: PDF bytes in, one-page ROI PDF bytes out.
+    Nothing touches the disk, so concurrent uploads of same-named files can't collide.
+    dpi may be "auto" or "native" and locate=True finds the meter photo (see render_roi).
+
+    bbox uses PyMuPDF page coordinates in points (1/72 inch), origin at top-left:
+      (x0, y0, x1, y1)
+    """
+    pix, info = render_roi(pdf_bytes, page_number=page_number, bbox=bbox, dpi=dpi, locate=locate)
+    return pixmap_to_pdf_bytes(pix, grayscale=grayscale, autocontrast=autocontrast, sharpen=sharpen,
+                               stream=info.get("stream"))
+
+
+def slice_pdf_bytes(pdf_bytes, pages):
+    """New PDF with only `pages` (0-based, in the given order) of the source, as bytes.
+    Pages are kept as-is (text, vectors and embedded images untouched); objects they share,
+    like a logo on every page, stay stored once and everything else is dropped."""
+    doc = fitz.open(stream=pdf_bytes, filetype="pdf")
+    try:
+        doc.select(list(pages))
+        return doc.tobytes(garbage=3)
+    finally:
+        doc.close()
+
+
+def crop_roi_to_pdf(in_pdf_path, out_pdf_path, page_number=0, bbox=(100, 500, 200, 550), dpi=400, sharpen=False,
+                    locate=False):
+    """
+    File-path wrapper around crop_roi_pdf_bytes (used by preview-roi-pdf.py).
+    bbox uses PyMuPDF page coordinates in points (1/72 inch), origin at top-left:
+      (x0, y0, x1, y1)
+    """
+    with open(in_pdf_path, "rb") as f:
+        data = crop_roi_pdf_bytes(f.read(), page_number=page_number, bbox=bbox, dpi=dpi, sharpen=sharpen,
+                                  locate=locate)
+    with open(out_pdf_path, "wb") as f:
+        f.write(data)
     return out_pdf_path